@@ -1,13 +1,27 @@
 import streamlit as st
-import requests
+import functools
+import html
+import math
+import os
+import re
+import secrets
 import time
-from datetime import datetime
-import threading
-import copy
-import random
 import logging
 import streamlit.components.v1 as components
 
+from runninghub.api import is_timeout_error, get_connection_stats
+from runninghub.blob_store import content_digest, get_blob_store
+from runninghub.board import get_board
+from runninghub.config import MAX_RETRIES, INGEST_ROOTS, INTERACTIVE_MAX_BATCH
+from runninghub.engine import get_engine
+from runninghub.export import export_zip, result_files
+from runninghub.images import get_image_cache
+from runninghub.ingest import (
+    ARCHIVE_TYPES, iter_source, resolve_ingest_path, spool_upload,
+    start_ingest, session_jobs, cancel_session_jobs,
+)
+from runninghub.tasks import WatermarkTask, LightingTask, PoseTask, EnhanceTask
+
 # --- 1. 页面配置和全局设置 ---
 
 st.set_page_config(
@@ -22,68 +36,10 @@ logging.getLogger("tornado.access").setLevel(logging.ERROR)
 logging.getLogger("tornado.application").setLevel(logging.ERROR)
 logging.getLogger("tornado.general").setLevel(logging.ERROR)
 
-# API配置 - 去水印
-WATERMARK_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
-WATERMARK_WEBAPP_ID = "1986469254155403266"
-WATERMARK_NODE_INFO = [
-    {"nodeId": "191", "fieldName": "image", "fieldValue": "placeholder.jpg", "description": "image"}
-]
-
-# API配置 - 溶图打光
-LIGHTING_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
-LIGHTING_WEBAPP_ID = "1985718229576425473"
-LIGHTING_NODE_INFO = [
-    {"nodeId": "437", "fieldName": "image", "fieldValue": "placeholder.png", "description": "image"}
-]
-
-# API配置 - 姿态迁移
-POSE_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
-POSE_WEBAPP_ID = "1975745173911154689"
-POSE_NODE_INFO = [
-    {"nodeId": "245", "fieldName": "image", "fieldValue": "placeholder.png", "description": "角色图片"},
-    {"nodeId": "244", "fieldName": "image", "fieldValue": "placeholder.png", "description": "姿势参考图"}
-]
-
-# API配置 - 图像优化 WAN 2.2（当前版本）
-ENHANCE_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
-ENHANCE_WEBAPP_ID_V2_2 = "1986501194824773634"
-ENHANCE_NODE_INFO_V2_2 = [
-    {"nodeId": "14", "fieldName": "image", "fieldValue": "placeholder.jpg", "description": "image"}
-]
-
-# API配置 - 图像优化 WAN 2.1
-ENHANCE_WEBAPP_ID_V2_1 = "1947599512657453057"
-ENHANCE_NODE_INFO_V2_1 = [
-    {"nodeId": "38", "fieldName": "image", "fieldValue": "placeholder.png", "description": "图片输入"},
-    {"nodeId": "60", "fieldName": "text", "fieldValue": "8k, high quality, high detail", "description": "正向提示词补充"},
-    {"nodeId": "4", "fieldName": "text", "fieldValue": "色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走", "description": "反向提示词"}
-]
-
-# 系统配置 - 全局并发限制
-MAX_CONCURRENT = 5  # 全局最大并发数
-MAX_RETRIES = 3
-POLL_INTERVAL = 4
-MAX_POLL_COUNT = 240
+# 界面配置（接口与并发配置见 runninghub/config.py）
 AUTO_REFRESH_INTERVAL = 7
 DISPLAY_TIMEOUT_MINUTES = 5
-ACTUAL_TIMEOUT_MINUTES = 20
-
-# 超时配置
-UPLOAD_TIMEOUT = 120
-RUN_TASK_TIMEOUT = 60  
-STATUS_CHECK_TIMEOUT = 25
-OUTPUT_FETCH_TIMEOUT = 90
-IMAGE_DOWNLOAD_TIMEOUT = 120
-
-# 错误关键词
-CONCURRENT_LIMIT_ERRORS = [
-    "concurrent limit", "too many requests", "rate limit",
-    "队列已满", "并发限制", "服务忙碌", "CONCURRENT_LIMIT_EXCEEDED", "TOO_MANY_REQUESTS"
-]
-
-TIMEOUT_ERRORS = [
-    "read timed out", "connection timeout", "timeout", "timed out"
-]
+TASK_PAGE_SIZE = 20  # 任务列表每页显示的任务数
 
 # --- 2. CSS样式 ---
 st.markdown("""
@@ -106,6 +62,14 @@ st.markdown("""
     .lighting-task-card { border-left: 4px solid #ff6b35; }
     .pose-task-card { border-left: 4px solid #28a745; }
     .enhance-task-card { border-left: 4px solid #fd7e14; }
+    .task-header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 0.3rem; }
+    .task-progress { background: #e9ecef; border-radius: 4px; height: 6px; margin: 0.4rem 0 0.2rem 0; overflow: hidden; }
+    .task-progress > div { background: #fd7e14; height: 100%; }
+    .task-message { padding: 0.4rem 0.6rem; border-radius: 6px; margin: 0.3rem 0; font-size: 0.9em; }
+    .task-message.success { background: #d4edda; color: #155724; }
+    .task-message.error { background: #f8d7da; color: #721c24; }
+    .task-message.warning { background: #fff3cd; color: #856404; }
+    .page-info { text-align: center; color: #6c757d; font-size: 0.9em; padding-top: 0.5rem; }
     .success-badge { color: #28a745; font-weight: 600; }
     .error-badge { color: #dc3545; font-weight: 600; }
     .processing-badge { color: #fd7e14; font-weight: 600; }
@@ -246,9 +210,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 3. Session State管理 ---
+# secrets.token_urlsafe(16) 生成的会话ID：22 个 URL 安全字符
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{22}")
+
 def get_session_key():
     if 'session_id' not in st.session_state:
-        st.session_state.session_id = f"s_{int(time.time())}_{random.randint(100, 999)}"
+        # 会话ID保存在地址栏参数中，刷新页面或服务重启后可以恢复任务列表。
+        # 持有会话ID即可查看、下载该会话的任务结果，因此使用不可猜测的随机值，不符合格式的参数重新生成
+        session_id = st.query_params.get("sid")
+        if not session_id or not SESSION_ID_PATTERN.fullmatch(session_id):
+            session_id = secrets.token_urlsafe(16)
+            st.query_params["sid"] = session_id
+        st.session_state.session_id = session_id
     return st.session_state.session_id
 
 def clear_ui_state():
@@ -259,6 +232,7 @@ def clear_ui_state():
     st.session_state.pose_uploader_key += 1
     st.session_state.enhance_uploader_key += 1
     st.session_state.upload_success = False
+    st.session_state.upload_digests = {}
     st.session_state.need_ui_refresh = True
 
 def clear_single_upload_delayed():
@@ -286,10 +260,8 @@ def handle_delayed_clear():
 # 初始化Session State
 if 'selected_function' not in st.session_state:
     st.session_state.selected_function = "图像优化"  # 默认选择图像优化
-if 'tasks' not in st.session_state:
-    st.session_state.tasks = []
-if 'task_counter' not in st.session_state:
-    st.session_state.task_counter = 0
+if 'task_board' not in st.session_state:
+    st.session_state.task_board = get_board(get_session_key(), lambda: get_engine().restore_session(get_session_key()))
 # 为每个功能创建独立的文件上传器key
 if 'watermark_uploader_key' not in st.session_state:
     st.session_state.watermark_uploader_key = 0
@@ -301,10 +273,12 @@ if 'enhance_uploader_key' not in st.session_state:
     st.session_state.enhance_uploader_key = 0
 if 'upload_success' not in st.session_state:
     st.session_state.upload_success = False
+if 'task_page' not in st.session_state:
+    st.session_state.task_page = 1
+if 'upload_digests' not in st.session_state:
+    st.session_state.upload_digests = {}  # 上传文件 file_id -> 内容哈希
 if 'download_clicked' not in st.session_state:
     st.session_state.download_clicked = {}
-if 'task_queue' not in st.session_state:
-    st.session_state.task_queue = []
 if 'need_single_clear' not in st.session_state:
     st.session_state.need_single_clear = False
 if 'clear_message' not in st.session_state:
@@ -314,499 +288,50 @@ if 'need_ui_refresh' not in st.session_state:
 if 'enhance_version' not in st.session_state:
     st.session_state.enhance_version = "WAN 2.2"  # 默认使用 WAN 2.2
 
-# --- 4. 任务类 ---
-class TaskItem:
-    def __init__(self, task_id, task_type, session_id, **kwargs):
-        self.task_id = task_id
-        self.task_type = task_type  # "watermark", "lighting", "pose" 或 "enhance"
-        self.session_id = session_id
-        
-        # 去水印专用属性
-        if task_type == "watermark":
-            self.file_data = kwargs.get('file_data')
-            self.file_name = kwargs.get('file_name')
-            self.result_data = None
-        
-        # 溶图打光专用属性
-        elif task_type == "lighting":
-            self.file_data = kwargs.get('file_data')
-            self.file_name = kwargs.get('file_name')
-            self.result_data = None
-        
-        # 姿态迁移专用属性
-        elif task_type == "pose":
-            self.character_image_data = kwargs.get('character_image_data')
-            self.character_image_name = kwargs.get('character_image_name')
-            self.reference_image_data = kwargs.get('reference_image_data')
-            self.reference_image_name = kwargs.get('reference_image_name')
-            self.result_data_list = []
-        
-        # 图像优化专用属性
-        elif task_type == "enhance":
-            self.file_data = kwargs.get('file_data')
-            self.file_name = kwargs.get('file_name')
-            self.enhance_version = kwargs.get('enhance_version', 'WAN 2.2')  # 默认 WAN 2.2
-            self.result_data = None
-        
-        # 通用属性
-        self.status = "QUEUED"
-        self.progress = 0
-        self.error_message = None
-        self.api_task_id = None
-        self.created_at = datetime.now()
-        self.start_time = None
-        self.elapsed_time = None
-        self.retry_count = 0
-        self.timeout_count = 0
-
-# --- 5. 核心API函数 ---
-def is_concurrent_limit_error(error_msg):
-    error_lower = error_msg.lower()
-    return any(keyword in error_lower for keyword in CONCURRENT_LIMIT_ERRORS)
-
-def is_timeout_error(error_msg):
-    error_lower = error_msg.lower()
-    return any(keyword in error_lower for keyword in TIMEOUT_ERRORS)
-
-def upload_file_with_retry(file_data, file_name, api_key, max_retries=3):
-    for attempt in range(max_retries):
-        try:
-            url = 'https://www.runninghub.cn/task/openapi/upload'
-            files = {'file': (file_name, file_data)}
-            data = {'apiKey': api_key, 'fileType': 'image'}
-            
-            response = requests.post(url, files=files, data=data, timeout=UPLOAD_TIMEOUT)
-            response.raise_for_status()
-            
-            result = response.json()
-            if result.get("code") == 0:
-                return result['data']['fileName']
-            else:
-                raise Exception(f"上传失败: {result.get('msg', '未知错误')}")
-                
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                time.sleep((attempt + 1) * 2)
-                continue
-            else:
-                raise Exception(f"上传超时，已重试{max_retries}次")
-        except Exception as e:
-            if attempt < max_retries - 1 and is_timeout_error(str(e)):
-                time.sleep((attempt + 1) * 2)
-                continue
-            else:
-                raise
-
-def run_task_with_retry(api_key, webapp_id, node_info_list, max_retries=3, instance_type=None):
-    for attempt in range(max_retries):
-        try:
-            url = 'https://www.runninghub.cn/task/openapi/ai-app/run'
-            headers = {'Host': 'www.runninghub.cn', 'Content-Type': 'application/json'}
-            payload = {
-                "apiKey": api_key, 
-                "webappId": webapp_id, 
-                "nodeInfoList": node_info_list
-            }
-            
-            # 只在需要时添加 instanceType
-            if instance_type:
-                payload["instanceType"] = instance_type
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=RUN_TASK_TIMEOUT)
-            response.raise_for_status()
-            
-            result = response.json()
-            if result.get("code") != 0:
-                raise Exception(f"任务发起失败: {result.get('msg', '未知错误')}")
-            return result['data']['taskId']
-            
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                time.sleep((attempt + 1) * 3)
-                continue
-            else:
-                raise Exception(f"启动任务超时，已重试{max_retries}次")
-        except Exception as e:
-            if attempt < max_retries - 1 and is_timeout_error(str(e)):
-                time.sleep((attempt + 1) * 3)
-                continue
-            else:
-                raise
-
-def get_task_status(api_key, task_id):
-    try:
-        url = 'https://www.runninghub.cn/task/openapi/status'
-        response = requests.post(url, json={'apiKey': api_key, 'taskId': task_id}, timeout=STATUS_CHECK_TIMEOUT)
-        response.raise_for_status()
-        return response.json().get('data')
-    except requests.exceptions.Timeout:
-        return "CHECKING"
-    except:
-        return "UNKNOWN"
-
-def fetch_task_outputs(api_key, task_id, task_type="watermark"):
-    """获取任务结果"""
-    try:
-        url = 'https://www.runninghub.cn/task/openapi/outputs'
-        response = requests.post(url, json={'apiKey': api_key, 'taskId': task_id}, timeout=OUTPUT_FETCH_TIMEOUT)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get("code") == 0 and data.get("data"):
-            if task_type == "pose":
-                # 姿态迁移 - 支持多个输出
-                file_urls = []
-                for output_item in data["data"]:
-                    file_url = output_item.get("fileUrl")
-                    if file_url:
-                        file_urls.append(file_url)
-                if file_urls:
-                    return file_urls
-            else:
-                # 去水印、溶图打光和图像优化 - 单个输出
-                file_url = data["data"][0].get("fileUrl")
-                if file_url:
-                    return file_url
-            
-        raise Exception(f"获取结果失败: {data.get('msg', '未找到结果')}")
-        
-    except requests.exceptions.Timeout:
-        raise Exception("获取结果超时，请稍后重试")
-
-def download_result_image(url):
-    try:
-        response = requests.get(url, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT)
-        response.raise_for_status()
-        return response.content
-    except requests.exceptions.Timeout:
-        raise Exception("下载图片超时")
-
-# --- 6. 任务处理逻辑 ---
-def process_watermark_task(task):
-    """处理去水印任务"""
-    api_key = WATERMARK_API_KEY
-    webapp_id = WATERMARK_WEBAPP_ID
-    node_info = WATERMARK_NODE_INFO
-
-    try:
-        task.progress = 15
-        uploaded_filename = upload_file_with_retry(task.file_data, task.file_name, api_key)
-
-        task.progress = 25
-        node_info_list = copy.deepcopy(node_info)
-        for node in node_info_list:
-            if node["nodeId"] == "191":
-                node["fieldValue"] = uploaded_filename
-
-        task.progress = 35
-        task.api_task_id = run_task_with_retry(api_key, webapp_id, node_info_list)
-
-        poll_count = 0
-        while poll_count < MAX_POLL_COUNT:
-            time.sleep(POLL_INTERVAL)
-            poll_count += 1
-
-            status = get_task_status(api_key, task.api_task_id)
-            task.progress = min(90, 35 + (55 * poll_count / MAX_POLL_COUNT))
-
-            if status == "SUCCESS":
-                break
-            elif status == "FAILED":
-                raise Exception("API任务处理失败")
-
-        if poll_count >= MAX_POLL_COUNT:
-            raise Exception(f"任务超时 (>{ACTUAL_TIMEOUT_MINUTES}分钟)")
-
-        task.progress = 95
-        result_url = fetch_task_outputs(api_key, task.api_task_id, "watermark")
-        task.result_data = download_result_image(result_url)
-
-        task.progress = 100
-        task.status = "SUCCESS"
-
-    except Exception as e:
-        handle_task_error(task, e)
-
-def process_lighting_task(task):
-    """处理溶图打光任务"""
-    api_key = LIGHTING_API_KEY
-    webapp_id = LIGHTING_WEBAPP_ID
-    node_info = LIGHTING_NODE_INFO
-
-    try:
-        task.progress = 15
-        uploaded_filename = upload_file_with_retry(task.file_data, task.file_name, api_key)
-
-        task.progress = 25
-        node_info_list = copy.deepcopy(node_info)
-        for node in node_info_list:
-            if node["nodeId"] == "437":
-                node["fieldValue"] = uploaded_filename
-
-        task.progress = 35
-        task.api_task_id = run_task_with_retry(api_key, webapp_id, node_info_list, instance_type="plus")
-
-        poll_count = 0
-        while poll_count < MAX_POLL_COUNT:
-            time.sleep(POLL_INTERVAL)
-            poll_count += 1
-
-            status = get_task_status(api_key, task.api_task_id)
-            task.progress = min(90, 35 + (55 * poll_count / MAX_POLL_COUNT))
-
-            if status == "SUCCESS":
-                break
-            elif status == "FAILED":
-                raise Exception("API任务处理失败")
-
-        if poll_count >= MAX_POLL_COUNT:
-            raise Exception(f"任务超时 (>{ACTUAL_TIMEOUT_MINUTES}分钟)")
-
-        task.progress = 95
-        result_url = fetch_task_outputs(api_key, task.api_task_id, "lighting")
-        task.result_data = download_result_image(result_url)
-
-        task.progress = 100
-        task.status = "SUCCESS"
-
-    except Exception as e:
-        handle_task_error(task, e)
-
-def process_pose_task(task):
-    """处理姿态迁移任务"""
-    api_key = POSE_API_KEY
-    webapp_id = POSE_WEBAPP_ID
-    node_info = POSE_NODE_INFO
-
-    try:
-        # 上传角色图片
-        task.progress = 10
-        character_uploaded_filename = upload_file_with_retry(
-            task.character_image_data, task.character_image_name, api_key)
-
-        # 上传姿势参考图
-        task.progress = 20
-        reference_uploaded_filename = upload_file_with_retry(
-            task.reference_image_data, task.reference_image_name, api_key)
-
-        # 构建节点信息
-        task.progress = 25
-        node_info_list = copy.deepcopy(node_info)
-        for node in node_info_list:
-            if node["nodeId"] == "245":  # 角色图片
-                node["fieldValue"] = character_uploaded_filename
-            elif node["nodeId"] == "244":  # 姿势参考图
-                node["fieldValue"] = reference_uploaded_filename
-
-        task.progress = 35
-        task.api_task_id = run_task_with_retry(api_key, webapp_id, node_info_list)
-
-        # 轮询状态
-        poll_count = 0
-        consecutive_timeouts = 0
-        
-        while poll_count < MAX_POLL_COUNT:
-            time.sleep(POLL_INTERVAL)
-            poll_count += 1
-
-            status = get_task_status(api_key, task.api_task_id)
-            task.progress = min(90, 35 + (55 * poll_count / MAX_POLL_COUNT))
-
-            if status == "SUCCESS":
-                break
-            elif status == "FAILED":
-                raise Exception("API任务处理失败")
-            elif status in ["CHECKING", "UNKNOWN"]:
-                consecutive_timeouts += 1
-                if consecutive_timeouts > 3:
-                    time.sleep(POLL_INTERVAL * 2)
-                    consecutive_timeouts = 0
-            else:
-                consecutive_timeouts = 0
-
-        if poll_count >= MAX_POLL_COUNT:
-            raise Exception(f"任务处理超时 (>{ACTUAL_TIMEOUT_MINUTES}分钟)")
-
-        # 获取多个结果
-        task.progress = 95
-        result_urls = fetch_task_outputs(api_key, task.api_task_id, "pose")
-        
-        # 下载所有结果图片
-        task.result_data_list = []
-        for i, url in enumerate(result_urls):
-            image_data = download_result_image(url)
-            task.result_data_list.append({
-                'data': image_data,
-                'filename': f"pose_result_{i+1}_{task.character_image_name}",
-                'url': url
-            })
-
-        task.progress = 100
-        task.status = "SUCCESS"
-
-    except Exception as e:
-        handle_task_error(task, e)
-
-def process_enhance_task(task):
-    """处理图像优化任务（支持 WAN 2.1 和 WAN 2.2）"""
-    api_key = ENHANCE_API_KEY
-
-    # 根据版本选择不同的配置
-    if task.enhance_version == "WAN 2.1":
-        webapp_id = ENHANCE_WEBAPP_ID_V2_1
-        node_info = ENHANCE_NODE_INFO_V2_1
-        image_node_id = "38"
-    else:  # WAN 2.2
-        webapp_id = ENHANCE_WEBAPP_ID_V2_2
-        node_info = ENHANCE_NODE_INFO_V2_2
-        image_node_id = "14"
-
-    try:
-        task.progress = 15
-        uploaded_filename = upload_file_with_retry(task.file_data, task.file_name, api_key)
-
-        task.progress = 25
-        node_info_list = copy.deepcopy(node_info)
-        for node in node_info_list:
-            if node["nodeId"] == image_node_id:
-                node["fieldValue"] = uploaded_filename
-
-        task.progress = 35
-        task.api_task_id = run_task_with_retry(api_key, webapp_id, node_info_list)
-
-        poll_count = 0
-        while poll_count < MAX_POLL_COUNT:
-            time.sleep(POLL_INTERVAL)
-            poll_count += 1
-
-            status = get_task_status(api_key, task.api_task_id)
-            task.progress = min(90, 35 + (55 * poll_count / MAX_POLL_COUNT))
-
-            if status == "SUCCESS":
-                break
-            elif status == "FAILED":
-                raise Exception("API任务处理失败")
-
-        if poll_count >= MAX_POLL_COUNT:
-            raise Exception(f"任务超时 (>{ACTUAL_TIMEOUT_MINUTES}分钟)")
-
-        task.progress = 95
-        result_url = fetch_task_outputs(api_key, task.api_task_id, "enhance")
-        task.result_data = download_result_image(result_url)
-
-        task.progress = 100
-        task.status = "SUCCESS"
-
-    except Exception as e:
-        handle_task_error(task, e)
-
-def handle_task_error(task, error):
-    """统一处理任务错误"""
-    error_msg = str(error)
-    task.elapsed_time = time.time() - task.start_time if task.start_time else 0
-
-    is_timeout = is_timeout_error(error_msg)
-    is_concurrent = is_concurrent_limit_error(error_msg)
-
-    if is_timeout:
-        task.timeout_count += 1
-        
-    if ((is_concurrent or is_timeout) and task.retry_count < MAX_RETRIES):
-        task.retry_count += 1
-        task.status = "QUEUED"
-        task.progress = 0
-        
-        if is_timeout:
-            delay = (task.timeout_count * 10) + random.randint(5, 15)
-        else:
-            delay = (2 ** task.retry_count) + random.randint(1, 3)
-        
-        time.sleep(delay)
-        st.session_state.task_queue.append(task)
-    else:
-        task.status = "FAILED"
-        task.error_message = error_msg[:150]
-
-def process_single_task(task):
-    """处理单个任务的统一入口"""
-    task.status = "PROCESSING"
-    task.start_time = time.time()
-
-    if task.task_type == "watermark":
-        process_watermark_task(task)
-    elif task.task_type == "lighting":
-        process_lighting_task(task)
-    elif task.task_type == "pose":
-        process_pose_task(task)
-    elif task.task_type == "enhance":
-        process_enhance_task(task)
-    
-    if task.status == "SUCCESS":
-        task.elapsed_time = time.time() - task.start_time
-
-# --- 7. 队列管理 ---
+# --- 4. 队列管理 ---
+# 任务类、接口调用和执行引擎位于 runninghub 包内，进程内所有会话共享同一个引擎；
+# 页面只负责提交任务和读取任务状态
 def get_stats():
-    processing_count = sum(1 for t in st.session_state.tasks if t.status == "PROCESSING")
-    queued_count = len(st.session_state.task_queue) + sum(1 for t in st.session_state.tasks if t.status == "QUEUED")
-    success_count = sum(1 for t in st.session_state.tasks if t.status == "SUCCESS")
-    failed_count = sum(1 for t in st.session_state.tasks if t.status == "FAILED")
-    
-    # 分类统计
-    watermark_count = sum(1 for t in st.session_state.tasks if t.task_type == "watermark")
-    lighting_count = sum(1 for t in st.session_state.tasks if t.task_type == "lighting")
-    pose_count = sum(1 for t in st.session_state.tasks if t.task_type == "pose")
-    enhance_count = sum(1 for t in st.session_state.tasks if t.task_type == "enhance")
-    
-    return {
-        'processing': processing_count,
-        'queued': queued_count,
-        'success': success_count,
-        'failed': failed_count,
-        'total': len(st.session_state.tasks),
-        'watermark': watermark_count,
-        'lighting': lighting_count,
-        'pose': pose_count,
-        'enhance': enhance_count
-    }
+    """任务统计，由任务面板在状态变更时增量维护"""
+    return st.session_state.task_board.stats()
+
+def submit_task(task):
+    """登记任务并交给后台引擎处理"""
+    st.session_state.task_board.add(task)
+    get_engine().submit(task)
+
+def has_pending_work():
+    """有排队、处理中的任务或正在进行的批量导入"""
+    return (st.session_state.task_board.has_active()
+            or any(not job.finished for job in session_jobs(get_session_key())))
+
+# --- 5. 图片预览组件（仅用于图像优化）---
+def upload_digest(image_file):
+    """上传文件的内容哈希；同一次上传（file_id 不变）只计算一次"""
+    digests = st.session_state.upload_digests
+    digest = digests.get(image_file.file_id)
+    if digest is None:
+        digest = digests[image_file.file_id] = content_digest(image_file.getbuffer())
+    return digest
 
-def start_new_tasks():
-    stats = get_stats()
-    available_slots = MAX_CONCURRENT - stats['processing']
-    
-    if available_slots <= 0:
-        return
-    
-    for _ in range(min(available_slots, len(st.session_state.task_queue))):
-        if st.session_state.task_queue:
-            task = st.session_state.task_queue.pop(0)
-            
-            thread = threading.Thread(target=process_single_task, args=(task,))
-            thread.daemon = True
-            thread.start()
-
-# --- 8. 图片预览组件（仅用于图像优化）---
 def show_image_preview_for_enhance(image_file, caption_text):
-    """仅用于图像优化的图片预览"""
+    """仅用于图像优化的图片预览（显示缓存的缩略图，不发送原图）"""
     if image_file:
+        digest = upload_digest(image_file)
+        image_cache = get_image_cache()
+
         st.markdown('<div class="image-preview-container enhance-preview">', unsafe_allow_html=True)
-        st.image(image_file, caption=caption_text, use_container_width=False)
-        
-        try:
-            from PIL import Image
-            import io
-            
-            img = Image.open(io.BytesIO(image_file.getvalue()))
-            width, height = img.size
-            file_size = len(image_file.getvalue()) / 1024
-            
+        st.image(image_cache.thumbnail(digest, image_file) or image_file, caption=caption_text, use_container_width=False)
+
+        info = image_cache.info(digest, image_file)
+        file_size = image_file.size / 1024
+        if info:
             st.markdown(f'''
             <div class="preview-caption">
-                📏 尺寸: {width} × {height} px | 📦 大小: {file_size:.1f} KB
+                📏 尺寸: {info.width} × {info.height} px | 📦 大小: {file_size:.1f} KB
             </div>
             ''', unsafe_allow_html=True)
-            
-        except Exception as e:
-            file_size = len(image_file.getvalue()) / 1024
+        else:
             st.markdown(f'''
             <div class="preview-caption">
                 📦 大小: {file_size:.1f} KB
@@ -816,31 +341,24 @@ def show_image_preview_for_enhance(image_file, caption_text):
         st.markdown('</div>', unsafe_allow_html=True)
 
 def show_file_info(image_file, file_type="image"):
-    """显示文件信息（替代图片预览）"""
+    """显示文件信息（替代图片预览），尺寸只读取文件头并在所有会话间缓存"""
     if image_file:
-        try:
-            from PIL import Image
-            import io
-            
-            # 尝试获取图片尺寸
-            img = Image.open(io.BytesIO(image_file.getvalue()))
-            width, height = img.size
-            file_size = len(image_file.getvalue()) / 1024
-            
+        info = get_image_cache().info(upload_digest(image_file), image_file)
+        file_size = image_file.size / 1024
+
+        if info:
             st.markdown(f'''
             <div class="file-info">
                 <div class="file-name">📄 {image_file.name}</div>
                 <div class="file-details">
-                    📏 尺寸: {width} × {height} px | 
+                    📏 尺寸: {info.width} × {info.height} px | 
                     📦 大小: {file_size:.1f} KB | 
                     🎨 格式: {image_file.type}
                 </div>
             </div>
             ''', unsafe_allow_html=True)
-            
-        except Exception as e:
+        else:
             # 如果无法读取图片信息，显示基本信息
-            file_size = len(image_file.getvalue()) / 1024
             st.markdown(f'''
             <div class="file-info">
                 <div class="file-name">📄 {image_file.name}</div>
@@ -851,19 +369,17 @@ def show_file_info(image_file, file_type="image"):
             </div>
             ''', unsafe_allow_html=True)
 
-# --- 9. 下载按钮组件 ---
+# --- 6. 下载按钮组件 ---
 def create_download_buttons(task):
     """创建下载按钮"""
     if task.task_type == "pose" and task.result_data_list:
-        st.markdown("### 📥 下载结果")
-        
         if len(task.result_data_list) == 1:
             result = task.result_data_list[0]
-            file_size = len(result['data']) / 1024
+            file_size = result['blob'].size / 1024
             
             st.download_button(
                 label=f"📥 下载结果 ({file_size:.1f}KB)",
-                data=result['data'],
+                data=result['blob'].read,  # 点击下载时才从磁盘读取
                 file_name=result['filename'],
                 mime="image/png",
                 key=f"download_{task.task_id}",
@@ -875,11 +391,11 @@ def create_download_buttons(task):
             for i, result in enumerate(task.result_data_list):
                 col_idx = i % len(cols)
                 with cols[col_idx]:
-                    file_size = len(result['data']) / 1024
+                    file_size = result['blob'].size / 1024
                     
                     st.download_button(
                         label=f"📥 结果{i+1} ({file_size:.1f}KB)",
-                        data=result['data'],
+                        data=result['blob'].read,
                         file_name=result['filename'],
                         mime="image/png",
                         key=f"download_{task.task_id}_{i}",
@@ -887,28 +403,26 @@ def create_download_buttons(task):
                     )
     
     elif task.task_type in ["watermark", "lighting", "enhance"] and task.result_data:
-        file_size = len(task.result_data) / 1024
+        file_size = task.result_data.size / 1024
         
         if task.task_type == "watermark":
             button_text = f"📥 下载去水印结果 ({file_size:.1f}KB)"
-            file_prefix = "watermark_removed_"
         elif task.task_type == "lighting":
             button_text = f"📥 下载溶图打光结果 ({file_size:.1f}KB)"
-            file_prefix = "lighting_"
         else:
             button_text = f"📥 下载优化结果 ({file_size:.1f}KB)"
-            file_prefix = "optimized_"
-        
+        file_name, blob = result_files(task)[0]
+
         st.download_button(
             label=button_text,
-            data=task.result_data,
-            file_name=f"{file_prefix}{task.file_name}",
+            data=blob.read,
+            file_name=file_name,
             mime="image/png",
             key=f"download_{task.task_id}",
             use_container_width=True
         )
 
-# --- 10. 功能界面 ---
+# --- 7. 功能界面 ---
 def render_watermark_interface():
     """去水印界面（使用延迟清空策略）"""
     st.markdown("### 🚿 去水印")
@@ -957,16 +471,13 @@ def render_watermark_interface():
     if start_processing:
         if uploaded_image:
             with st.spinner('添加去水印任务到队列...'):
-                st.session_state.task_counter += 1
-                task = TaskItem(
-                    st.session_state.task_counter, 
-                    "watermark",
+                task = WatermarkTask(
+                    st.session_state.task_board.next_task_id(),
                     get_session_key(),
-                    file_data=uploaded_image.getvalue(),
+                    file_data=get_blob_store().write_file(uploaded_image),
                     file_name=uploaded_image.name
                 )
-                st.session_state.tasks.append(task)
-                st.session_state.task_queue.append(task)
+                submit_task(task)
 
             # 使用延迟清空策略：先标记成功，延迟清空UI
             st.session_state.upload_success = True
@@ -1024,16 +535,13 @@ def render_lighting_interface():
     if start_processing:
         if uploaded_image:
             with st.spinner('添加溶图打光任务到队列...'):
-                st.session_state.task_counter += 1
-                task = TaskItem(
-                    st.session_state.task_counter, 
-                    "lighting",
+                task = LightingTask(
+                    st.session_state.task_board.next_task_id(),
                     get_session_key(),
-                    file_data=uploaded_image.getvalue(),
+                    file_data=get_blob_store().write_file(uploaded_image),
                     file_name=uploaded_image.name
                 )
-                st.session_state.tasks.append(task)
-                st.session_state.task_queue.append(task)
+                submit_task(task)
 
             # 使用延迟清空策略：先标记成功，延迟清空UI
             st.session_state.upload_success = True
@@ -1108,18 +616,15 @@ def render_pose_interface():
     if start_processing:
         if character_image and reference_image:
             with st.spinner('添加任务到队列...'):
-                st.session_state.task_counter += 1
-                task = TaskItem(
-                    st.session_state.task_counter, 
-                    "pose",
+                task = PoseTask(
+                    st.session_state.task_board.next_task_id(),
                     get_session_key(),
-                    character_image_data=character_image.getvalue(),
+                    character_image_data=get_blob_store().write_file(character_image),
                     character_image_name=character_image.name,
-                    reference_image_data=reference_image.getvalue(),
+                    reference_image_data=get_blob_store().write_file(reference_image),
                     reference_image_name=reference_image.name
                 )
-                st.session_state.tasks.append(task)
-                st.session_state.task_queue.append(task)
+                submit_task(task)
 
             # 使用延迟清空策略：先标记成功，延迟清空UI
             st.session_state.upload_success = True
@@ -1187,26 +692,330 @@ def render_enhance_interface():
             for i, file in enumerate(uploaded_files, 1):
                 show_file_info(file, f"file_{i}")
 
-        # 自动添加到队列（包含版本信息）
+        # 自动添加到队列（包含版本信息），一次添加多张时进入批量通道，不挤占单张任务
+        lane = "bulk" if len(uploaded_files) > INTERACTIVE_MAX_BATCH else "interactive"
         with st.spinner(f'添加 {len(uploaded_files)} 个文件...'):
             for file in uploaded_files:
-                st.session_state.task_counter += 1
-                task = TaskItem(
-                    st.session_state.task_counter,
-                    "enhance",
+                task = EnhanceTask(
+                    st.session_state.task_board.next_task_id(),
                     get_session_key(),
-                    file_data=file.getvalue(),
+                    file_data=get_blob_store().write_file(file),
                     file_name=file.name,
-                    enhance_version=st.session_state.enhance_version  # 传入版本信息
+                    enhance_version=st.session_state.enhance_version,  # 传入版本信息
+                    lane=lane
                 )
-                st.session_state.tasks.append(task)
-                st.session_state.task_queue.append(task)
+                submit_task(task)
 
             st.session_state.upload_success = True
             st.session_state.enhance_uploader_key += 1
             st.rerun()
 
-# --- 11. 主界面 ---
+    render_archive_import()
+
+def start_enhance_ingest(source_name, entries, cleanup=None):
+    """在后台逐个导入图片，按当前选择的版本创建图像优化任务"""
+    session_id = get_session_key()
+    enhance_version = st.session_state.enhance_version
+
+    def make_task(task_id, blob, file_name):
+        return EnhanceTask(task_id, session_id, file_data=blob, file_name=file_name, enhance_version=enhance_version,
+                           lane="bulk")
+
+    start_ingest(session_id, source_name, entries, make_task, st.session_state.task_board, get_engine(), cleanup=cleanup)
+    st.session_state.upload_success = True
+
+def render_archive_import():
+    """压缩包 / 服务器目录导入（大批量图片，后台逐个加入队列）"""
+    with st.expander("📦 批量导入（压缩包 / 服务器目录）"):
+        if st.session_state.get('ingest_error'):
+            st.error(f"❌ {st.session_state.ingest_error}")
+            st.session_state.ingest_error = None
+
+        archive = st.file_uploader(
+            "选择 ZIP / TAR 压缩包",
+            type=ARCHIVE_TYPES,
+            help="压缩包中的图片在后台逐个加入处理队列",
+            key=f"enhance_archive_{st.session_state.enhance_uploader_key}"
+        )
+        if archive:
+            path = spool_upload(archive)
+            try:
+                entries = iter_source(path)
+            except Exception as e:
+                os.remove(path)
+                st.session_state.ingest_error = str(e)
+            else:
+                start_enhance_ingest(archive.name, entries, cleanup=functools.partial(os.remove, path))
+            st.session_state.enhance_uploader_key += 1
+            st.rerun()
+
+        # 服务器目录导入仅在配置了 RH_INGEST_ROOTS 时提供
+        if INGEST_ROOTS:
+            server_path = st.text_input("服务器目录或压缩包路径", placeholder=INGEST_ROOTS[0])
+            if st.button("📂 导入", use_container_width=True, disabled=not server_path):
+                try:
+                    real_path = resolve_ingest_path(server_path)
+                    entries = iter_source(real_path)
+                except Exception as e:
+                    st.session_state.ingest_error = str(e)
+                else:
+                    start_enhance_ingest(os.path.basename(real_path) or real_path, entries)
+                st.rerun()
+
+# --- 8. 任务列表 ---
+TASK_TYPE_LABELS = {
+    "watermark": ("🚿", "去水印"),
+    "lighting": ("✨", "溶图打光"),
+    "pose": ("🤸", "姿态迁移"),
+    "enhance": ("🎨", "图像优化"),
+}
+STATUS_BADGES = {
+    "SUCCESS": ("success-badge", "✅ 完成"),
+    "FAILED": ("error-badge", "❌ 失败"),
+    "PROCESSING": ("processing-badge", "⚡ 处理中"),
+    "QUEUED": ("queued-badge", "⏳ 队列中"),
+}
+# 筛选项 -> (状态, board.stats() 中的计数键)
+TASK_FILTERS = {
+    "全部": (None, 'total'),
+    "处理中": ("PROCESSING", 'processing'),
+    "排队中": ("QUEUED", 'queued'),
+    "已完成": ("SUCCESS", 'success'),
+    "失败": ("FAILED", 'failed'),
+}
+
+INGEST_STATUS_TEXT = {
+    "RUNNING": "导入中",
+    "DONE": "导入完成",
+    "CANCELLED": "已停止",
+    "FAILED": "导入失败",
+}
+
+def format_elapsed(seconds):
+    return f"{int(seconds//60)}:{int(seconds%60):02d}"
+
+def render_task_card(task):
+    """任务卡片：文字、状态与进度合并为一个元素，只有完成的任务另加下载按钮"""
+    icon, type_name = TASK_TYPE_LABELS[task.task_type]
+    badge_class, badge_text = STATUS_BADGES.get(task.status, STATUS_BADGES["QUEUED"])
+
+    if task.task_type == "pose":
+        title = f"{icon} {type_name}"
+    elif task.task_type == "enhance":
+        title = f"{icon} {html.escape(task.file_name)} [{task.enhance_version}]"
+    else:
+        title = f"{icon} {html.escape(task.file_name)}"
+
+    lines = []
+    if task.task_type == "pose":
+        lines.append(f'<div class="compact-info">👤 角色: {html.escape(task.character_image_name)}</div>')
+        lines.append(f'<div class="compact-info">🤸 参考: {html.escape(task.reference_image_name)}</div>')
+    if task.retry_count > 0:
+        lines.append(f'<div class="compact-info">🔄 重试 {task.retry_count}/{MAX_RETRIES}</div>')
+    if task.timeout_count > 0:
+        lines.append(f'<div class="compact-info">⏰ 超时 {task.timeout_count}次</div>')
+
+    # 进度显示
+    if task.status == "PROCESSING":
+        progress = int(task.progress)
+        lines.append(f'<div class="task-progress"><div style="width: {progress}%"></div></div>'
+                     f'<div class="compact-info">进度: {progress}%</div>')
+        if task.start_time:
+            lines.append(f'<div class="compact-info real-time">⏱️ 已用时: {format_elapsed(time.time() - task.start_time)}</div>')
+    elif task.status == "QUEUED":
+        if task.retry_at and task.retry_at > time.time():
+            lines.append(f'<div class="compact-info">⏳ {math.ceil(task.retry_at - time.time())} 秒后重试...</div>')
+        else:
+            lines.append('<div class="compact-info">⏳ 等待处理...</div>')
+
+    # 结果处理
+    elif task.status == "SUCCESS":
+        elapsed_str = format_elapsed(task.elapsed_time or 0)
+        if task.task_type == "watermark":
+            message = f"🚿 去水印完成! 用时: {elapsed_str}"
+        elif task.task_type == "lighting":
+            message = f"✨ 溶图打光完成! 用时: {elapsed_str}"
+        elif task.task_type == "pose":
+            message = f"🎉 姿态迁移完成! 用时: {elapsed_str} | 生成了 {len(task.result_data_list)} 个结果"
+        else:
+            message = f"🎉 图像优化完成! 用时: {elapsed_str}"
+        lines.append(f'<div class="task-message success">{message}</div>')
+        if task.cache_hit:
+            lines.append('<div class="compact-info">⚡ 相同图片已处理过，直接复用结果</div>')
+
+    elif task.status == "FAILED":
+        lines.append('<div class="task-message error">💥 处理失败</div>')
+        if task.error_message:
+            if is_timeout_error(task.error_message):
+                lines.append(f'<div class="task-message warning">⏰ 超时错误: 已重试 {task.retry_count} 次</div>')
+            lines.append(f'<div class="compact-info">❌ 错误: {html.escape(task.error_message)}</div>')
+
+    st.markdown(f'''
+    <div class="task-card {task.task_type}-task-card">
+        <div class="task-header">
+            <span><b>{title}</b> <code>#{task.task_id}</code></span>
+            <span class="{badge_class}">{badge_text}</span>
+        </div>
+        {"".join(lines)}
+    </div>
+    ''', unsafe_allow_html=True)
+
+    if task.status == "SUCCESS":
+        create_download_buttons(task)
+
+def task_label(task):
+    name = task.character_image_name if task.task_type == "pose" else task.file_name
+    return f"#{task.task_id} {TASK_TYPE_LABELS[task.task_type][1]} · {name}"
+
+def render_export(board):
+    """打包下载已完成任务的结果（ZIP，点击下载时才生成）
+
+    在定时刷新的任务列表之外渲染；任务选择列表只在勾选"按任务选择"后生成，页面刷新的开销不随已完成任务数增长。
+    """
+    finished_count = board.count("SUCCESS")
+    if not finished_count:
+        return
+
+    with st.expander(f"📦 批量下载（{finished_count} 个已完成任务）"):
+        tasks = None  # None 表示全部已完成任务
+        if st.checkbox("按任务选择", key="export_pick"):
+            by_uid = {task.uid: task for task in board.with_status("SUCCESS")}
+            selected = st.multiselect(
+                "选择任务",
+                list(reversed(by_uid)),
+                format_func=lambda uid: task_label(by_uid[uid]),
+                placeholder="不选择则下载全部已完成任务",
+                key="export_selection",
+            )
+            tasks = [by_uid[uid] for uid in selected if uid in by_uid] or None
+
+        if tasks:
+            files = [blob for task in tasks for _, blob in result_files(task)]
+            total_size = sum(blob.size for blob in files) / 1024 / 1024
+            label = f"📥 下载 {len(tasks)} 个任务的 {len(files)} 个文件 ({total_size:.1f}MB, ZIP)"
+        else:
+            label = f"📥 下载全部 {finished_count} 个已完成任务的结果 (ZIP)"
+
+        st.download_button(
+            label=label,
+            data=lambda: export_zip(tasks or board.with_status("SUCCESS")),  # 点击时才打包
+            file_name=f"runninghub_{time.strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip",
+            key="export_zip",
+            use_container_width=True,
+        )
+
+def render_ingest_job(job):
+    """批量导入进度，跳过的条目折叠显示"""
+    summary = f"📦 {html.escape(job.source_name)}：{INGEST_STATUS_TEXT[job.status]} · 已加入 {job.submitted} 张"
+    if job.skipped:
+        summary += f" · 跳过 {job.skipped} 个"
+    if job.error:
+        summary += f" · {html.escape(job.error)}"
+    if job.skipped_samples:
+        samples = "".join(f"<li>{html.escape(name)}：{reason}</li>" for name, reason in job.skipped_samples)
+        st.markdown(f'<details class="compact-info"><summary>{summary}</summary><ul>{samples}</ul></details>',
+                    unsafe_allow_html=True)
+    else:
+        st.markdown(f'<div class="compact-info">{summary}</div>', unsafe_allow_html=True)
+    if not job.finished:
+        st.button("⏹️ 停止导入", key=f"stop_ingest_{job.id}", on_click=job.cancel)
+
+def set_task_page(page):
+    st.session_state.task_page = page
+
+def render_task_panel(auto_refresh=False):
+    """任务列表：按状态筛选、分页，只渲染当前页的任务
+
+    作为 fragment 运行，有进行中的任务时每 AUTO_REFRESH_INTERVAL 秒只重跑这一部分，
+    侧边栏和上传区不受影响。auto_refresh 表示本次是否带定时刷新。
+    """
+    board = st.session_state.task_board
+    if auto_refresh and not has_pending_work():
+        # 任务全部结束：整页重跑一次，去掉定时刷新并更新页面其他部分
+        st.rerun()
+
+    st.markdown("### 📋 任务列表")
+
+    for job in session_jobs(get_session_key()):
+        render_ingest_job(job)
+
+    if not len(board):
+        st.info("💡 暂无任务，请选择功能并上传文件开始处理")
+        return
+
+    get_engine().sync(board.with_status("QUEUED", "PROCESSING"))
+
+    stats = board.stats()
+    task_filter = st.radio(
+        "筛选",
+        list(TASK_FILTERS),
+        format_func=lambda name: f"{name} ({stats[TASK_FILTERS[name][1]]})",
+        horizontal=True,
+        key="task_filter",
+        on_change=set_task_page,
+        args=(1,),
+        label_visibility="collapsed",
+    )
+    status, _ = TASK_FILTERS[task_filter]
+
+    # 显示当前页任务
+    page = st.session_state.task_page
+    tasks, total = board.window(status, (page - 1) * TASK_PAGE_SIZE, TASK_PAGE_SIZE)
+    pages = max(1, math.ceil(total / TASK_PAGE_SIZE))
+    if page > pages:
+        # 任务被清空或状态变化后当前页已不存在
+        page = pages
+        set_task_page(page)
+        tasks, total = board.window(status, (page - 1) * TASK_PAGE_SIZE, TASK_PAGE_SIZE)
+
+    if not tasks:
+        st.caption("没有符合条件的任务")
+    for task in tasks:
+        render_task_card(task)
+
+    # 翻页
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("⬅️ 上一页", use_container_width=True, disabled=page <= 1,
+                      on_click=set_task_page, args=(page - 1,))
+        with col2:
+            st.markdown(f'<div class="page-info">第 {page}/{pages} 页 · 共 {total} 个任务</div>', unsafe_allow_html=True)
+        with col3:
+            st.button("下一页 ➡️", use_container_width=True, disabled=page >= pages,
+                      on_click=set_task_page, args=(page + 1,))
+
+    st.divider()
+
+    # 操作按钮
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        if st.button("🗑️ 清空所有", use_container_width=True):
+            cancel_session_jobs(get_session_key())
+            get_engine().cancel(board.clear())
+            st.session_state.download_clicked = {}
+            set_task_page(1)
+            st.rerun()
+
+    with col2:
+        if st.button("🔄 重启失败", use_container_width=True):
+            failed_tasks = board.with_status("FAILED")
+            for task in failed_tasks:
+                task.reset_for_retry()
+                get_engine().submit(task)
+            if failed_tasks:
+                st.success(f"✅ 已重启 {len(failed_tasks)} 个失败任务")
+            else:
+                st.info("ℹ️ 没有失败的任务需要重启")
+            st.rerun()
+
+    with col3:
+        if st.button("🔄 强制刷新", use_container_width=True):
+            st.rerun()
+
+# --- 9. 主界面 ---
 def main():
     # 处理延迟清空操作
     handle_delayed_clear()
@@ -1267,6 +1076,43 @@ def main():
 
         st.caption("智能去除图片水印")
 
+        # 连接复用统计
+        conn_stats = get_connection_stats()
+        if conn_stats['requests']:
+            st.divider()
+            st.caption(f"📡 API请求 {conn_stats['requests']} 次 | 新建连接 {conn_stats['connections_opened']} | 复用 {conn_stats['connections_reused']}")
+            engine_stats = get_engine().stats()
+            st.caption(f"🔍 状态查询 {engine_stats['status_calls']} 次 | 按历史耗时节省 {engine_stats['status_calls_saved']} 次")
+            uploads = engine_stats['uploads']
+            if uploads['uploads']:
+                st.caption(f"🗜️ 上传 {uploads['uploads']} 张（预处理 {uploads['preprocessed']}）| "
+                           f"{uploads['bytes_before'] / 1024 / 1024:.1f}MB → {uploads['bytes_after'] / 1024 / 1024:.1f}MB | "
+                           f"平均上传 {uploads['avg_upload_seconds_before']:.1f}s → {uploads['avg_upload_seconds']:.1f}s")
+            stages = engine_stats['stages']
+            st.caption(f"⏫ 上传 {stages['upload']} | 🛰️ 远端运行 {stages['remote']} | ⏬ 下载 {stages['download']} | "
+                       f"⏳ 等待重试 {engine_stats['queue'].get('delayed', 0)}")
+            lanes = engine_stats['lanes']
+            for lane, label in (("interactive", "⚡ 交互"), ("bulk", "📦 批量")):
+                waiting = sum(lanes[where][lane]['waiting'] for where in ("queue", "upload", "remote"))
+                st.caption(f"{label} 等待 {waiting} | 等待名额 p95 {lanes['remote'][lane]['p95_wait']:.1f}s"
+                           f"（上传 {lanes['upload'][lane]['p95_wait']:.1f}s）")
+            for key_name, usage in engine_stats['limiter'].items():
+                st.caption(f"🔑 {key_name} 并发 {len(usage['holders'])}/{usage['capacity']} | 等待 {sum(usage['waiting'].values())}")
+                adaptive = usage['adaptive']
+                if adaptive['breaker'] == "OPEN":
+                    st.caption(f"🚧 已熔断，{adaptive['reopen_in']:.0f} 秒后试探恢复（错误过多）")
+                elif adaptive['breaker'] == "HALF_OPEN":
+                    st.caption("🚧 熔断试探中，额外放行一个试探任务")
+                else:
+                    st.caption(f"📈 自适应窗口 {adaptive['window']:.1f} | 近期错误率 {adaptive['error_rate']:.0%}")
+
+        # 独立 worker 模式：页面只提交任务，显示共享队列状态
+        engine = get_engine()
+        if not engine.consume:
+            queue_stats = engine.queue.stats()
+            st.divider()
+            st.caption(f"🧵 任务由独立 worker 执行 | 排队 {queue_stats['ready']} | 处理中 {queue_stats['leased']}")
+
     # 主界面布局
     left_col, right_col = st.columns([1.8, 3.2])
 
@@ -1283,146 +1129,16 @@ def main():
 
     # 右侧：任务列表
     with right_col:
-        st.markdown("### 📋 任务列表")
-
-        if not st.session_state.tasks:
-            st.info("💡 暂无任务，请选择功能并上传文件开始处理")
-        else:
-            start_new_tasks()
-
-            # 显示任务
-            for task in reversed(st.session_state.tasks):
-                with st.container():
-                    if task.task_type == "watermark":
-                        task_card_class = "watermark-task-card"
-                    elif task.task_type == "lighting":
-                        task_card_class = "lighting-task-card"
-                    elif task.task_type == "pose":
-                        task_card_class = "pose-task-card"
-                    else:
-                        task_card_class = "enhance-task-card"
-                    
-                    st.markdown(f'<div class="task-card {task_card_class}">', unsafe_allow_html=True)
-
-                    # 任务头部
-                    col1, col2 = st.columns([4, 1])
-
-                    with col1:
-                        if task.task_type == "watermark":
-                            task_type_icon = "🚿"
-                            task_type_name = "去水印"
-                            st.markdown(f"**{task_type_icon} {task.file_name}** `#{task.task_id}`")
-                        elif task.task_type == "lighting":
-                            task_type_icon = "✨"
-                            task_type_name = "溶图打光"
-                            st.markdown(f"**{task_type_icon} {task.file_name}** `#{task.task_id}`")
-                        elif task.task_type == "pose":
-                            task_type_icon = "🤸"
-                            task_type_name = "姿态迁移"
-                            st.markdown(f"**{task_type_icon} {task_type_name}** `#{task.task_id}`")
-                            st.markdown(f'<div class="compact-info">👤 角色: {task.character_image_name}</div>', unsafe_allow_html=True)
-                            st.markdown(f'<div class="compact-info">🤸 参考: {task.reference_image_name}</div>', unsafe_allow_html=True)
-                        else:
-                            task_type_icon = "🎨"
-                            version_tag = f" [{task.enhance_version}]" if hasattr(task, 'enhance_version') else ""
-                            st.markdown(f"**{task_type_icon} {task.file_name}{version_tag}** `#{task.task_id}`")
-
-                        if task.retry_count > 0:
-                            st.markdown(f'<div class="compact-info">🔄 重试 {task.retry_count}/{MAX_RETRIES}</div>', unsafe_allow_html=True)
-                        if task.timeout_count > 0:
-                            st.markdown(f'<div class="compact-info">⏰ 超时 {task.timeout_count}次</div>', unsafe_allow_html=True)
-
-                    with col2:
-                        if task.status == "SUCCESS":
-                            st.markdown('<span class="success-badge">✅ 完成</span>', unsafe_allow_html=True)
-                        elif task.status == "FAILED":
-                            st.markdown('<span class="error-badge">❌ 失败</span>', unsafe_allow_html=True)
-                        elif task.status == "PROCESSING":
-                            st.markdown('<span class="processing-badge">⚡ 处理中</span>', unsafe_allow_html=True)
-                        else:
-                            st.markdown('<span class="queued-badge">⏳ 队列中</span>', unsafe_allow_html=True)
-
-                    # 进度显示
-                    if task.status == "PROCESSING":
-                        st.progress(task.progress / 100, text=f"进度: {int(task.progress)}%")
-                        
-                        if task.start_time:
-                            elapsed = time.time() - task.start_time
-                            elapsed_str = f"{int(elapsed//60)}:{int(elapsed%60):02d}"
-                            st.markdown(f'<div class="compact-info real-time">⏱️ 已用时: {elapsed_str}</div>', unsafe_allow_html=True)
-
-                    elif task.status == "QUEUED":
-                        st.markdown('<div class="compact-info">⏳ 等待处理...</div>', unsafe_allow_html=True)
-
-                    # 结果处理
-                    if task.status == "SUCCESS":
-                        elapsed_str = f"{int(task.elapsed_time//60)}:{int(task.elapsed_time%60):02d}"
-                        
-                        if task.task_type == "watermark":
-                            st.success(f"🚿 去水印完成! 用时: {elapsed_str}")
-                        elif task.task_type == "lighting":
-                            st.success(f"✨ 溶图打光完成! 用时: {elapsed_str}")
-                        elif task.task_type == "pose":
-                            result_count = len(task.result_data_list)
-                            st.success(f"🎉 姿态迁移完成! 用时: {elapsed_str} | 生成了 {result_count} 个结果")
-                        else:
-                            st.success(f"🎉 图像优化完成! 用时: {elapsed_str}")
-                        
-                        create_download_buttons(task)
-
-                    elif task.status == "FAILED":
-                        st.error(f"💥 处理失败")
-                        if task.error_message:
-                            if is_timeout_error(task.error_message):
-                                st.warning(f"⏰ 超时错误: 已重试 {task.retry_count} 次")
-                            st.markdown(f'<div class="compact-info">❌ 错误: {task.error_message}</div>', unsafe_allow_html=True)
-
-                    st.markdown('</div>', unsafe_allow_html=True)
-
-            st.divider()
+        refresh_interval = AUTO_REFRESH_INTERVAL if has_pending_work() else None
+        st.fragment(render_task_panel, run_every=refresh_interval)(auto_refresh=refresh_interval is not None)
+        # 批量下载不随任务列表定时刷新
+        render_export(st.session_state.task_board)
 
-            # 操作按钮
-            col1, col2, col3 = st.columns(3)
-
-            with col1:
-                if st.button("🗑️ 清空所有", use_container_width=True):
-                    st.session_state.tasks = []
-                    st.session_state.task_queue = []
-                    st.session_state.download_clicked = {}
-                    st.rerun()
-
-            with col2:
-                if st.button("🔄 重启失败", use_container_width=True):
-                    failed_tasks = [t for t in st.session_state.tasks if t.status == "FAILED"]
-                    for task in failed_tasks:
-                        task.status = "QUEUED"
-                        task.retry_count = 0
-                        task.timeout_count = 0
-                        task.error_message = None
-                        task.progress = 0
-                        st.session_state.task_queue.append(task)
-                    if failed_tasks:
-                        st.success(f"✅ 已重启 {len(failed_tasks)} 个失败任务")
-                    else:
-                        st.info("ℹ️ 没有失败的任务需要重启")
-                    st.rerun()
-            
-            with col3:
-                if st.button("🔄 强制刷新", use_container_width=True):
-                    st.rerun()
-
-# --- 12. 应用入口 ---
+# --- 10. 应用入口 ---
 if __name__ == "__main__":
     try:
         main()
 
-        # 自动刷新逻辑
-        has_active_tasks = any(t.status in ["PROCESSING", "QUEUED"] for t in st.session_state.tasks) or len(st.session_state.task_queue) > 0
-
-        if has_active_tasks:
-            time.sleep(AUTO_REFRESH_INTERVAL)
-            st.rerun()
-
     except Exception as e:
         error_str = str(e).lower()
         # 过滤掉Streamlit内部的无害错误
@@ -0,0 +1,5 @@
+"""RunningHub 任务处理核心模块
+
+Streamlit 每次重跑都会重新执行 app.py，放在 app.py 中的模块级对象会被反复重建。
+需要在进程内所有会话之间共享的组件（HTTP连接池等）统一放在本包中。
+"""
@@ -0,0 +1,208 @@
+"""按 API Key 自适应调整并发数，错误率过高时熔断
+
+账号实际能同时运行的任务数取决于 RunningHub 当时的繁忙程度，固定的 MAX_CONCURRENT
+要么偏保守，要么在服务繁忙时让每个任务各自撞上"队列已满"再各自退避。
+这里按 AIMD 调整每个 API Key 的并发窗口，作为 limiter 的名额数：
+
+- 发起成功：窗口加 1/窗口（大约每成功一整个窗口的任务加 1），不超过上限
+- 发起时遇到并发限制 / 超时：窗口乘以 ADAPTIVE_DECREASE_FACTOR，同一波错误（ADAPTIVE_DECREASE_INTERVAL 内）只减一次
+
+只统计发起（提交）的结果，远端运行得慢不影响窗口。
+
+熔断器统计最近 BREAKER_WINDOW 秒内发起的错误率，超过 BREAKER_ERROR_RATE 时打开，
+BREAKER_COOLDOWN 秒内不再发起新任务（名额为 0）；之后半开，不论熔断前放行的任务是否结束，
+都额外放行一个试探任务（reserve_probe，放行后由 assign_probe 记下持有者），
+只有该任务的发起结果决定恢复还是再次打开，熔断前放行的任务在半开期间的结果不计。
+试探任务 BREAKER_COOLDOWN 秒内没有结果（被取消等）时可以再放行一个。
+
+状态只在本进程内维护；使用 Redis 共享名额时，各进程按自己观察到的窗口限制共享的名额总数。
+"""
+import threading
+import time
+from collections import deque
+
+from .config import (
+    ADAPTIVE_CONCURRENCY, ADAPTIVE_MIN_CONCURRENT, ADAPTIVE_DECREASE_FACTOR, ADAPTIVE_DECREASE_INTERVAL,
+    BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_COOLDOWN,
+)
+
+CLOSED, OPEN, HALF_OPEN = "CLOSED", "OPEN", "HALF_OPEN"
+
+
+class AdaptiveWindow:
+    """一个 API Key 的并发窗口与熔断器"""
+
+    def __init__(self, initial, min_window, max_window):
+        self.window = float(initial)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.breaker = CLOSED
+        self.increases = 0
+        self.decreases = 0
+        self.trips = 0
+        self._outcomes = deque()   # (时间, 是否失败)
+        self._opened_at = None
+        self._probe_at = None      # 半开时放行试探任务的时间
+        self._probe_holder = None  # 试探任务的持有者（任务 uid）
+        self._last_decrease = 0.0
+
+    def _advance(self, now):
+        if self.breaker == OPEN and now - self._opened_at >= BREAKER_COOLDOWN:
+            self.breaker = HALF_OPEN
+        while self._outcomes and now - self._outcomes[0][0] > BREAKER_WINDOW:
+            self._outcomes.popleft()
+
+    def capacity(self, now):
+        """常规名额数，熔断打开、半开时为 0（半开时的试探任务由 reserve_probe 放行）"""
+        self._advance(now)
+        if self.breaker != CLOSED:
+            return 0
+        return int(self.window)
+
+    def reserve_probe(self, now):
+        """半开且没有进行中的试探任务时，占用试探名额并返回 True"""
+        self._advance(now)
+        if self.breaker != HALF_OPEN:
+            return False
+        if self._probe_at is not None and now - self._probe_at < BREAKER_COOLDOWN:
+            return False
+        self._probe_at = now
+        self._probe_holder = None
+        return True
+
+    def assign_probe(self, holder):
+        """试探名额已交给 holder，之后只有它的结果决定熔断器状态"""
+        if self._probe_at is not None:
+            self._probe_holder = holder
+
+    def cancel_probe(self):
+        """占用的试探名额没有交给任务"""
+        self._probe_at = None
+        self._probe_holder = None
+
+    def reopen_in(self, now):
+        """距离可以再放行任务的秒数：熔断打开时到半开，半开时到试探名额过期"""
+        self._advance(now)
+        if self.breaker == OPEN:
+            return max(0.0, BREAKER_COOLDOWN - (now - self._opened_at))
+        if self.breaker == HALF_OPEN and self._probe_at is not None:
+            return max(0.0, BREAKER_COOLDOWN - (now - self._probe_at))
+        return 0.0
+
+    def record(self, outcome, now, holder=None):
+        """outcome: "success" / "congestion"（并发限制、超时）/ "error"（其他发起失败）；holder 为发起的任务"""
+        self._advance(now)
+        if self.breaker == HALF_OPEN and (holder is None or holder != self._probe_holder):
+            return  # 熔断前放行的任务，半开期间只看试探任务的结果
+        failed = outcome != "success"
+        if outcome == "success":
+            if self.window < self.max_window:
+                self.window = min(self.max_window, self.window + 1 / self.window)
+                self.increases += 1
+        elif outcome == "congestion" and now - self._last_decrease >= ADAPTIVE_DECREASE_INTERVAL:
+            self.window = max(self.min_window, self.window * ADAPTIVE_DECREASE_FACTOR)
+            self._last_decrease = now
+            self.decreases += 1
+
+        if self.breaker == HALF_OPEN:
+            # 试探任务的结果决定恢复还是再次熔断
+            if failed:
+                self._trip(now)
+            else:
+                self.breaker = CLOSED
+                self._probe_at = None
+                self._probe_holder = None
+                self._outcomes.clear()
+            return
+        if self.breaker == OPEN:
+            return  # 熔断前已发起的任务
+        self._outcomes.append((now, failed))
+        errors = sum(1 for _, f in self._outcomes if f)
+        if len(self._outcomes) >= BREAKER_MIN_CALLS and errors / len(self._outcomes) >= BREAKER_ERROR_RATE:
+            self._trip(now)
+
+    def _trip(self, now):
+        self.breaker = OPEN
+        self._opened_at = now
+        self._probe_at = None
+        self._probe_holder = None
+        self._outcomes.clear()
+        self.trips += 1
+
+    def snapshot(self, now):
+        self._advance(now)
+        errors = sum(1 for _, f in self._outcomes if f)
+        return {
+            'window': round(self.window, 2),
+            'breaker': self.breaker,
+            'reopen_in': round(self.reopen_in(now), 1),
+            'error_rate': errors / len(self._outcomes) if self._outcomes else 0.0,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'trips': self.trips,
+        }
+
+
+class ConcurrencyController:
+    """各 API Key 的并发窗口（线程安全），enabled=False 时名额固定为 capacity"""
+
+    def __init__(self, capacity, max_capacity, min_capacity=ADAPTIVE_MIN_CONCURRENT, enabled=ADAPTIVE_CONCURRENCY):
+        self.initial = capacity
+        self.min_capacity = min(min_capacity, capacity)
+        self.max_capacity = max(max_capacity, capacity)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._windows = {}   # api_key -> AdaptiveWindow
+
+    def _window(self, api_key):
+        if api_key not in self._windows:
+            self._windows[api_key] = AdaptiveWindow(self.initial, self.min_capacity, self.max_capacity)
+        return self._windows[api_key]
+
+    def capacity(self, api_key):
+        """当前允许同时运行的任务数，熔断时为 0"""
+        if not self.enabled:
+            return self.initial
+        with self._lock:
+            return self._window(api_key).capacity(time.monotonic())
+
+    def breaker(self, api_key):
+        if not self.enabled:
+            return CLOSED
+        with self._lock:
+            window = self._window(api_key)
+            window._advance(time.monotonic())
+            return window.breaker
+
+    def reserve_probe(self, api_key):
+        if not self.enabled:
+            return False
+        with self._lock:
+            return self._window(api_key).reserve_probe(time.monotonic())
+
+    def assign_probe(self, api_key, holder):
+        with self._lock:
+            self._window(api_key).assign_probe(holder)
+
+    def cancel_probe(self, api_key):
+        with self._lock:
+            self._window(api_key).cancel_probe()
+
+    def reopen_in(self, api_key):
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            return self._window(api_key).reopen_in(time.monotonic())
+
+    def record(self, api_key, outcome, holder=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._window(api_key).record(outcome, time.monotonic(), holder)
+
+    def snapshot(self, api_key):
+        if not self.enabled:
+            return {'window': self.initial, 'breaker': CLOSED, 'reopen_in': 0.0, 'error_rate': 0.0,
+                    'increases': 0, 'decreases': 0, 'trips': 0}
+        with self._lock:
+            return self._window(api_key).snapshot(time.monotonic())
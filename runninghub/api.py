@@ -0,0 +1,331 @@
+"""RunningHub OpenAPI 调用
+
+所有接口请求都经过进程级共享的 HttpClient，复用长连接，避免每次轮询都重新握手。
+"""
+import io
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.fields import RequestField
+
+from .config import (
+    UPLOAD_URL, RUN_TASK_URL, STATUS_URL, OUTPUTS_URL,
+    UPLOAD_TIMEOUT, RUN_TASK_TIMEOUT, STATUS_CHECK_TIMEOUT, OUTPUT_FETCH_TIMEOUT, IMAGE_DOWNLOAD_TIMEOUT,
+    HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, BLOB_CHUNK_SIZE,
+    CONCURRENT_LIMIT_ERRORS, TIMEOUT_ERRORS,
+)
+
+# 各接口的默认超时
+ENDPOINT_TIMEOUTS = {
+    "upload": UPLOAD_TIMEOUT,
+    "run": RUN_TASK_TIMEOUT,
+    "status": STATUS_CHECK_TIMEOUT,
+    "outputs": OUTPUT_FETCH_TIMEOUT,
+    "download": IMAGE_DOWNLOAD_TIMEOUT,
+}
+
+# --- 1. 连接池 ---
+class ConnectionStats:
+    """记录请求数与实际建立的TCP/TLS连接数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.by_endpoint = {}
+
+    def record_request(self, endpoint):
+        with self._lock:
+            self.requests += 1
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'connections_reused': max(0, self.requests - self.connections_opened),
+                'by_endpoint': dict(self.by_endpoint),
+            }
+
+
+def _counting_pool_classes(stats):
+    """生成在每次真正建立连接时计数的连接池类"""
+
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            stats.record_connect()
+            return super().connect()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            stats.record_connect()
+            return super().connect()
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    return {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+class PooledAdapter(HTTPAdapter):
+    """连接数有上限的长连接适配器"""
+
+    def __init__(self, stats, **kwargs):
+        self._pool_classes = _counting_pool_classes(stats)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class HttpClient:
+    """进程级共享的HTTP客户端
+
+    每个线程持有自己的 requests.Session（Session 本身不保证线程安全），
+    但所有 Session 挂载同一个适配器，因此共享同一组长连接池。
+    """
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.stats = ConnectionStats()
+        self._adapter = PooledAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, endpoint, url, **kwargs):
+        kwargs.setdefault('timeout', ENDPOINT_TIMEOUTS[endpoint])
+        self.stats.record_request(endpoint)
+        return self._session().request(method, url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        return self.request("POST", endpoint, url, **kwargs)
+
+    def get(self, endpoint, url, **kwargs):
+        return self.request("GET", endpoint, url, **kwargs)
+
+    def close(self):
+        self._adapter.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """获取进程内唯一的HTTP客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+def get_connection_stats():
+    return get_client().stats.snapshot()
+
+# --- 2. 流式上传 ---
+class MultipartStream:
+    """multipart/form-data 请求体，文件内容边读边发送
+
+    只有字段头部在内存中，文件部分直接从 fileobj 按块读取。实现了 __len__，
+    requests 会据此设置 Content-Length，而不是改用分块传输。
+    """
+
+    def __init__(self, fields, file_field, file_name, fileobj, file_size):
+        self.boundary = uuid.uuid4().hex
+        head = b"".join(self._part(name, value.encode("utf-8")) for name, value in fields.items())
+        head += self._part_header(file_field, file_name)
+        tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        self._length = len(head) + file_size + len(tail)
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self._fileobj = fileobj
+
+    def _part_header(self, name, file_name=None):
+        # 与 requests 构造的字段头一致
+        field = RequestField(name=name, data=b"", filename=file_name)
+        field.make_multipart()
+        return f"--{self.boundary}\r\n".encode("ascii") + field.render_headers().encode("utf-8")
+
+    def _part(self, name, value):
+        return self._part_header(name) + value + b"\r\n"
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self._fileobj.close()
+
+
+def _open_input(file_data):
+    """返回 (文件对象, 字节数)；file_data 可以是 bytes，也可以是 BlobRef 等带 open()/size 的引用"""
+    if isinstance(file_data, (bytes, bytearray)):
+        return io.BytesIO(file_data), len(file_data)
+    return file_data.open(), file_data.size
+
+# --- 3. 错误判断 ---
+def is_concurrent_limit_error(error_msg):
+    error_lower = error_msg.lower()
+    return any(keyword.lower() in error_lower for keyword in CONCURRENT_LIMIT_ERRORS)
+
+def is_timeout_error(error_msg):
+    error_lower = error_msg.lower()
+    return any(keyword.lower() in error_lower for keyword in TIMEOUT_ERRORS)
+
+# --- 4. 接口函数 ---
+def upload_file_with_retry(file_data, file_name, api_key, max_retries=3):
+    for attempt in range(max_retries):
+        try:
+            fileobj, file_size = _open_input(file_data)
+            body = MultipartStream({'apiKey': api_key, 'fileType': 'image'}, 'file', file_name, fileobj, file_size)
+            try:
+                response = get_client().post(
+                    "upload", UPLOAD_URL, data=body, headers={'Content-Type': body.content_type})
+            finally:
+                body.close()
+            response.raise_for_status()
+
+            result = response.json()
+            if result.get("code") == 0:
+                return result['data']['fileName']
+            else:
+                raise Exception(f"上传失败: {result.get('msg', '未知错误')}")
+
+        except requests.exceptions.Timeout:
+            if attempt < max_retries - 1:
+                time.sleep((attempt + 1) * 2)
+                continue
+            else:
+                raise Exception(f"上传超时，已重试{max_retries}次")
+        except Exception as e:
+            if attempt < max_retries - 1 and is_timeout_error(str(e)):
+                time.sleep((attempt + 1) * 2)
+                continue
+            else:
+                raise
+
+def run_task_with_retry(api_key, webapp_id, node_info_list, max_retries=3, instance_type=None):
+    for attempt in range(max_retries):
+        try:
+            headers = {'Host': 'www.runninghub.cn', 'Content-Type': 'application/json'}
+            payload = {
+                "apiKey": api_key,
+                "webappId": webapp_id,
+                "nodeInfoList": node_info_list
+            }
+
+            # 只在需要时添加 instanceType
+            if instance_type:
+                payload["instanceType"] = instance_type
+
+            response = get_client().post("run", RUN_TASK_URL, headers=headers, json=payload)
+            response.raise_for_status()
+
+            result = response.json()
+            if result.get("code") != 0:
+                raise Exception(f"任务发起失败: {result.get('msg', '未知错误')}")
+            return result['data']['taskId']
+
+        except requests.exceptions.Timeout:
+            if attempt < max_retries - 1:
+                time.sleep((attempt + 1) * 3)
+                continue
+            else:
+                raise Exception(f"启动任务超时，已重试{max_retries}次")
+        except Exception as e:
+            if attempt < max_retries - 1 and is_timeout_error(str(e)):
+                time.sleep((attempt + 1) * 3)
+                continue
+            else:
+                raise
+
+def get_task_status(api_key, task_id):
+    try:
+        response = get_client().post("status", STATUS_URL, json={'apiKey': api_key, 'taskId': task_id})
+        response.raise_for_status()
+        return response.json().get('data')
+    except requests.exceptions.Timeout:
+        return "CHECKING"
+    except:
+        return "UNKNOWN"
+
+def fetch_task_outputs(api_key, task_id, task_type="watermark"):
+    """获取任务结果"""
+    try:
+        response = get_client().post("outputs", OUTPUTS_URL, json={'apiKey': api_key, 'taskId': task_id})
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get("code") == 0 and data.get("data"):
+            if task_type == "pose":
+                # 姿态迁移 - 支持多个输出
+                file_urls = []
+                for output_item in data["data"]:
+                    file_url = output_item.get("fileUrl")
+                    if file_url:
+                        file_urls.append(file_url)
+                if file_urls:
+                    return file_urls
+            else:
+                # 去水印、溶图打光和图像优化 - 单个输出
+                file_url = data["data"][0].get("fileUrl")
+                if file_url:
+                    return file_url
+
+        raise Exception(f"获取结果失败: {data.get('msg', '未找到结果')}")
+
+    except requests.exceptions.Timeout:
+        raise Exception("获取结果超时，请稍后重试")
+
+def iter_result_image(url, chunk_size=BLOB_CHUNK_SIZE):
+    """分块下载结果图片，不在内存中保留完整文件"""
+    try:
+        with get_client().get("download", url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+    except requests.exceptions.Timeout:
+        raise Exception("下载图片超时")
+
+def download_result_image(url):
+    return b"".join(iter_result_image(url))
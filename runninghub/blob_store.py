@@ -0,0 +1,179 @@
+"""按内容寻址的本地文件存储
+
+下载结果边下载边写入临时文件并计算 sha256，完成后以哈希为文件名移入存储目录，
+内存中只保留 BlobRef（哈希 + 字节数）。页面上传的输入图片同样先写入这里，上传到 RunningHub 时
+从文件按块读取。页面下载、结果缓存、任务存储都通过 BlobRef 引用同一份文件。
+
+读取或复用时会刷新文件修改时间。引擎定期清理（prune）：删除超过 BLOB_RETENTION 未使用的文件；
+总大小超过 BLOB_MAX_BYTES 时，再按最久未使用的顺序删除，直到低于上限（最近 BLOB_MIN_AGE 内使用过的文件除外）。
+任务存储中仍有未取消任务引用的输入、结果文件始终保留，任务记录过期清理后才会被删除。结果缓存淘汰条目时，
+不再被任务引用的结果文件直接删除（见 result_cache.py）。
+多台机器分别运行页面和 worker 时，需要把 RH_CACHE_DIR 放在共享存储上。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from .config import BLOB_DIR, BLOB_RETENTION, BLOB_MAX_BYTES, BLOB_MIN_AGE, BLOB_CHUNK_SIZE
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobRef:
+    """存储中一个文件的引用，可以跨进程传递"""
+    __slots__ = ('digest', 'size')
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.size = size
+
+    def __eq__(self, other):
+        return isinstance(other, BlobRef) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"BlobRef({self.digest[:12]}…, {self.size})"
+
+    def __getstate__(self):
+        return (self.digest, self.size)
+
+    def __setstate__(self, state):
+        self.digest, self.size = state
+
+    def open(self):
+        return get_blob_store().open(self.digest)
+
+    def read(self):
+        return get_blob_store().read(self.digest)
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self._tmp = os.path.join(root, ".tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        return self.write_stream([data])
+
+    def write_stream(self, chunks):
+        """逐块写入，返回 BlobRef；相同内容只保存一份"""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            digest = hasher.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return BlobRef(digest, size)
+
+    def write_file(self, fileobj, chunk_size=BLOB_CHUNK_SIZE):
+        """从文件对象（如 Streamlit 的 UploadedFile）按块写入"""
+        fileobj.seek(0)
+        return self.write_stream(iter(lambda: fileobj.read(chunk_size), b""))
+
+    def ref(self, digest):
+        """已存在文件的引用，文件不存在时返回 None"""
+        try:
+            stat = os.stat(self.path(digest))
+        except OSError:
+            return None
+        return BlobRef(digest, stat.st_size)
+
+    def touch(self, digest):
+        try:
+            os.utime(self.path(digest))
+            return True
+        except OSError:
+            return False
+
+    def open(self, digest):
+        self.touch(digest)
+        return open(self.path(digest), "rb")
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def discard(self, digest):
+        """删除文件，不存在时返回 False"""
+        try:
+            os.remove(self.path(digest))
+            return True
+        except OSError:
+            return False
+
+    def prune(self, retention=BLOB_RETENTION, max_bytes=BLOB_MAX_BYTES, keep=(), min_age=BLOB_MIN_AGE):
+        """删除长时间未使用的文件和中断写入留下的临时文件，总大小超过 max_bytes 时再删除最久未使用的，
+        返回删除数量。keep 中的文件（仍被任务引用的输入、结果）不删除。"""
+        now = time.time()
+        removed = 0
+        files = []   # [(修改时间, 字节数, 路径, 文件名)]
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                    if entry.name not in keep and stat.st_mtime < now - retention:
+                        os.remove(entry.path)
+                        removed += 1
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+                except OSError:
+                    pass
+
+        total = sum(size for _, size, _, _ in files)
+        if max_bytes is None or total <= max_bytes:
+            return removed
+        for mtime, size, path, name in sorted(files):
+            if total <= max_bytes or mtime >= now - min_age:
+                break
+            if name in keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+        return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
@@ -0,0 +1,132 @@
+"""会话任务面板
+
+保存一个会话的任务列表，并在每次状态变更时增量维护各状态、各类型的计数与按状态的索引，
+页面统计和"是否还有进行中的任务"的判断都不再遍历任务列表。
+
+状态变更来自引擎线程（TaskItem.update 的监听），页面脚本线程只读取，读写都在锁内进行。
+同一个会话ID（同一地址栏参数打开的多个标签页）共用一个面板。
+"""
+import itertools
+import threading
+import weakref
+
+from .tasks import TASK_TYPES, add_listener
+
+STATUSES = ("QUEUED", "PROCESSING", "SUCCESS", "FAILED")
+ACTIVE_STATUSES = ("QUEUED", "PROCESSING")
+
+
+class TaskBoard:
+    def __init__(self, session_id, tasks=()):
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        self._tasks = {}                                   # uid -> 任务，按加入顺序
+        self._by_status = {status: {} for status in STATUSES}  # 状态 -> {uid: 任务}
+        self._status_of = {}                               # uid -> 当前计入的状态
+        self._type_counts = dict.fromkeys(TASK_TYPES, 0)
+        self._last_task_id = 0
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        with self._lock:
+            if task.uid in self._tasks:
+                return
+            self._tasks[task.uid] = task
+            self._last_task_id = max(self._last_task_id, task.task_id)
+            self._type_counts[task.task_type] += 1
+            self._place(task.uid, task, task.status)
+
+    def next_task_id(self):
+        """分配会话内的任务编号（清空列表后也不重复使用）"""
+        with self._lock:
+            self._last_task_id += 1
+            return self._last_task_id
+
+    def clear(self):
+        """移除全部任务，返回被移除的任务"""
+        with self._lock:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+            self._status_of.clear()
+            for index in self._by_status.values():
+                index.clear()
+            self._type_counts = dict.fromkeys(TASK_TYPES, 0)
+        return tasks
+
+    def _place(self, uid, task, status):
+        old = self._status_of.get(uid)
+        if old == status:
+            return
+        if old is not None:
+            self._by_status[old].pop(uid, None)
+        self._by_status.setdefault(status, {})[uid] = task
+        self._status_of[uid] = status
+
+    def _on_status(self, task):
+        with self._lock:
+            if task.uid in self._tasks:
+                self._place(task.uid, task, task.status)
+
+    # --- 读取 ---
+    def __len__(self):
+        return len(self._tasks)
+
+    def tasks(self):
+        """全部任务（按加入顺序）"""
+        with self._lock:
+            return list(self._tasks.values())
+
+    def with_status(self, *statuses):
+        with self._lock:
+            return [task for status in statuses for task in self._by_status.get(status, {}).values()]
+
+    def window(self, status=None, offset=0, limit=20):
+        """倒序取一页任务，返回 (任务列表, 总数)
+
+        status 为 None 时按加入顺序取全部任务，否则按进入该状态的先后顺序取。
+
+        只复制这一页的任务，页面渲染开销不随会话任务总数增长。
+        """
+        with self._lock:
+            source = self._tasks if status is None else self._by_status.get(status, {})
+            page = list(itertools.islice(reversed(source.values()), offset, offset + limit))
+            return page, len(source)
+
+    def count(self, status):
+        return len(self._by_status.get(status, ()))
+
+    def has_active(self):
+        return any(self._by_status[status] for status in ACTIVE_STATUSES)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processing': len(self._by_status["PROCESSING"]),
+                'queued': len(self._by_status["QUEUED"]),
+                'success': len(self._by_status["SUCCESS"]),
+                'failed': len(self._by_status["FAILED"]),
+                'total': len(self._tasks),
+                **self._type_counts,
+            }
+
+
+_boards = weakref.WeakValueDictionary()   # session_id -> TaskBoard
+_boards_lock = threading.Lock()
+
+def get_board(session_id, restore=None):
+    """获取会话的任务面板；首次获取时用 restore() 返回的任务初始化"""
+    with _boards_lock:
+        board = _boards.get(session_id)
+        if board is None:
+            board = TaskBoard(session_id, restore() if restore else ())
+            _boards[session_id] = board
+        return board
+
+def _on_update(task, changes):
+    if 'status' in changes:
+        board = _boards.get(task.session_id)
+        if board is not None:
+            board._on_status(task)
+
+add_listener(_on_update)
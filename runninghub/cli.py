@@ -0,0 +1,284 @@
+"""命令行批量处理
+
+不需要打开页面，直接用任务引擎处理一个目录或清单中的全部图片：
+
+    python -m runninghub.cli enhance -i ./photos -o ./out --version "WAN 2.1" --concurrency 5
+    python -m runninghub.cli pose --manifest pairs.jsonl -o ./out
+
+清单为 JSONL，每行一个条目：单图工作流 {"image": "a.jpg"}，姿态迁移
+{"character": "c.png", "reference": "r.png"}，可选 "id"；相对路径相对于清单所在目录。
+
+输出目录下的 runninghub-manifest.jsonl 记录每个条目的处理结果，重新运行同一命令时跳过已完成的条目。
+任务状态保存在输出目录的 .runninghub/tasks.sqlite3 中，中断时已在远端运行的任务重启后继续等待结果，
+不重新上传、发起。结束时输出吞吐量与耗时统计。
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import shutil
+import sys
+import time
+
+from .config import MAX_CONCURRENT, INGEST_BACKLOG, WORKER_SHUTDOWN_TIMEOUT
+from .export import result_files
+from .ingest import iter_directory, skip_reason
+from .tasks import TASK_TYPES, add_listener, remove_listener
+
+ENHANCE_VERSIONS = ("WAN 2.2", "WAN 2.1")
+MANIFEST_NAME = "runninghub-manifest.jsonl"
+PROGRESS_INTERVAL = 10  # 每完成多少个条目输出一次进度
+STALL_CHECK_INTERVAL = 30  # 这么多秒没有条目完成时，检查是否有任务已不会再被处理（秒）
+
+
+# --- 输入条目 ---
+def load_items(args, parser):
+    """返回 [(条目ID, {任务数据属性: 文件路径})]"""
+    if args.manifest:
+        base = os.path.dirname(os.path.abspath(args.manifest))
+        items = []
+        with open(args.manifest, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if args.workflow == "pose":
+                    inputs = {'character_image_data': entry["character"], 'reference_image_data': entry["reference"]}
+                else:
+                    inputs = {'file_data': entry["image"]}
+                inputs = {attr: os.path.join(base, path) for attr, path in inputs.items()}
+                items.append((str(entry.get("id") or f"{line_no:05d}"), inputs))
+        return items
+
+    if args.workflow == "pose":
+        parser.error("姿态迁移需要用 --manifest 指定每个条目的角色图片与姿势参考图")
+    return [(name, {'file_data': os.path.join(args.input, name)})
+            for name, size, _ in iter_directory(args.input) if skip_reason(name, size) is None]
+
+
+def read_manifest(path):
+    """已处理条目的最新记录 {条目ID: 记录}"""
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 中断时写了一半的行
+                records[record["id"]] = record
+    return records
+
+
+def item_uid(workflow, item_id):
+    """条目对应的任务 uid，重新运行时与上次相同，用于找回已在远端运行的任务"""
+    return hashlib.sha256(f"{workflow}:{item_id}".encode("utf-8")).hexdigest()[:32]
+
+
+def output_dir(root, item_id, workflow):
+    """条目结果的保存目录：保持输入的子目录结构，姿态迁移每个条目一个目录"""
+    item_path = os.path.normpath(item_id).lstrip(os.sep)
+    if item_path.startswith(os.pardir):
+        item_path = os.path.basename(item_path)
+    return os.path.join(root, item_path if workflow == "pose" else os.path.dirname(item_path))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+# --- 批量运行 ---
+class BatchRunner:
+    def __init__(self, engine, workflow, enhance_version, output, backlog):
+        self.engine = engine
+        self.workflow = workflow
+        self.enhance_version = enhance_version
+        self.output = output
+        self.backlog = backlog
+        self.session_id = f"cli:{hashlib.sha256(os.path.abspath(output).encode('utf-8')).hexdigest()[:12]}"
+        self.manifest_path = os.path.join(output, MANIFEST_NAME)
+        self._watching = {}     # uid -> (条目ID, 任务, 提交时间)
+        self._done = queue.Queue()
+        self._task_id = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.latencies = []     # 提交到完成
+        self.processing = []    # 任务处理耗时（不含排队）
+        self.output_bytes = 0
+
+    def _on_update(self, task, changes):
+        watched = self._watching.get(task.uid)
+        if changes.get('status') in ("SUCCESS", "FAILED") and watched and watched[1] is task:
+            self._done.put(task.uid)
+
+    def _watch(self, item_id, task):
+        self._watching[task.uid] = (item_id, task, time.time())
+        if task.status in ("SUCCESS", "FAILED"):
+            self._done.put(task.uid)
+
+    def _new_task(self, uid, inputs):
+        blobs = self.engine.blobs
+        data = {}
+        for attr, path in inputs.items():
+            with open(path, "rb") as f:
+                data[attr] = blobs.write_file(f)
+            data[attr.replace("_data", "_name")] = os.path.basename(path)
+        if self.workflow == "enhance":
+            data['enhance_version'] = self.enhance_version
+        self._task_id += 1
+        return TASK_TYPES[self.workflow](self._task_id, self.session_id, uid=uid, lane="bulk", **data)
+
+    def run(self, items):
+        os.makedirs(self.output, exist_ok=True)
+        finished = {item_id for item_id, record in read_manifest(self.manifest_path).items()
+                    if record["status"] == "SUCCESS"}
+        restored = {task.uid: task for task in self.engine.restore_session(self.session_id)}
+        self._task_id = max((task.task_id for task in restored.values()), default=0)
+        pending = [(item_id, inputs) for item_id, inputs in items if item_id not in finished]
+        self.skipped = len(items) - len(pending)
+        total = len(pending)
+        print(f"共 {len(items)} 个条目，已完成 {self.skipped} 个，本次处理 {total} 个")
+
+        add_listener(self._on_update)
+        try:
+            with open(self.manifest_path, "a", encoding="utf-8") as manifest:
+                for item_id, inputs in pending:
+                    while len(self._watching) >= self.backlog:
+                        self._collect(manifest, total)
+                    task = restored.get(item_uid(self.workflow, item_id))
+                    if task is None:
+                        task = self._new_task(item_uid(self.workflow, item_id), inputs)
+                        self.engine.submit(task)
+                    elif task.status == "FAILED":
+                        task.reset_for_retry()
+                        self.engine.submit(task)
+                    # 其余状态：上次运行中断的任务，由引擎从任务存储恢复执行
+                    self._watch(item_id, task)
+                while self._watching:
+                    self._collect(manifest, total)
+        finally:
+            remove_listener(self._on_update)
+
+    def _collect(self, manifest, total):
+        try:
+            uid = self._done.get(timeout=STALL_CHECK_INTERVAL)
+        except queue.Empty:
+            self._fail_lost()
+            return
+        if uid not in self._watching:
+            return
+        item_id, task, submitted_at = self._watching.pop(uid)
+        record = {'id': item_id, 'status': task.status, 'elapsed': round(task.elapsed_time or 0, 2)}
+        if task.status == "SUCCESS":
+            record['outputs'] = self._save_outputs(item_id, task)
+            self.succeeded += 1
+            self.cache_hits += bool(task.cache_hit)
+            self.latencies.append(time.time() - submitted_at)
+            self.processing.append(task.elapsed_time or 0)
+        else:
+            record['error'] = task.error_message
+            self.failed += 1
+        manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        manifest.flush()
+
+        count = self.succeeded + self.failed
+        if task.status == "FAILED":
+            print(f"[{count}/{total}] ✗ {item_id}: {task.error_message}")
+        elif count % PROGRESS_INTERVAL == 0 or count == total:
+            print(f"[{count}/{total}] ✓ 成功 {self.succeeded}，失败 {self.failed}")
+
+    def _fail_lost(self):
+        """死信、被清除或引擎已停止的任务不会再完成，记为失败（状态变更经 _on_update 进入完成队列）"""
+        tasks = [task for _, task, _ in self._watching.values()]
+        if not self.engine.is_alive():
+            error = "任务引擎已停止"
+        else:
+            error = "任务已不在队列中（多次中断转入死信或已被清除）"
+        for task in self.engine.find_lost(tasks):
+            task.update(status="FAILED", error_message=error)
+
+    def _save_outputs(self, item_id, task):
+        directory = output_dir(self.output, item_id, self.workflow)
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for name, blob in result_files(task):
+            path = os.path.join(directory, name)
+            with blob.open() as src, open(path, "wb") as dest:
+                shutil.copyfileobj(src, dest)
+            self.output_bytes += blob.size
+            paths.append(os.path.relpath(path, self.output))
+        return paths
+
+    def summary(self, wall_time):
+        processed = self.succeeded + self.failed
+        lines = [
+            "",
+            "=== 处理完成 ===",
+            f"条目: 成功 {self.succeeded}，失败 {self.failed}，跳过（此前已完成）{self.skipped}，复用缓存结果 {self.cache_hits}",
+            f"总耗时: {wall_time:.1f}s，吞吐量: {processed / wall_time * 60 if wall_time else 0:.1f} 个/分钟",
+        ]
+        if self.latencies:
+            lines.append(f"端到端耗时: p50 {percentile(self.latencies, 0.5):.1f}s，"
+                         f"p95 {percentile(self.latencies, 0.95):.1f}s，最长 {max(self.latencies):.1f}s")
+            lines.append(f"处理耗时（不含排队）: p50 {percentile(self.processing, 0.5):.1f}s，"
+                         f"p95 {percentile(self.processing, 0.95):.1f}s")
+        uploads = self.engine.stats()['uploads']
+        if uploads['uploads']:
+            lines.append(f"上传: {uploads['uploads']} 张，{uploads['bytes_before'] / 1024 / 1024:.1f}MB → "
+                         f"{uploads['bytes_after'] / 1024 / 1024:.1f}MB，平均 {uploads['avg_upload_seconds']:.1f}s")
+        lines.append(f"结果: {self.output_bytes / 1024 / 1024:.1f}MB，记录见 {self.manifest_path}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m runninghub.cli", description="RunningHub 命令行批量处理")
+    parser.add_argument("workflow", choices=sorted(TASK_TYPES), help="工作流")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-i", "--input", help="输入图片目录（含子目录）")
+    source.add_argument("--manifest", help="输入清单（JSONL）")
+    parser.add_argument("-o", "--output", required=True, help="输出目录")
+    parser.add_argument("--version", dest="enhance_version", choices=ENHANCE_VERSIONS, default=ENHANCE_VERSIONS[0],
+                        help="图像优化的模型版本")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT, help="同一 API Key 的最大并发数（遇到并发限制时自动降低）")
+    parser.add_argument("--backlog", type=int, default=INGEST_BACKLOG, help="同时提交给引擎的条目数上限")
+    args = parser.parse_args(argv)
+
+    if args.input and not os.path.isdir(args.input):
+        parser.error(f"输入目录不存在: {args.input}")
+    items = load_items(args, parser)
+
+    from .engine import TaskEngine
+    from .limiter import LocalLimiter
+    from .task_queue import InMemoryTaskQueue
+    from .task_store import TaskStore
+
+    # 独立的队列与任务存储，不与页面进程共享
+    engine = TaskEngine(
+        queue=InMemoryTaskQueue(),
+        limiter=LocalLimiter(capacity=args.concurrency, max_capacity=args.concurrency),
+        store=TaskStore(path=os.path.join(args.output, ".runninghub", "tasks.sqlite3")),
+    )
+    runner = BatchRunner(engine, args.workflow, args.enhance_version, args.output, max(args.backlog, args.concurrency))
+
+    started = time.time()
+    try:
+        runner.run(items)
+    except KeyboardInterrupt:
+        print("\n已中断，重新运行同一命令会跳过已完成的条目并继续未完成的远端任务")
+        engine.shutdown()
+        engine.store.flush(WORKER_SHUTDOWN_TIMEOUT)
+        print(runner.summary(time.time() - started))
+        return 130
+    engine.store.flush(WORKER_SHUTDOWN_TIMEOUT)
+    print(runner.summary(time.time() - started))
+    return 1 if runner.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
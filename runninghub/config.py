@@ -0,0 +1,162 @@
+"""RunningHub 接口与系统配置"""
+import os
+
+# --- 1. 接口地址 ---
+API_BASE_URL = "https://www.runninghub.cn"
+UPLOAD_URL = f"{API_BASE_URL}/task/openapi/upload"
+RUN_TASK_URL = f"{API_BASE_URL}/task/openapi/ai-app/run"
+STATUS_URL = f"{API_BASE_URL}/task/openapi/status"
+OUTPUTS_URL = f"{API_BASE_URL}/task/openapi/outputs"
+
+# --- 2. 工作流配置 ---
+# 工作流 - 去水印
+WATERMARK_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
+WATERMARK_WEBAPP_ID = "1986469254155403266"
+WATERMARK_NODE_INFO = [
+    {"nodeId": "191", "fieldName": "image", "fieldValue": "placeholder.jpg", "description": "image"}
+]
+
+# 工作流 - 溶图打光
+LIGHTING_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
+LIGHTING_WEBAPP_ID = "1985718229576425473"
+LIGHTING_NODE_INFO = [
+    {"nodeId": "437", "fieldName": "image", "fieldValue": "placeholder.png", "description": "image"}
+]
+
+# 工作流 - 姿态迁移
+POSE_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
+POSE_WEBAPP_ID = "1975745173911154689"
+POSE_NODE_INFO = [
+    {"nodeId": "245", "fieldName": "image", "fieldValue": "placeholder.png", "description": "角色图片"},
+    {"nodeId": "244", "fieldName": "image", "fieldValue": "placeholder.png", "description": "姿势参考图"}
+]
+
+# 工作流 - 图像优化 WAN 2.2（当前版本）
+ENHANCE_API_KEY = "9394a5c6d9454cd2b31e24661dd11c3d"
+ENHANCE_WEBAPP_ID_V2_2 = "1986501194824773634"
+ENHANCE_NODE_INFO_V2_2 = [
+    {"nodeId": "14", "fieldName": "image", "fieldValue": "placeholder.jpg", "description": "image"}
+]
+
+# 工作流 - 图像优化 WAN 2.1
+ENHANCE_WEBAPP_ID_V2_1 = "1947599512657453057"
+ENHANCE_NODE_INFO_V2_1 = [
+    {"nodeId": "38", "fieldName": "image", "fieldValue": "placeholder.png", "description": "图片输入"},
+    {"nodeId": "60", "fieldName": "text", "fieldValue": "8k, high quality, high detail", "description": "正向提示词补充"},
+    {"nodeId": "4", "fieldName": "text", "fieldValue": "色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量，JPEG压缩残留，丑陋的，残缺的，多余的手指，画得不好的手部，画得不好的脸部，畸形的，毁容的，形态畸形的肢体，手指融合，静止不动的画面，杂乱的背景，三条腿，背景人很多，倒着走", "description": "反向提示词"}
+]
+
+# 上传前预处理（见 preprocess.py），为 None 的工作流始终上传原图
+# max_edge: 最长边上限（像素）；quality: JPEG 质量；min_bytes: 不需要缩放、旋转且小于该大小的图片不处理
+WATERMARK_PREPROCESS = {"max_edge": 4096, "quality": 92, "min_bytes": 2 * 1024 * 1024}
+LIGHTING_PREPROCESS = {"max_edge": 4096, "quality": 92, "min_bytes": 2 * 1024 * 1024}
+POSE_PREPROCESS = {"max_edge": 4096, "quality": 95, "min_bytes": 4 * 1024 * 1024}
+ENHANCE_PREPROCESS = {"max_edge": 6144, "quality": 95, "min_bytes": 4 * 1024 * 1024}  # 图像优化需要保留细节
+
+# --- 3. 系统配置 ---
+MAX_CONCURRENT = 5  # 每个 API Key 的初始并发数（所有会话共享），开启自适应并发后按实际情况调整
+# 自适应并发与熔断（见 adaptive.py）
+ADAPTIVE_CONCURRENCY = os.environ.get("RH_ADAPTIVE_CONCURRENCY", "1") != "0"  # 设为 0 时并发数固定为 MAX_CONCURRENT
+ADAPTIVE_MIN_CONCURRENT = 1
+ADAPTIVE_MAX_CONCURRENT = int(os.environ.get("RH_ADAPTIVE_MAX_CONCURRENT", 20))
+ADAPTIVE_DECREASE_FACTOR = 0.5   # 遇到并发限制/超时错误时窗口乘以该系数
+ADAPTIVE_DECREASE_INTERVAL = 10  # 两次减小之间至少间隔的秒数，同时失败的一批任务只减一次
+BREAKER_WINDOW = 60              # 统计发起错误率的时间窗口（秒）
+BREAKER_MIN_CALLS = 10           # 窗口内发起次数达到该值才判断错误率
+BREAKER_ERROR_RATE = 0.5         # 错误率达到该值时熔断
+BREAKER_COOLDOWN = 30            # 熔断后暂停发起的秒数，之后放行一个试探任务
+MAX_RETRIES = 3
+# 失败重试前的等待（秒），按错误类型分别配置：min(max, base × factor^(第几次 - 1)) 再加 0~jitter 的随机值。
+# 等待期间任务交回队列，不占用引擎和 API Key 的名额
+RETRY_BACKOFF = {
+    "concurrent": {"base": 2, "factor": 2, "max": 60, "jitter": 3},    # CONCURRENT_LIMIT_ERRORS，按重试次数计
+    "timeout": {"base": 15, "factor": 2, "max": 120, "jitter": 10},    # TIMEOUT_ERRORS，按超时次数计
+}
+POLL_INTERVAL = 4
+MAX_POLL_COUNT = 240
+POLL_CONCURRENCY = 8    # 集中轮询时同时进行的状态查询上限（全进程）
+POLL_MAX_INTERVAL = 30  # 超过历史 p95 耗时后，查询间隔最多放宽到的秒数
+LATENCY_WINDOW = 200    # 每个工作流保留的最近耗时样本数
+LATENCY_MIN_SAMPLES = 5 # 样本数达到后才按历史分布安排查询，之前按固定间隔
+ACTUAL_TIMEOUT_MINUTES = 20
+IO_THREADS = 32     # 执行阻塞HTTP调用的线程数，与连接池大小一致
+UPLOAD_CONCURRENCY = 8    # 同时上传的任务数（上传在等待远端名额之前进行，不占用 MAX_CONCURRENT）
+DOWNLOAD_CONCURRENCY = 8  # 同时获取、下载结果的任务数（远端完成后立即释放名额）
+ENGINE_MAX_IN_FLIGHT = int(os.environ.get("RH_ENGINE_MAX_IN_FLIGHT", 1000))  # 单个引擎同时从队列取出的任务上限
+# 单个引擎已取出、尚未开始远端运行的任务上限；其余留在共享队列中，由空闲的进程取走
+ENGINE_PREFETCH = int(os.environ.get("RH_ENGINE_PREFETCH", UPLOAD_CONCURRENCY + MAX_CONCURRENT))
+UPLOAD_PREPROCESS = os.environ.get("RH_UPLOAD_PREPROCESS", "1") != "0"  # 设为 0 时所有工作流上传原图
+# 排队顺序（见 scheduler.py）：interactive 为页面上单张、少量提交的任务，bulk 为批量上传、导入和命令行任务
+LANE_WEIGHTS = {"interactive": 8, "bulk": 1}  # 两个通道同时有任务排队时分到的处理份额之比
+WORKFLOW_WEIGHTS = {"watermark": 1, "lighting": 1, "pose": 1, "enhance": 1}  # 各工作流在公平份额中的权重
+INTERACTIVE_MAX_BATCH = 3  # 一次提交不超过该张数时进入 interactive 通道
+SCHEDULER_SJF = os.environ.get("RH_SCHEDULER_SJF") == "1"  # 按工作流历史远端耗时估算代价，耗时短的优先
+SCHEDULER_DEFAULT_COST = 120  # 开启 SCHEDULER_SJF 时，还没有历史耗时的工作流按该秒数估算
+LANE_WAIT_WINDOW = 500        # 每个通道保留的最近等待时间样本数
+INGEST_BACKLOG = 50  # 压缩包/目录导入时，单个导入任务最多同时未完成的图片数，其余留在压缩包中
+INGEST_MAX_FILE_BYTES = 200 * 1024 * 1024  # 压缩包/目录中单张图片的大小上限
+INGEST_POLL_INTERVAL = 0.5                  # 排队已满时检查队列的间隔（秒）
+# 允许按服务器目录导入的根目录（多个用 os.pathsep 分隔），为空时页面不提供目录导入
+INGEST_ROOTS = [path for path in os.environ.get("RH_INGEST_ROOTS", "").split(os.pathsep) if path]
+
+# --- 4. 本地缓存 ---
+CACHE_DIR = os.environ.get("RH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "runninghub"))
+RESULT_CACHE_DIR = os.path.join(CACHE_DIR, "results")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RH_RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+UPLOAD_CACHE_PATH = os.path.join(CACHE_DIR, "uploads.sqlite3")
+UPLOAD_CACHE_TTL = 6 * 3600  # 已上传文件名的复用时长（秒）
+TASK_STORE_PATH = os.path.join(CACHE_DIR, "tasks.sqlite3")
+TASK_STORE_FLUSH_INTERVAL = 0.2  # 状态变更批量写入的最长间隔（秒）
+TASK_STORE_BATCH_SIZE = 500      # 单个事务最多写入的变更条数
+TASK_STORE_RETENTION = 7 * 24 * 3600  # 超过该时长未更新的任务记录在定期清理时删除
+TASK_STORE_TRANSITIONS_RETENTION = 24 * 3600  # 状态变更记录（进度等）的保留时长
+TASK_STORE_PRUNE_INTERVAL = 3600      # 定期清理任务记录和状态变更记录的间隔（秒）
+BLOB_DIR = os.path.join(CACHE_DIR, "blobs")  # 输入/结果图片文件，按内容哈希存放
+BLOB_RETENTION = TASK_STORE_RETENTION  # 超过该时长未使用的图片文件在定期清理时删除
+BLOB_MAX_BYTES = int(os.environ.get("RH_BLOB_MAX_BYTES", 5 * 1024 * 1024 * 1024))  # 图片文件总大小上限，超过时删除最久未使用的
+BLOB_MIN_AGE = 3600                    # 最近该时长内写入或使用过的文件不因超出总大小而删除（秒）
+BLOB_PRUNE_INTERVAL = 600              # 定期清理图片文件的间隔（秒）
+BLOB_CHUNK_SIZE = 256 * 1024           # 下载结果、暂存输入时每次读写的字节数
+IMAGE_INFO_CACHE_ENTRIES = 4096        # 内存中缓存的图片元数据条数（所有会话共享）
+THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 内存中预览缩略图的总大小上限
+THUMBNAIL_SIZE = 800                   # 预览缩略图的最长边（像素）
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024  # 批量导出的 ZIP 超过该大小后写入临时文件而不是留在内存
+INGEST_DIR = os.path.join(CACHE_DIR, "ingest")  # 上传的压缩包在导入完成前暂存于此
+
+# --- 5. 共享队列 ---
+REDIS_URL = os.environ.get("RH_REDIS_URL")  # 未配置时使用进程内队列
+QUEUE_NAMESPACE = os.environ.get("RH_QUEUE_NAMESPACE", "rh:queue")
+VISIBILITY_TIMEOUT = 120        # 取出后未续租的任务超过该秒数重新投递
+QUEUE_HEARTBEAT_INTERVAL = 30   # 续租/回写状态/检查超时的间隔
+QUEUE_POLL_INTERVAL = 0.5       # 队列为空时的检查间隔
+MAX_DELIVERIES = 3              # 超过该投递次数的任务转入死信队列
+DEAD_LETTER_MAX = 1000          # 死信队列最多保留的任务数，超出时丢弃最早的
+DEAD_LETTER_TTL = 7 * 24 * 3600 # 死信任务的描述保留时长（Redis 队列）
+STATE_TTL = 24 * 3600           # 任务状态快照保留时长
+LIMITER_NAMESPACE = os.environ.get("RH_LIMITER_NAMESPACE", "rh:limiter")
+LIMITER_LEASE_TTL = 60          # 并发名额租约时长，持有进程每 1/3 租期续租一次
+LIMITER_POLL_INTERVAL = 0.5     # 等待名额时的检查间隔
+EXTERNAL_WORKERS = os.environ.get("RH_EXTERNAL_WORKERS") == "1"  # 页面只提交任务，由独立 worker 进程执行
+WORKER_PROCESSES = int(os.environ.get("RH_WORKER_PROCESSES", 2))   # python -m runninghub.worker 默认启动的进程数
+WORKER_SHUTDOWN_TIMEOUT = 15    # worker 退出时交还处理中任务的最长等待秒数
+
+# --- 6. 超时配置 ---
+UPLOAD_TIMEOUT = 120
+RUN_TASK_TIMEOUT = 60
+STATUS_CHECK_TIMEOUT = 25
+OUTPUT_FETCH_TIMEOUT = 90
+IMAGE_DOWNLOAD_TIMEOUT = 120
+
+# --- 7. 连接池配置 ---
+HTTP_POOL_CONNECTIONS = 4   # 缓存的主机连接池数量（API域名 + 结果图片域名）
+HTTP_POOL_MAXSIZE = 32      # 每个主机最多保持的长连接数，超出时等待空闲连接
+
+# --- 8. 错误关键词 ---
+CONCURRENT_LIMIT_ERRORS = [
+    "concurrent limit", "too many requests", "rate limit",
+    "队列已满", "并发限制", "服务忙碌", "CONCURRENT_LIMIT_EXCEEDED", "TOO_MANY_REQUESTS"
+]
+
+TIMEOUT_ERRORS = [
+    "read timed out", "connection timeout", "timeout", "timed out"
+]
@@ -0,0 +1,649 @@
+"""基于 asyncio 的任务执行引擎
+
+进程内只有一个后台事件循环，每个任务是一个协程：上传 → 发起 → 轮询 → 获取结果 → 下载。
+轮询等待使用 asyncio.sleep，不再占用线程；阻塞的HTTP调用交给有上限的线程池执行。
+Streamlit 端只负责提交任务和读取任务状态，不再自己启动线程。
+
+任务提交后先进入共享队列（见 task_queue.py），由引擎的分发协程取出执行，
+因此多个进程可以共同消费同一个 Redis 积压队列。配置 RH_EXTERNAL_WORKERS=1 时页面进程的引擎
+不消费队列（consume=False），任务全部交给 python -m runninghub.worker 启动的独立进程执行。
+
+队列、上传名额和 API Key 并发名额三处等待都按任务的调度票排序（见 scheduler.py）：
+页面上单张提交的任务不会排在同一账号的大批量任务之后。
+
+任务的每次状态变更都写入本地任务存储（见 task_store.py）。进程重启后，已发起远端任务的
+任务直接继续等待结果，不再重新上传、发起。
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import (
+    is_concurrent_limit_error, is_timeout_error,
+    upload_file_with_retry, run_task_with_retry,
+    fetch_task_outputs, iter_result_image,
+)
+from .blob_store import get_blob_store
+from .config import (
+    MAX_RETRIES, RETRY_BACKOFF, IO_THREADS, REDIS_URL, EXTERNAL_WORKERS, UPLOAD_CONCURRENCY, DOWNLOAD_CONCURRENCY,
+    ENGINE_MAX_IN_FLIGHT, ENGINE_PREFETCH, QUEUE_POLL_INTERVAL, QUEUE_HEARTBEAT_INTERVAL, WORKER_SHUTDOWN_TIMEOUT,
+    SCHEDULER_SJF, SCHEDULER_DEFAULT_COST, BLOB_PRUNE_INTERVAL,
+)
+from .limiter import create_limiter
+from .poller import StatusPoller
+from .preprocess import UploadStats, preprocess_options, prepare_upload
+from .result_cache import ResultCache, result_cache_key
+from .scheduler import FairSlots, task_ticket
+from .task_queue import create_task_queue
+from .task_store import INPUT_EXPIRED_ERROR, TaskStore
+from .tasks import TaskState, add_listener
+from .upload_cache import UploadCache
+from .workflows import get_workflow, workflow_key, build_node_info, missing_inputs
+
+logger = logging.getLogger("runninghub.engine")
+
+
+class TaskEngine:
+    def __init__(self, io_threads=IO_THREADS, queue=None, limiter=None, max_in_flight=ENGINE_MAX_IN_FLIGHT,
+                 consume=True, store=None, prefetch=ENGINE_PREFETCH):
+        self.io_threads = io_threads
+        self.max_in_flight = max_in_flight
+        self.prefetch = prefetch
+        self.consume = consume
+        self._stopping = False
+        self.queue = queue or create_task_queue()
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="rh-io")
+        self._local = weakref.WeakValueDictionary()  # uid -> 本进程页面提交的 TaskItem
+        self._claimed = {}   # uid -> 本引擎正在处理的 TaskItem，仅在事件循环线程中读写
+        self._unstarted = set()  # 已取出、尚未开始远端运行（等待上传名额、并发名额）的任务
+        self._running = {}   # uid -> asyncio.Task，仅在事件循环线程中读写
+        self._finishing = set()  # 尚未完成的确认/交还操作
+        self._retry_after = {}   # uid -> 失败待重试任务的退避秒数，处理协程结束后交回队列
+        self._inflight = {}  # 结果缓存键 -> asyncio.Future，相同请求只执行一次远端任务
+        self._wakeup = asyncio.Event()
+        self._upload_slots = FairSlots(UPLOAD_CONCURRENCY)
+        self._download_slots = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        self._stages = Counter()  # 阶段 -> 任务数，仅在事件循环线程中读写
+        self.limiter = limiter or create_limiter(io=self._io)
+        self.poller = StatusPoller(self._io)
+        self.blobs = get_blob_store()
+        self.store = store or TaskStore()
+        self.result_cache = ResultCache(referenced=self.store.referenced_blobs)
+        self.upload_cache = UploadCache()
+        self.upload_stats = UploadStats()
+        add_listener(self.store.on_update)
+        self._thread = threading.Thread(target=self._run_loop, name="rh-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.create_task(self._prune_loop())
+        if self.consume:
+            self._dispatcher = self._loop.create_task(self._dispatch_loop())
+            self._loop.create_task(self._heartbeat_loop())
+            if not self.queue.shared:
+                # 进程内队列随进程丢失，从任务存储恢复；共享队列中的任务由租约超时重新投递
+                self._loop.create_task(self._resume_unfinished())
+        self._loop.run_forever()
+
+    async def _prune_loop(self):
+        """定期清理图片文件（按未使用时长和总大小），仍被任务引用的输入、结果保留"""
+        while True:
+            try:
+                await self._io(self._prune_blobs)
+            except Exception:
+                pass
+            await asyncio.sleep(BLOB_PRUNE_INTERVAL)
+
+    def _prune_blobs(self):
+        return self.blobs.prune(keep=self.store.referenced_blobs())
+
+    # --- 对外接口（可在任意线程调用）---
+    def submit(self, task):
+        """提交任务到队列，立即返回；输入文件已被清理的任务（重启失败任务时）直接标记为失败"""
+        self._local[task.uid] = task
+        self.store.add(task)
+        if missing_inputs(task):
+            task.update(status="FAILED", error_message=INPUT_EXPIRED_ERROR, progress=0)
+            return
+        self.queue.put(task, self._ticket(task))
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel(self, tasks):
+        """取消任务（清空任务列表时调用），远端已发起的任务不再跟踪"""
+        uids = [task.uid for task in tasks]
+        for uid in uids:
+            self.queue.cancel(uid)
+        self.store.discard(uids)
+        self._loop.call_soon_threadsafe(self._cancel, uids)
+
+    def sync(self, tasks):
+        """把其他进程处理中的任务状态同步到本地任务对象上"""
+        remote = [task for task in tasks if task.status in ["QUEUED", "PROCESSING"] and task.uid not in self._claimed]
+        if not remote:
+            return
+        states = self.queue.fetch_states(task.uid for task in remote)
+        for task in remote:
+            if task.uid in states:
+                task.update(**states[task.uid]._asdict())
+
+    def is_alive(self):
+        """事件循环线程是否仍在运行"""
+        return self._thread.is_alive()
+
+    def find_lost(self, tasks):
+        """未完成、但不会再被处理的任务：引擎已停止，或队列中已没有该任务（转入死信、被清除）
+
+        其他进程已把结果写入队列的任务先同步状态，不算在内。
+        """
+        unfinished = [task for task in tasks if task.status not in ("SUCCESS", "FAILED")]
+        if not self.is_alive():
+            return unfinished
+        self.sync(unfinished)
+        return [task for task in unfinished
+                if task.status not in ("SUCCESS", "FAILED") and task.uid not in self._claimed
+                and self.queue.is_cancelled(task.uid)]
+
+    def restore_session(self, session_id):
+        """从任务存储恢复会话的任务列表（刷新页面、服务重启后）"""
+        tasks = []
+        for task in self.store.load_session(session_id):
+            # 引擎已恢复执行的任务使用同一个对象，页面上直接看到进度
+            task = self._local.get(task.uid) or task
+            self._local[task.uid] = task
+            tasks.append(task)
+        return tasks
+
+    def shutdown(self, timeout=WORKER_SHUTDOWN_TIMEOUT):
+        """停止取新任务，处理中的任务交还队列，由其他进程接手"""
+        if not self.consume:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        future.result(timeout)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._running),
+            'io_threads': self.io_threads,
+            'deduplicated_waiting': len(self._inflight),
+            'prefetched': len(self._unstarted),
+            'stages': {name: self._stages[name] for name in ("upload", "remote", "download")},
+            'lanes': self.lane_stats(),
+            'queue': self.queue.stats(),
+            'limiter': self.limiter.snapshot(),
+            'result_cache': self.result_cache.stats(),
+            'upload_cache': self.upload_cache.stats(),
+            'uploads': self.upload_stats.stats(),
+            'task_store': self.store.stats(),
+            **self.poller.stats(),
+        }
+
+    def lane_stats(self):
+        """各通道在队列、上传名额、远端名额三处的等待数与等待时间"""
+        return {
+            'queue': self.queue.stats()['lanes'],
+            'upload': self._upload_slots.stats(),
+            'remote': self.limiter.lane_stats(),
+        }
+
+    def _ticket(self, task):
+        """任务的调度票；开启 SCHEDULER_SJF 时代价为该工作流历史远端耗时的中位数"""
+        if not SCHEDULER_SJF:
+            return task_ticket(task)
+        profile = self.poller.history.profile(workflow_key(task))
+        return task_ticket(task, profile['p50'] if profile else SCHEDULER_DEFAULT_COST)
+
+    # --- 事件循环内部 ---
+    async def _dispatch_loop(self):
+        """从队列取出任务并启动处理协程
+
+        只预取足够填满上传和远端名额的任务（prefetch）；其余留在共享队列中，
+        多个 worker 进程时由空闲的进程取走，也不必为只在本地等待的任务续租。
+        """
+        while True:
+            if len(self._claimed) >= self.max_in_flight or len(self._unstarted) >= self.prefetch:
+                # 有任务开始远端运行或结束时唤醒
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._wakeup.clear()
+            try:
+                claimed = await self._io(self.queue.claim)
+            except Exception:
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            uid, descriptor, deliveries = claimed
+            # 本进程提交的任务直接更新页面持有的对象，其他进程提交的任务通过状态快照回写
+            task = self._local.get(uid)
+            if task is None:
+                task = descriptor
+                self.store.add(task)
+            if deliveries > 1 and not task.api_task_id:
+                # 重新投递的任务：之前的处理方可能已经发起了远端任务
+                try:
+                    api_task_id = await self._io(self._previous_remote_task, uid)
+                except Exception:
+                    api_task_id = None
+                if api_task_id:
+                    task.update(api_task_id=api_task_id)
+            self._claimed[uid] = task
+            self._unstarted.add(uid)
+            runner = self._loop.create_task(self._process(task))
+            self._running[uid] = runner
+            runner.add_done_callback(functools.partial(self._on_done, uid))
+
+    def _previous_remote_task(self, uid):
+        api_task_id = self.store.remote_task_id(uid)
+        if not api_task_id:
+            state = self.queue.fetch_states([uid]).get(uid)
+            if state and state.status in ["QUEUED", "PROCESSING"]:
+                api_task_id = state.api_task_id
+        return api_task_id
+
+    async def _resume_unfinished(self):
+        """重新排队重启前未完成的任务"""
+        try:
+            tasks = await self._io(self.store.load_unfinished)
+        except Exception:
+            return
+        for task in tasks:
+            if task.status == "FAILED":
+                continue  # 输入文件已被清理，恢复时已标记为失败
+            if not await self._io(self.queue.is_cancelled, task.uid):
+                continue  # 已在队列中（启动后页面刚提交的任务）
+            # 页面已恢复的任务使用同一个对象
+            task = self._local.setdefault(task.uid, task)
+            await self._io(self.queue.put, task, self._ticket(task))
+        self._wakeup.set()
+
+    def _started(self, uid):
+        """任务开始远端运行（或不再需要本地名额），可以再取一个任务"""
+        if uid in self._unstarted:
+            self._unstarted.discard(uid)
+            self._wakeup.set()
+
+    def _begin(self, task):
+        """任务实际开始处理（取得上传名额、命中缓存等）时才标记为处理中，等待名额期间仍显示排队"""
+        if task.status != "PROCESSING":
+            task.update(status="PROCESSING", start_time=time.time())
+
+    def _on_done(self, uid, runner):
+        self._started(uid)
+        self._running.pop(uid, None)
+        task = self._claimed.pop(uid, None)
+        retry_after = self._retry_after.pop(uid, None)
+        if retry_after is not None:
+            # 到期时唤醒分发协程，不必等下一次轮询
+            self._loop.call_later(retry_after, self._wakeup.set)
+        finishing = self._loop.run_in_executor(self._executor, self._finish, uid, task, retry_after)
+        self._finishing.add(finishing)
+        finishing.add_done_callback(self._finishing.discard)
+        finishing.add_done_callback(_consume_exception)
+
+    def _finish(self, uid, task, retry_after=None):
+        if retry_after is not None and task is not None and task.status == "QUEUED":
+            if uid not in self._local:
+                self.queue.publish_state(uid, task.snapshot())
+            self.queue.retry(task, retry_after)
+            return
+        if self._stopping and task is not None and task.status in ["QUEUED", "PROCESSING"]:
+            # 进程退出时被中断的任务，放回队列
+            task.update(status="QUEUED", progress=0)
+            if uid not in self._local:
+                self.queue.publish_state(uid, task.snapshot())
+            self.queue.release(uid)
+            return
+        if task is not None and uid not in self._local:
+            self.queue.publish_state(uid, task.snapshot())
+        self.queue.ack(uid)
+
+    async def _heartbeat_loop(self):
+        """续租处理中的任务，回写其他进程任务的状态，重新投递超时任务"""
+        while True:
+            await asyncio.sleep(QUEUE_HEARTBEAT_INTERVAL)
+            try:
+                await self._io(self._heartbeat, dict(self._claimed))
+            except Exception:
+                pass
+
+    def _heartbeat(self, claimed):
+        cancelled = []
+        for uid, task in claimed.items():
+            self.queue.extend(uid)
+            if self.queue.is_cancelled(uid):
+                cancelled.append(uid)
+            elif uid not in self._local:
+                self.queue.publish_state(uid, task.snapshot())
+        if cancelled:
+            self._loop.call_soon_threadsafe(self._cancel, cancelled)
+
+        for uid in self.queue.requeue_expired():
+            # 多次投递都没有处理完（进程反复中断），转入死信队列
+            self.queue.publish_state(uid, TaskState(status="FAILED", error_message="任务多次中断，已停止重试"))
+
+    async def _shutdown(self):
+        self._stopping = True
+        self._dispatcher.cancel()
+        runners = list(self._running.values())
+        for runner in runners:
+            runner.cancel()
+        if runners:
+            await asyncio.wait(runners)
+        await asyncio.sleep(0)
+        # 等 _on_done 中提交的交还操作执行完
+        if self._finishing:
+            await asyncio.wait(list(self._finishing))
+
+    def _cancel(self, uids):
+        for uid in uids:
+            runner = self._running.get(uid)
+            if runner:
+                runner.cancel()
+
+    async def _io(self, func, *args, **kwargs):
+        """在线程池中执行阻塞调用"""
+        return await self._loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _process(self, task):
+        """处理单个任务的统一入口
+
+        任务分阶段执行（见 _execute_remote），只有远端运行阶段占用 API Key 的并发名额。
+        失败可重试时不在这里等待：协程结束、释放名额，任务交回队列的计时集合，退避时间到后重新排队。
+        取出后先保持排队状态，开始上传时才标记为处理中（见 _begin）。
+        """
+        task.update(retry_at=None)
+        if missing_inputs(task):
+            # 其他进程提交、输入文件已被清理（或不在共享存储上）的任务
+            task.update(status="FAILED", error_message=INPUT_EXPIRED_ERROR, progress=0)
+            return
+        try:
+            await self._run_workflow(task)
+            task.update(progress=100, status="SUCCESS", elapsed_time=time.time() - task.start_time)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = self._handle_error(task, e)
+            if delay is not None:
+                self._retry_after[task.uid] = delay
+
+    async def _run_workflow(self, task):
+        spec = get_workflow(task)
+        input_digests = self._input_digests(task, spec)
+        cache_key = result_cache_key(spec, input_digests)
+
+        cached = await self._io(self.result_cache.get, cache_key)
+        if cached:
+            self._started(task.uid)
+            self._begin(task)
+            self._apply_results(task, cached, cache_hit=True)
+            return
+
+        # 相同的请求正在执行时等待它的结果；若它被取消则由本任务接手执行
+        while cache_key in self._inflight:
+            leader = self._inflight[cache_key]
+            # 等待期间不占用本地名额
+            self._started(task.uid)
+            self._begin(task)
+            try:
+                results = await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                if leader.cancelled():
+                    continue
+                raise
+            self._apply_results(task, results, cache_hit=True)
+            return
+
+        leader = self._loop.create_future()
+        leader.add_done_callback(_consume_exception)
+        self._inflight[cache_key] = leader
+        try:
+            results = await self._execute_remote(task, spec, input_digests)
+            leader.set_result(results)
+        except asyncio.CancelledError:
+            leader.cancel()
+            raise
+        except Exception as e:
+            leader.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+        self._apply_results(task, results)
+        # 远端任务已经成功，写缓存失败（磁盘已满等）只影响之后的复用，不改变本任务和等待者的结果
+        try:
+            await self._io(self.result_cache.put, cache_key, results)
+        except Exception as e:
+            logger.warning("写入结果缓存失败 %s: %s", task.uid, e)
+
+    def _input_digests(self, task, spec):
+        # 输入图片已在提交时写入 BlobStore，直接使用文件哈希
+        return {node_id: getattr(task, data_attr).digest for node_id, data_attr, _ in spec["inputs"]}
+
+    async def _execute_remote(self, task, spec, input_digests):
+        """上传 → 发起 → 等待 → 下载，返回结果（与 ResultCache 的格式相同）
+
+        三个阶段各有自己的名额：上传受 UPLOAD_CONCURRENCY 限制，在等待远端名额之前完成；
+        只有发起到远端完成占用 limiter 的名额，完成后立即交给下一个已上传好的任务；
+        获取结果和下载受 DOWNLOAD_CONCURRENCY 限制。
+        """
+        api_key = spec["api_key"]
+        ticket = self._ticket(task)
+
+        if task.api_task_id:
+            # 重启前已发起的远端任务，继续等待结果（远端仍占着名额）
+            self._begin(task)
+            async with self._stage("remote"), self.limiter.permit(api_key, task.session_id, task.uid, ticket):
+                self._started(task.uid)
+                await self._wait_remote(task, api_key)
+            task.update(progress=95)
+            return await self._collect_results(task, api_key, spec)
+
+        async with self._stage("upload"), self._upload_slots.slot(ticket):
+            self._begin(task)
+            uploaded_files, reused = await self._upload_inputs(task, spec, input_digests)
+        task.update(progress=25)
+
+        async with self._stage("remote"), self.limiter.permit(api_key, task.session_id, task.uid, ticket):
+            self._started(task.uid)
+            task.update(progress=35)
+            try:
+                api_task_id, reused = await self._start_remote(task, spec, input_digests, uploaded_files, reused)
+            except Exception as e:
+                self._record_outcome(api_key, task, str(e))
+                raise
+            self._record_outcome(api_key, task)
+            task.update(api_task_id=api_task_id)
+
+            try:
+                await self._wait_remote(task, api_key, submitted_at=time.time())
+            except Exception:
+                # 远端失败时不确定是否与复用的文件有关，下次重新上传
+                self._invalidate_uploads(spec, input_digests, reused)
+                raise
+
+        task.update(progress=95)
+        return await self._collect_results(task, api_key, spec)
+
+    async def _start_remote(self, task, spec, input_digests, uploaded_files, reused):
+        """发起远端任务，返回 (api_task_id, 复用缓存文件名的nodeId集合)"""
+        api_key = spec["api_key"]
+        node_info_list = build_node_info(spec, uploaded_files)
+        try:
+            api_task_id = await self._io(
+                run_task_with_retry, api_key, spec["webapp_id"], node_info_list, instance_type=spec["instance_type"])
+        except Exception as e:
+            if not reused or is_timeout_error(str(e)) or is_concurrent_limit_error(str(e)):
+                raise
+            # 服务端拒绝了缓存的文件名（可能已过期），重新上传后再发起一次
+            self._invalidate_uploads(spec, input_digests, reused)
+            uploaded_files, reused = await self._upload_inputs(task, spec, input_digests, bypass_cache=reused)
+            node_info_list = build_node_info(spec, uploaded_files)
+            api_task_id = await self._io(
+                run_task_with_retry, api_key, spec["webapp_id"], node_info_list, instance_type=spec["instance_type"])
+        return api_task_id, reused
+
+    def _record_outcome(self, api_key, task, error_msg=None):
+        """把发起结果交给自适应并发控制：成功 / 并发限制或超时（拥塞）/ 其他错误
+
+        只统计提交，远端运行慢（等待结果超时）不是提交被拒绝，不影响窗口。
+        """
+        if error_msg is None:
+            outcome = "success"
+        elif is_concurrent_limit_error(error_msg) or is_timeout_error(error_msg):
+            outcome = "congestion"
+        else:
+            outcome = "error"
+        self.limiter.record(api_key, outcome, task.uid)
+
+    @contextlib.asynccontextmanager
+    async def _stage(self, name):
+        """统计各阶段的任务数（含等待名额的任务）"""
+        self._stages[name] += 1
+        try:
+            yield
+        finally:
+            self._stages[name] -= 1
+
+    async def _upload_inputs(self, task, spec, input_digests, bypass_cache=()):
+        """上传输入图片，返回 ({nodeId: fileName}, 复用缓存文件名的nodeId集合)
+
+        bypass_cache 中的节点不查缓存，强制重新上传。
+        """
+        api_key = spec["api_key"]
+        options = preprocess_options(spec)
+        uploaded_files = {}
+        reused = set()
+        for i, (node_id, data_attr, name_attr) in enumerate(spec["inputs"]):
+            task.update(progress=15 if len(spec["inputs"]) == 1 else 10 * (i + 1))
+            digest = input_digests[node_id]
+            file_name = None
+            if node_id not in bypass_cache:
+                file_name = await self._io(self.upload_cache.get, api_key, digest, options)
+            if file_name:
+                reused.add(node_id)
+            else:
+                file_name = await self._io(
+                    self._upload, getattr(task, data_attr), getattr(task, name_attr), api_key, spec)
+                await self._io(self.upload_cache.put, api_key, digest, file_name, options)
+            uploaded_files[node_id] = file_name
+        return uploaded_files, reused
+
+    def _upload(self, blob, file_name, api_key, spec):
+        """按工作流配置预处理后上传（在线程池中执行），记录上传前后的字节数与耗时"""
+        started = time.monotonic()
+        data, upload_name = prepare_upload(blob, file_name, preprocess_options(spec), self.blobs)
+        prepared = time.monotonic()
+        uploaded = upload_file_with_retry(data, upload_name, api_key)
+        self.upload_stats.record(blob.size, data.size, prepared - started, time.monotonic() - prepared)
+        return uploaded
+
+    def _invalidate_uploads(self, spec, input_digests, node_ids):
+        options = preprocess_options(spec)
+        for node_id in node_ids:
+            self.upload_cache.invalidate(spec["api_key"], input_digests[node_id], options)
+
+    async def _wait_remote(self, task, api_key, submitted_at=None):
+        """交给集中轮询器等待远端任务完成，状态变化回写到任务上
+
+        submitted_at 为本次发起远端任务的时间；继续等待重启前发起的任务时不知道，耗时不计入历史。
+        """
+        timeout = self.poller.timeout
+
+        def on_status(status, elapsed):
+            task.update(remote_status=status, progress=min(90, 35 + (55 * elapsed / timeout)))
+
+        await self.poller.watch(api_key, task.api_task_id, on_status, workflow=workflow_key(task),
+                                submitted_at=submitted_at)
+
+    async def _collect_results(self, task, api_key, spec):
+        """获取并下载结果（不占用远端名额）"""
+        async with self._stage("download"), self._download_slots:
+            if spec["multi_output"]:
+                result_urls = await self._io(fetch_task_outputs, api_key, task.api_task_id, task.task_type)
+                blobs = await asyncio.gather(*(self._io(self._download, url) for url in result_urls))
+                return {'result_data_list': [{'blob': blob, 'url': url} for blob, url in zip(blobs, result_urls)]}
+
+            result_url = await self._io(fetch_task_outputs, api_key, task.api_task_id, task.task_type)
+            return {'result_data': await self._io(self._download, result_url)}
+
+    def _download(self, url):
+        """边下载边写入本地文件，返回 BlobRef"""
+        return self.blobs.write_stream(iter_result_image(url))
+
+    def _apply_results(self, task, results, cache_hit=False):
+        if 'result_data_list' in results:
+            task.update(cache_hit=cache_hit, result_data_list=[
+                {
+                    'blob': item['blob'],
+                    'filename': f"pose_result_{i+1}_{task.character_image_name}",
+                    'url': item['url']
+                }
+                for i, item in enumerate(results['result_data_list'])
+            ])
+        else:
+            task.update(cache_hit=cache_hit, result_data=results['result_data'])
+
+    def _handle_error(self, task, error):
+        """统一处理任务错误，返回重新排队前的等待秒数，不再重试时返回 None"""
+        error_msg = str(error)
+        task.update(elapsed_time=time.time() - task.start_time if task.start_time else 0)
+
+        is_timeout = is_timeout_error(error_msg)
+        is_concurrent = is_concurrent_limit_error(error_msg)
+
+        if is_timeout:
+            task.update(timeout_count=task.timeout_count + 1)
+
+        if (is_concurrent or is_timeout) and task.retry_count < MAX_RETRIES:
+            if is_timeout:
+                delay = backoff_delay(RETRY_BACKOFF["timeout"], task.timeout_count)
+            else:
+                delay = backoff_delay(RETRY_BACKOFF["concurrent"], task.retry_count + 1)
+            task.update(retry_count=task.retry_count + 1, status="QUEUED", progress=0, api_task_id=None,
+                        retry_at=time.time() + delay)
+            return delay
+
+        task.update(status="FAILED", error_message=error_msg[:150])
+        return None
+
+
+def backoff_delay(policy, attempt):
+    """第 attempt 次重试前的等待秒数（policy 见 config.RETRY_BACKOFF）"""
+    delay = min(policy["max"], policy["base"] * policy["factor"] ** max(0, attempt - 1))
+    return delay + random.uniform(0, policy["jitter"])
+
+
+def _consume_exception(future):
+    # 没有等待者时也不要报 "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """获取进程内唯一的任务引擎（所有 Streamlit 会话共享）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # 外部 worker 模式依赖共享队列，没有配置 Redis 时仍在本进程执行
+                _engine = TaskEngine(consume=not (EXTERNAL_WORKERS and REDIS_URL))
+    return _engine
@@ -0,0 +1,81 @@
+"""批量导出结果
+
+把选中任务的结果图片打包成一个 ZIP：结果图片本身已经压缩，使用 ZIP_STORED 不再压缩，
+每个文件从 BlobStore 按块复制进压缩包。压缩包写入 SpooledTemporaryFile，
+超过 EXPORT_SPOOL_BYTES 后落到磁盘，不在内存中拼出整个压缩包。
+文件已被清理的结果跳过，列在压缩包内的 MISSING_MANIFEST 中，不影响其他文件的下载。
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+
+from .config import BLOB_CHUNK_SIZE, EXPORT_SPOOL_BYTES
+
+# 单结果工作流下载文件名的前缀
+RESULT_PREFIXES = {
+    "watermark": "watermark_removed_",
+    "lighting": "lighting_",
+    "enhance": "optimized_",
+}
+
+# 列出缺失结果文件的清单
+MISSING_MANIFEST = "缺失文件.txt"
+
+
+def result_files(task):
+    """任务的结果文件 [(文件名, BlobRef)]，未完成的任务返回空列表"""
+    if task.status != "SUCCESS":
+        return []
+    if task.task_type == "pose":
+        return [(result['filename'], result['blob']) for result in task.result_data_list]
+    if task.result_data is None:
+        return []
+    return [(f"{RESULT_PREFIXES[task.task_type]}{task.file_name}", task.result_data)]
+
+
+def export_entries(tasks):
+    """压缩包中的 [(路径, BlobRef, 任务创建时间)]
+
+    文件名前加任务编号，避免不同任务的同名图片互相覆盖；姿态迁移的多个结果放在同一任务编号下。
+    """
+    entries = []
+    used = set()
+    for task in tasks:
+        for name, blob in result_files(task):
+            arcname = f"{task.task_id:03d}_{os.path.basename(name)}"
+            stem, ext = os.path.splitext(arcname)
+            n = 1
+            while arcname in used:
+                n += 1
+                arcname = f"{stem}_{n}{ext}"
+            used.add(arcname)
+            entries.append((arcname, blob, task.created_at))
+    return entries
+
+
+def export_zip(tasks):
+    """打包任务结果，返回已回到开头的文件对象"""
+    archive = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    try:
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            missing = []
+            for arcname, blob, created_at in export_entries(tasks):
+                try:
+                    src = blob.open()  # 先打开源文件，缺失时不会在压缩包里留下半个条目
+                except FileNotFoundError:
+                    missing.append(arcname)
+                    continue
+                info = zipfile.ZipInfo(arcname, date_time=created_at.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = blob.size
+                with src, zf.open(info, "w") as dest:
+                    shutil.copyfileobj(src, dest, BLOB_CHUNK_SIZE)
+            if missing:
+                lines = ["以下结果文件已被清理，未包含在压缩包中：", *missing]
+                zf.writestr(MISSING_MANIFEST, "\n".join(lines) + "\n")
+    except BaseException:
+        archive.close()
+        raise
+    archive.seek(0)
+    return archive
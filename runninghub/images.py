@@ -0,0 +1,128 @@
+"""图片元数据与预览缩略图缓存
+
+上传区每次重跑都要显示图片尺寸和预览。这里按内容哈希缓存元数据（宽高、格式、字节数）
+和缩小后的预览图，所有会话共享，同一张图片只解析一次：
+
+- 元数据只读取文件头（Pillow 打开图片时不解码像素）
+- 缩略图对 JPEG 使用 draft 模式按缩小比例解码，再缩放到 THUMBNAIL_SIZE 以内
+- 两者都按最近使用淘汰，元数据限制条数，缩略图限制总字节数
+"""
+import io
+import threading
+from collections import OrderedDict, namedtuple
+
+from .config import IMAGE_INFO_CACHE_ENTRIES, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_SIZE
+
+ImageInfo = namedtuple("ImageInfo", ("width", "height", "format", "size"))
+
+_MISSING = object()
+
+
+def _file_size(fileobj):
+    fileobj.seek(0, io.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+class ImageCache:
+    def __init__(self, max_entries=IMAGE_INFO_CACHE_ENTRIES, max_thumbnail_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_thumbnail_bytes = max_thumbnail_bytes
+        self._lock = threading.Lock()
+        self._infos = OrderedDict()       # digest -> ImageInfo，无法识别的文件为 None
+        self._thumbnails = OrderedDict()  # (digest, 最长边) -> 缩略图字节，无法生成时为 None
+        self._thumbnail_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, entries, key):
+        with self._lock:
+            value = entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def info(self, digest, fileobj):
+        """图片元数据，不是可识别的图片时返回 None"""
+        info = self._lookup(self._infos, digest)
+        if info is not _MISSING:
+            return info
+
+        try:
+            from PIL import Image
+            fileobj.seek(0)
+            with Image.open(fileobj) as img:  # 只解析文件头
+                info = ImageInfo(img.width, img.height, img.format, _file_size(fileobj))
+        except Exception:
+            info = None
+        finally:
+            fileobj.seek(0)
+
+        with self._lock:
+            self._infos[digest] = info
+            self._infos.move_to_end(digest)
+            while len(self._infos) > self.max_entries:
+                self._infos.popitem(last=False)
+        return info
+
+    def thumbnail(self, digest, fileobj, max_size=THUMBNAIL_SIZE):
+        """缩小后的预览图（JPEG，带透明通道时为 PNG），无法解码时返回 None"""
+        key = (digest, max_size)
+        data = self._lookup(self._thumbnails, key)
+        if data is not _MISSING:
+            return data
+
+        try:
+            from PIL import Image
+            fileobj.seek(0)
+            with Image.open(fileobj) as img:
+                img.draft("RGB", (max_size, max_size))  # JPEG 按 1/2~1/8 比例直接解码
+                img.thumbnail((max_size, max_size))
+                out = io.BytesIO()
+                if img.mode in ("RGBA", "LA", "P"):
+                    img.convert("RGBA").save(out, format="PNG", optimize=True)
+                else:
+                    img.convert("RGB").save(out, format="JPEG", quality=85)
+            data = out.getvalue()
+        except Exception:
+            data = None
+        finally:
+            fileobj.seek(0)
+
+        size = len(data) if data else 0
+        if size > self.max_thumbnail_bytes:
+            return data
+        with self._lock:
+            old = self._thumbnails.pop(key, None)
+            self._thumbnail_bytes += size - (len(old) if old else 0)
+            self._thumbnails[key] = data
+            while self._thumbnail_bytes > self.max_thumbnail_bytes and self._thumbnails:
+                _, evicted = self._thumbnails.popitem(last=False)
+                self._thumbnail_bytes -= len(evicted) if evicted else 0
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                'infos': len(self._infos),
+                'thumbnails': len(self._thumbnails),
+                'thumbnail_bytes': self._thumbnail_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_image_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageCache()
+    return _cache
@@ -0,0 +1,219 @@
+"""压缩包 / 服务器目录批量导入
+
+大批量图片以 ZIP、TAR 压缩包或服务器上的目录提交。导入在后台线程中逐个读取条目：
+先按扩展名、大小和文件头过滤掉非图片条目，再把图片按块写入 BlobStore、创建任务并提交。
+每个导入任务最多同时有 INGEST_BACKLOG 张图片未完成（排队、等待名额或处理中），达到时暂停读取，
+剩余的图片留在压缩包里，不会一次性读进内存或全部进入队列。
+
+上传的压缩包先按块复制到 INGEST_DIR，导入结束后删除。
+"""
+import functools
+import itertools
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import uuid
+import zipfile
+
+from .blob_store import get_blob_store
+from .config import (
+    BLOB_CHUNK_SIZE, INGEST_BACKLOG, INGEST_DIR, INGEST_MAX_FILE_BYTES, INGEST_POLL_INTERVAL, INGEST_ROOTS,
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+ARCHIVE_TYPES = ["zip", "tar", "gz", "tgz"]
+MAX_SKIPPED_SAMPLES = 20  # 每个导入任务保留的跳过原因条数
+
+
+# --- 条目来源 ---
+def iter_zip(path):
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size, functools.partial(zf.open, info)
+
+def iter_tar(path):
+    # 流式读取，不预先建立成员列表
+    with tarfile.open(path, mode="r|*") as tf:
+        for member in tf:
+            if member.isfile():
+                yield member.name, member.size, functools.partial(tf.extractfile, member)
+
+def iter_directory(path):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            try:
+                size = os.path.getsize(full_path)
+            except OSError:
+                continue
+            yield os.path.relpath(full_path, path), size, functools.partial(open, full_path, "rb")
+
+def iter_source(path):
+    """按路径类型返回条目迭代器，条目为 (名称, 字节数, 打开函数)"""
+    if os.path.isdir(path):
+        return iter_directory(path)
+    if zipfile.is_zipfile(path):
+        return iter_zip(path)
+    if tarfile.is_tarfile(path):
+        return iter_tar(path)
+    raise Exception("不支持的文件格式，请使用 ZIP 或 TAR 压缩包")
+
+def resolve_ingest_path(path):
+    """检查服务器路径位于 INGEST_ROOTS 之内，返回规范化后的路径"""
+    real_path = os.path.realpath(path)
+    for root in INGEST_ROOTS:
+        root = os.path.realpath(root)
+        if os.path.commonpath([real_path, root]) == root:
+            if not os.path.exists(real_path):
+                raise Exception(f"路径不存在: {path}")
+            return real_path
+    raise Exception("该路径不在允许导入的目录中")
+
+def spool_upload(fileobj):
+    """把上传的压缩包按块复制到 INGEST_DIR，返回文件路径"""
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=INGEST_DIR)
+    with os.fdopen(fd, "wb") as f:
+        fileobj.seek(0)
+        shutil.copyfileobj(fileobj, f, BLOB_CHUNK_SIZE)
+    return path
+
+
+def _looks_like_image(head):
+    return (head.startswith(b"\x89PNG\r\n\x1a\n") or head.startswith(b"\xff\xd8\xff")
+            or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"))
+
+def skip_reason(name, size):
+    """按名称和大小判断条目是否跳过，返回跳过原因，可以导入时返回 None"""
+    base = os.path.basename(name)
+    if base.startswith(".") or "__MACOSX" in name.split("/"):
+        return "系统文件"
+    if not base.lower().endswith(IMAGE_EXTENSIONS):
+        return "不是支持的图片格式"
+    if size <= 0:
+        return "文件为空"
+    if size > INGEST_MAX_FILE_BYTES:
+        return "超过大小上限"
+    return None
+
+
+# --- 导入任务 ---
+class IngestJob:
+    """一个压缩包或目录的导入，在后台线程中逐个提交"""
+
+    def __init__(self, source_name, entries, make_task, board, engine, backlog=INGEST_BACKLOG, cleanup=None):
+        self.id = uuid.uuid4().hex
+        self.source_name = source_name
+        self.status = "RUNNING"  # RUNNING / DONE / CANCELLED / FAILED
+        self.submitted = 0
+        self.skipped = 0
+        self.skipped_samples = []  # [(名称, 原因)]
+        self.error = None
+        self._entries = entries
+        self._make_task = make_task  # make_task(task_id, blob, file_name) -> TaskItem
+        self._board = board
+        self._engine = engine
+        self._backlog = backlog
+        self._cleanup = cleanup
+        self._blobs = get_blob_store()
+        self._pending = []  # 本导入提交后尚未完成的任务
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rh-ingest", daemon=True)
+
+    @property
+    def finished(self):
+        return self.status != "RUNNING"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """停止读取后续条目，已提交的任务不受影响"""
+        self._cancelled.set()
+
+    def _run(self):
+        try:
+            for name, size, opener in self._entries:
+                if self._cancelled.is_set():
+                    break
+                reason = skip_reason(name, size)
+                if reason is None:
+                    # 先等待排队名额，再读取条目内容
+                    if not self._wait_for_room():
+                        break
+                    blob = self._store(opener)
+                    if blob is None:
+                        reason = "文件内容不是有效图片"
+                if reason:
+                    self._skip(name, reason)
+                    continue
+                task = self._make_task(self._board.next_task_id(), blob, os.path.basename(name))
+                self._board.add(task)
+                self._engine.submit(task)
+                self._pending.append(task)
+                self.submitted += 1
+            self.status = "CANCELLED" if self._cancelled.is_set() else "DONE"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "FAILED"
+        finally:
+            close = getattr(self._entries, "close", None)
+            if close:
+                close()
+            if self._cleanup:
+                self._cleanup()
+
+    def _wait_for_room(self):
+        while True:
+            # 独立 worker 模式下任务状态在其他进程中变化，先同步
+            self._engine.sync(self._pending)
+            # 引擎取出任务后立即标记为处理中，等待上传、并发名额的任务也要计入
+            self._pending = [task for task in self._pending if task.status not in ("SUCCESS", "FAILED")]
+            if len(self._pending) < self._backlog:
+                return True
+            if self._cancelled.wait(INGEST_POLL_INTERVAL):
+                return False
+
+    def _store(self, opener):
+        """检查文件头后按块写入 BlobStore，不是图片时返回 None"""
+        with opener() as f:
+            head = f.read(16)
+            if not _looks_like_image(head):
+                return None
+            return self._blobs.write_stream(itertools.chain([head], iter(lambda: f.read(BLOB_CHUNK_SIZE), b"")))
+
+    def _skip(self, name, reason):
+        self.skipped += 1
+        if len(self.skipped_samples) < MAX_SKIPPED_SAMPLES:
+            self.skipped_samples.append((name, reason))
+
+
+_jobs = {}  # session_id -> [IngestJob]
+_jobs_lock = threading.Lock()
+MAX_JOBS_PER_SESSION = 10  # 每个会话保留的导入记录数（含已结束的）
+
+def start_ingest(session_id, source_name, entries, make_task, board, engine, cleanup=None):
+    job = IngestJob(source_name, entries, make_task, board, engine, cleanup=cleanup)
+    with _jobs_lock:
+        jobs = _jobs.setdefault(session_id, [])
+        jobs.append(job)
+        # 只丢弃已结束的旧记录
+        while len(jobs) > MAX_JOBS_PER_SESSION and jobs[0].finished:
+            jobs.pop(0)
+    return job.start()
+
+def session_jobs(session_id):
+    with _jobs_lock:
+        return list(_jobs.get(session_id, ()))
+
+def cancel_session_jobs(session_id):
+    """停止会话的所有导入并清除记录（清空任务列表时调用）"""
+    with _jobs_lock:
+        jobs = _jobs.pop(session_id, [])
+    for job in jobs:
+        job.cancel()
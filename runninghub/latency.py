@@ -0,0 +1,68 @@
+"""按工作流统计远端耗时并据此安排状态查询时间
+
+每个工作流保留最近 LATENCY_WINDOW 次远端耗时（从发起任务到查询到 SUCCESS）。
+样本足够后，第一次查询安排在最快的一批任务完成前后（p05），
+p05–p95 区间内按 POLL_INTERVAL 密集查询，超过 p95 后逐渐拉长间隔。
+"""
+import threading
+from collections import deque
+
+from .config import POLL_INTERVAL, POLL_MAX_INTERVAL, LATENCY_WINDOW, LATENCY_MIN_SAMPLES
+
+
+def _quantile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class LatencyHistory:
+    def __init__(self, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = {}     # workflow -> deque[秒]
+        self._profiles = {}    # workflow -> {'p05','p50','p95'} 缓存，记录新样本时失效
+
+    def record(self, workflow, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(workflow, deque(maxlen=self.window))
+            samples.append(seconds)
+            self._profiles.pop(workflow, None)
+
+    def profile(self, workflow):
+        """返回耗时分位数，样本不足时返回 None"""
+        with self._lock:
+            if workflow in self._profiles:
+                return self._profiles[workflow]
+            samples = self._samples.get(workflow)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+            profile = {
+                'p05': _quantile(ordered, 0.05),
+                'p50': _quantile(ordered, 0.50),
+                'p95': _quantile(ordered, 0.95),
+                'samples': len(ordered),
+            }
+            self._profiles[workflow] = profile
+            return profile
+
+    def snapshot(self):
+        return {workflow: self.profile(workflow) for workflow in list(self._samples)}
+
+
+def next_poll_delay(elapsed, profile, interval=POLL_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+    """根据已等待时间和历史分布计算距下一次查询的秒数"""
+    if profile is None:
+        return interval
+
+    first = max(interval, profile['p05'] * 0.9)
+    if elapsed < first:
+        return first - elapsed
+    if elapsed < profile['p95']:
+        return interval
+
+    # 超过 p95 后按超出的程度线性放宽间隔
+    spread = max(profile['p95'] - profile['p50'], interval)
+    overdue = elapsed - profile['p95']
+    return min(max_interval, interval * (1 + overdue / spread))
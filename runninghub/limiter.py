@@ -0,0 +1,335 @@
+"""按 API Key 的全局并发限制
+
+同一个 API Key 下所有会话、所有进程共用一组名额，名额数由自适应并发控制（见 adaptive.py）
+给出：发起顺利时逐步增加，遇到并发限制时减半，熔断期间为 0，半开时额外放行一个试探任务。名额空出时按等待者的调度票
+（通道、会话 + 工作流的加权公平，见 scheduler.py）决定顺序，某个会话的大批量任务不会占满整个账号，
+页面上单张提交的任务也不必排在批量任务之后。
+
+- LocalLimiter：单进程实现，运行在引擎事件循环中
+- RedisLimiter：多进程共享，名额带租约，持有方定期续租；进程退出后租约到期自动释放
+
+两者都通过 permit() 使用，任务失败、被取消时都会释放名额。
+"""
+import asyncio
+import contextlib
+import hashlib
+import time
+
+from .adaptive import HALF_OPEN, ConcurrencyController
+from .config import (
+    MAX_CONCURRENT, ADAPTIVE_MAX_CONCURRENT, REDIS_URL, LIMITER_NAMESPACE, LIMITER_LEASE_TTL, LIMITER_POLL_INTERVAL,
+)
+from .scheduler import LANES, DEFAULT_LANE, FairScheduler, LaneWaits, Ticket
+
+
+class _LimiterBase:
+    @contextlib.asynccontextmanager
+    async def permit(self, api_key, session_id, holder_id, ticket=None):
+        """ticket 为调度票，未指定时按会话公平"""
+        await self.acquire(api_key, session_id, holder_id, ticket or Ticket(DEFAULT_LANE, session_id, 1, 1.0))
+        try:
+            yield
+        finally:
+            await self.release(api_key, holder_id)
+
+    def record(self, api_key, outcome, holder_id=None):
+        """记录 holder_id 一次发起的结果，调整该 API Key 的并发窗口（见 adaptive.py）"""
+        self.controller.record(api_key, outcome, holder_id)
+
+    def lane_stats(self):
+        """各通道等待名额的任务数与等待时间"""
+        waiting = dict.fromkeys(LANES, 0)
+        for usage in self.snapshot().values():
+            for lane, count in usage['lanes'].items():
+                waiting[lane] = waiting.get(lane, 0) + count
+        return self.waits.stats(waiting)
+
+
+class LocalLimiter(_LimiterBase):
+    def __init__(self, capacity=MAX_CONCURRENT, max_capacity=ADAPTIVE_MAX_CONCURRENT):
+        self.capacity = capacity  # 初始名额数
+        self.controller = ConcurrencyController(capacity, max_capacity)
+        self.waits = LaneWaits()
+        self._keys = {}
+
+    def _state(self, api_key):
+        if api_key not in self._keys:
+            # holders: holder_id -> (session_id, 持有协程)；waiters: 调度器；pending: holder_id -> (session_id, future)
+            # reopen: 熔断期间安排的重新分配
+            self._keys[api_key] = {'api_key': api_key, 'holders': {}, 'waiters': FairScheduler(self.waits),
+                                   'pending': {}, 'reopen': None}
+        return self._keys[api_key]
+
+    async def acquire(self, api_key, session_id, holder_id, ticket):
+        state = self._state(api_key)
+        future = asyncio.get_running_loop().create_future()
+        state['pending'][holder_id] = (session_id, future)
+        state['waiters'].push(holder_id, ticket)
+        self._grant(state)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if state['waiters'].remove(holder_id):
+                state['pending'].pop(holder_id, None)
+            if future.done() and not future.cancelled():
+                # 刚分到名额就被取消
+                state['holders'].pop(holder_id, None)
+                self._grant(state)
+            raise
+        state['holders'][holder_id] = (session_id, asyncio.current_task())
+
+    async def release(self, api_key, holder_id):
+        state = self._state(api_key)
+        state['holders'].pop(holder_id, None)
+        self._grant(state)
+
+    def record(self, api_key, outcome, holder_id=None):
+        super().record(api_key, outcome, holder_id)
+        if api_key in self._keys:
+            # 窗口变大或熔断恢复时立即放行等待者，不必等到有任务释放名额
+            self._grant(self._keys[api_key])
+
+    def _grant(self, state):
+        api_key = state['api_key']
+        holders = state['holders']
+        # 持有协程已结束但没有释放的名额（异常退出等），直接回收
+        for holder_id, (_, owner) in list(holders.items()):
+            if owner is not None and owner.done():
+                del holders[holder_id]
+
+        if self.controller.breaker(api_key) == HALF_OPEN:
+            # 半开：熔断前放行的任务不计，只额外放行一个试探任务
+            if state['waiters'] and self.controller.reserve_probe(api_key):
+                holder_id = self._grant_next(state)
+                if holder_id is None:
+                    self.controller.cancel_probe(api_key)
+                else:
+                    self.controller.assign_probe(api_key, holder_id)
+        else:
+            capacity = self.controller.capacity(api_key)
+            while len(holders) < capacity and self._grant_next(state) is not None:
+                pass
+
+        delay = self.controller.reopen_in(api_key)
+        if delay > 0 and state['waiters'] and state['reopen'] is None:
+            # 熔断中或试探任务未结束，到时再分配（没有任务释放名额时也不会一直等下去）
+            state['reopen'] = asyncio.get_running_loop().call_later(delay + 0.05, self._reopen, state)
+
+    def _grant_next(self, state):
+        """把名额交给排在最前的等待者并返回其 holder_id，没有等待者时返回 None"""
+        while True:
+            popped = state['waiters'].pop()
+            if popped is None:
+                return None
+            holder_id = popped[0]
+            session_id, future = state['pending'].pop(holder_id)
+            if not future.done():
+                state['holders'][holder_id] = (session_id, None)
+                future.set_result(True)
+                return holder_id
+
+    def _reopen(self, state):
+        state['reopen'] = None
+        self._grant(state)
+
+    def snapshot(self):
+        # 可能在其他线程调用，先复制再遍历
+        result = {}
+        for api_key, state in list(self._keys.items()):
+            waiting = {}
+            for session_id, _ in list(state['pending'].values()):
+                waiting[session_id] = waiting.get(session_id, 0) + 1
+            result[_mask(api_key)] = {
+                'capacity': self.controller.capacity(api_key),
+                'holders': [{'holder': h, 'session': s} for h, (s, _) in list(state['holders'].items())],
+                'waiting': waiting,
+                'lanes': state['waiters'].waiting(),
+                'adaptive': self.controller.snapshot(api_key),
+            }
+        return result
+
+
+# 清理过期的持有者与等待者；新的等待者按调度票计算虚拟完成时间（见 scheduler.py）加入等待集合，
+# 名额空出时只有排在最前的等待者获得名额
+_ACQUIRE_SCRIPT = """
+local holders, owners, waiters, wsessions, seen, wmeta, flows, vtime = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local holder, session, capacity, now, ttl = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local lane, flow, weight, cost = ARGV[6], ARGV[7], tonumber(ARGV[8]), tonumber(ARGV[9])
+
+for _, h in ipairs(redis.call('ZRANGEBYSCORE', holders, '-inf', now)) do
+    redis.call('ZREM', holders, h)
+    redis.call('HDEL', owners, h)
+end
+for _, h in ipairs(redis.call('ZRANGEBYSCORE', seen, '-inf', now - ttl)) do
+    redis.call('ZREM', seen, h)
+    redis.call('ZREM', waiters, h)
+    redis.call('HDEL', wsessions, h)
+    redis.call('HDEL', wmeta, h)
+end
+
+if redis.call('ZSCORE', holders, holder) then
+    redis.call('ZADD', holders, now + ttl, holder)
+    return 1
+end
+if not redis.call('ZSCORE', waiters, holder) then
+    local start = math.max(tonumber(redis.call('GET', vtime) or '0'), tonumber(redis.call('HGET', flows, flow) or '0'))
+    local finish = string.format('%.17g', start + cost / weight)
+    redis.call('HSET', flows, flow, finish)
+    redis.call('ZADD', waiters, finish, holder)
+    redis.call('HSET', wsessions, holder, session)
+    redis.call('HSET', wmeta, holder, lane .. '|' .. flow)
+end
+redis.call('ZADD', seen, now, holder)
+
+if capacity >= 0 and redis.call('ZCARD', holders) >= capacity then
+    return 0
+end
+local best = redis.call('ZRANGE', waiters, 0, 0, 'WITHSCORES')
+if best[1] ~= holder then
+    return 0
+end
+
+local v = math.max(tonumber(redis.call('GET', vtime) or '0'), tonumber(best[2]))
+redis.call('SET', vtime, string.format('%.17g', v))
+if tonumber(redis.call('HGET', flows, flow) or '0') <= v then
+    redis.call('HDEL', flows, flow)
+end
+redis.call('ZREM', waiters, holder)
+redis.call('ZREM', seen, holder)
+redis.call('HDEL', wsessions, holder)
+redis.call('HDEL', wmeta, holder)
+redis.call('ZADD', holders, now + ttl, holder)
+redis.call('HSET', owners, holder, session)
+return 1
+"""
+
+
+class RedisLimiter(_LimiterBase):
+    def __init__(self, client, capacity=MAX_CONCURRENT, namespace=LIMITER_NAMESPACE,
+                 lease_ttl=LIMITER_LEASE_TTL, poll_interval=LIMITER_POLL_INTERVAL, io=None,
+                 max_capacity=ADAPTIVE_MAX_CONCURRENT):
+        self.client = client
+        self.capacity = capacity  # 初始名额数
+        self.controller = ConcurrencyController(capacity, max_capacity)  # 本进程观察到的窗口
+        self.namespace = namespace
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._io = io                # 在线程池中执行阻塞调用的协程函数，由引擎传入
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self.waits = LaneWaits()     # 本进程的任务等待名额的时间
+        self._held = {}              # holder_id -> api_key，本进程持有的名额
+        self._api_keys = set()
+        self._renewer = None
+
+    def _keys(self, api_key):
+        prefix = f"{self.namespace}:{_key_hash(api_key)}"
+        return [f"{prefix}:holders", f"{prefix}:owners", f"{prefix}:waiters", f"{prefix}:wsessions",
+                f"{prefix}:seen", f"{prefix}:wmeta", f"{prefix}:flows", f"{prefix}:vtime"]
+
+    async def _call(self, func, *args, **kwargs):
+        if self._io:
+            return await self._io(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    async def acquire(self, api_key, session_id, holder_id, ticket):
+        keys = self._keys(api_key)
+        self._api_keys.add(api_key)
+        started = time.monotonic()
+        try:
+            while True:
+                # 半开时占用试探名额，以 -1 调用：不论现有持有者多少，排在最前时放行
+                probe = self.controller.reserve_probe(api_key)
+                capacity = -1 if probe else self.controller.capacity(api_key)
+                try:
+                    admitted = await self._call(
+                        self._acquire, keys=keys,
+                        args=[holder_id, session_id, capacity, time.time(), self.lease_ttl,
+                              ticket.lane, ticket.flow, ticket.weight, ticket.cost])
+                except BaseException:
+                    if probe:
+                        self.controller.cancel_probe(api_key)
+                    raise
+                if admitted:
+                    if probe:
+                        self.controller.assign_probe(api_key, holder_id)
+                    break
+                if probe:
+                    self.controller.cancel_probe(api_key)
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            await self._call(self._forget, keys, holder_id)
+            raise
+        self.waits.record(ticket.lane, time.monotonic() - started)
+        self._held[holder_id] = api_key
+        if self._renewer is None or self._renewer.done():
+            self._renewer = asyncio.get_running_loop().create_task(self._renew_loop())
+
+    async def release(self, api_key, holder_id):
+        self._held.pop(holder_id, None)
+        await self._call(self._forget, self._keys(api_key), holder_id)
+
+    def _forget(self, keys, holder_id):
+        holders, owners, waiters, wsessions, seen, wmeta, _, _ = keys
+        pipe = self.client.pipeline()
+        pipe.zrem(holders, holder_id)
+        pipe.hdel(owners, holder_id)
+        pipe.zrem(waiters, holder_id)
+        pipe.hdel(wsessions, holder_id)
+        pipe.zrem(seen, holder_id)
+        pipe.hdel(wmeta, holder_id)
+        pipe.execute()
+
+    async def _renew_loop(self):
+        """定期为本进程持有的名额续租"""
+        while self._held:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._call(self._renew, dict(self._held))
+            except Exception:
+                pass
+
+    def _renew(self, held):
+        pipe = self.client.pipeline()
+        deadline = time.time() + self.lease_ttl
+        for holder_id, api_key in held.items():
+            pipe.zadd(self._keys(api_key)[0], {holder_id: deadline}, xx=True)
+        pipe.execute()
+
+    def snapshot(self):
+        result = {}
+        for api_key in list(self._api_keys):
+            holders, owners, waiters, wsessions, _, wmeta, _, _ = self._keys(api_key)
+            owner_map = {_text(k): _text(v) for k, v in self.client.hgetall(owners).items()}
+            waiting = {}
+            for session_id in self.client.hvals(wsessions):
+                session_id = _text(session_id)
+                waiting[session_id] = waiting.get(session_id, 0) + 1
+            lanes = dict.fromkeys(LANES, 0)
+            for meta in self.client.hvals(wmeta):
+                lane = _text(meta).split("|", 1)[0]
+                lanes[lane] = lanes.get(lane, 0) + 1
+            result[_mask(api_key)] = {
+                'capacity': self.controller.capacity(api_key),
+                'holders': [{'holder': h, 'session': s} for h, s in owner_map.items()],
+                'waiting': waiting,
+                'lanes': lanes,
+                'adaptive': self.controller.snapshot(api_key),
+            }
+        return result
+
+
+def _key_hash(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def _mask(api_key):
+    return f"{api_key[:8]}…"
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+def create_limiter(io=None, redis_url=REDIS_URL):
+    """配置了 RH_REDIS_URL 时所有进程共享名额，否则只在本进程内限制"""
+    if redis_url:
+        import redis
+        return RedisLimiter(redis.Redis.from_url(redis_url), io=io)
+    return LocalLimiter()
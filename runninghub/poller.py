@@ -0,0 +1,175 @@
+"""集中式远端任务状态轮询
+
+进程内所有在途的 RunningHub 任务ID都登记在同一个 StatusPoller 中。每个任务根据其
+工作流的历史耗时安排下一次查询时间（见 latency.py）；每个轮询周期把到期的查询
+均匀分散到整个周期里，并且同时进行的状态查询数有上限，
+避免一批任务同时启动时在同一时刻集中请求状态接口。
+"""
+import asyncio
+import time
+
+from .api import get_task_status
+from .config import POLL_INTERVAL, POLL_CONCURRENCY, MAX_POLL_COUNT, ACTUAL_TIMEOUT_MINUTES
+from .latency import LatencyHistory, next_poll_delay
+
+
+class _WatchEntry:
+    __slots__ = ('api_key', 'api_task_id', 'workflow', 'future', 'on_status', 'registered_at', 'submitted_at',
+                 'next_poll_at', 'last_poll_at', 'poll_count', 'consecutive_timeouts', 'checking', 'last_status')
+
+    def __init__(self, api_key, api_task_id, workflow, future, on_status, now, submitted_at=None):
+        self.api_key = api_key
+        self.api_task_id = api_task_id
+        self.workflow = workflow
+        self.future = future
+        self.on_status = on_status
+        self.registered_at = now
+        self.submitted_at = submitted_at  # 远端任务的发起时间，未知（重启后恢复等）时为 None
+        self.next_poll_at = now
+        self.last_poll_at = None
+        self.poll_count = 0
+        self.consecutive_timeouts = 0
+        self.checking = False
+        self.last_status = None
+
+
+class StatusPoller:
+    """在引擎事件循环中运行，io 为在线程池中执行阻塞调用的协程函数"""
+
+    def __init__(self, io, interval=POLL_INTERVAL, concurrency=POLL_CONCURRENCY,
+                 timeout=MAX_POLL_COUNT * POLL_INTERVAL, history=None):
+        self._io = io
+        self.interval = interval
+        self.timeout = timeout
+        self.history = history or LatencyHistory()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._entries = {}   # api_task_id -> _WatchEntry
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self.total_calls = 0
+        self.total_ticks = 0
+        self.calls_by_workflow = {}
+        self.saved_by_workflow = {}   # 相比固定间隔轮询少发的查询次数
+
+    def watch(self, api_key, api_task_id, on_status=None, workflow=None, submitted_at=None):
+        """登记远端任务，返回在任务成功时完成、失败或超时时抛出异常的 Future
+
+        on_status(status, elapsed) 在每次查询后回调，用于把状态变化推送给任务。
+        submitted_at 为远端任务的发起时间，只有给出时才把耗时计入历史：重启后恢复等待的任务
+        从登记时算起的耗时偏短，会让该工作流的首次查询提前。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = _WatchEntry(api_key, api_task_id, workflow, future, on_status, time.time(), submitted_at)
+        entry.next_poll_at = entry.registered_at + next_poll_delay(0, self.history.profile(workflow), self.interval)
+        self._entries[api_task_id] = entry
+        self._wakeup.set()
+        if self._runner is None or self._runner.done():
+            self._runner = loop.create_task(self._run())
+        return future
+
+    def stats(self):
+        return {
+            'watching': len(self._entries),
+            'status_calls': self.total_calls,
+            'status_calls_saved': sum(self.saved_by_workflow.values()),
+            'ticks': self.total_ticks,
+            'calls_by_workflow': dict(self.calls_by_workflow),
+            'saved_by_workflow': dict(self.saved_by_workflow),
+            'latency': self.history.snapshot(),
+        }
+
+    async def _run(self):
+        while True:
+            if not self._entries:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(self.interval)
+            self._tick()
+
+    def _tick(self):
+        """把下一个周期内到期的查询均匀分布到整个周期内"""
+        self.total_ticks += 1
+        horizon = time.time() + self.interval
+        due = []
+        for entry in list(self._entries.values()):
+            if entry.future.done():
+                # 等待方已取消
+                self._entries.pop(entry.api_task_id, None)
+            elif not entry.checking and entry.next_poll_at <= horizon:
+                due.append(entry)
+
+        if not due:
+            return
+        due.sort(key=lambda e: e.next_poll_at)
+        spacing = self.interval / len(due)
+        loop = asyncio.get_running_loop()
+        for i, entry in enumerate(due):
+            entry.checking = True
+            loop.create_task(self._check(entry, i * spacing))
+
+    async def _check(self, entry, delay):
+        try:
+            await asyncio.sleep(delay)
+            if entry.future.done():
+                return
+            async with self._semaphore:
+                status = await self._io(get_task_status, entry.api_key, entry.api_task_id)
+            self.total_calls += 1
+            self.calls_by_workflow[entry.workflow] = self.calls_by_workflow.get(entry.workflow, 0) + 1
+            entry.poll_count += 1
+            self._dispatch(entry, status)
+        except Exception as e:
+            self._finish(entry, error=e)
+        finally:
+            entry.checking = False
+
+    def _dispatch(self, entry, status):
+        if entry.future.done():
+            self._entries.pop(entry.api_task_id, None)
+            return
+
+        now = time.time()
+        elapsed = now - entry.registered_at
+        entry.last_status = status
+        if entry.on_status:
+            entry.on_status(status, elapsed)
+
+        if status == "SUCCESS":
+            # 完成时刻落在上一次查询与本次查询之间，取中点
+            finished_at = now if entry.last_poll_at is None else (entry.last_poll_at + now) / 2
+            if entry.submitted_at is not None:
+                self.history.record(entry.workflow, finished_at - entry.submitted_at)
+            self._finish(entry)
+            return
+        if status == "FAILED":
+            self._finish(entry, error=Exception("API任务处理失败"))
+            return
+        if elapsed >= self.timeout:
+            self._finish(entry, error=Exception(f"任务超时 (>{ACTUAL_TIMEOUT_MINUTES}分钟)"))
+            return
+
+        entry.last_poll_at = now
+        delay = next_poll_delay(elapsed, self.history.profile(entry.workflow), self.interval)
+        if status in ["CHECKING", "UNKNOWN"]:
+            # 状态接口连续超时时额外暂停两个周期
+            entry.consecutive_timeouts += 1
+            if entry.consecutive_timeouts > 3:
+                delay += self.interval * 2
+                entry.consecutive_timeouts = 0
+        else:
+            entry.consecutive_timeouts = 0
+        entry.next_poll_at = now + delay
+
+    def _finish(self, entry, error=None):
+        if self._entries.pop(entry.api_task_id, None) is not None:
+            # 固定间隔轮询在同样时长内需要的查询次数
+            baseline = int((time.time() - entry.registered_at) // self.interval)
+            saved = max(0, baseline - entry.poll_count)
+            self.saved_by_workflow[entry.workflow] = self.saved_by_workflow.get(entry.workflow, 0) + saved
+        if entry.future.done():
+            return
+        if error is None:
+            entry.future.set_result(entry.last_status)
+        else:
+            entry.future.set_exception(error)
@@ -0,0 +1,102 @@
+"""上传前的图片预处理
+
+相机原图动辄 20~40MB，原样上传容易超过 UPLOAD_TIMEOUT，整个任务被退回重试。
+按工作流配置（workflows.py 中的 "preprocess"）在上传前：
+
+- 按 EXIF 方向旋转
+- 最长边超过 max_edge 时缩小（JPEG 先用 draft 模式按比例解码）
+- 去掉 EXIF 等元数据，重新编码为 JPEG（带透明通道时为 PNG）
+
+只有结果比原图小时才上传处理后的文件，否则仍上传原图。处理后的文件写入 BlobStore。
+结果缓存仍以原图哈希为键；上传文件名缓存以原图哈希加预处理参数为键，
+同一张图在预处理参数不同的工作流中分别上传。
+"""
+import io
+import os
+import threading
+
+from .blob_store import get_blob_store
+from .config import UPLOAD_PREPROCESS
+
+EXIF_ORIENTATION = 0x0112
+
+
+def preprocess_options(spec):
+    """工作流的预处理参数，未配置或已全局关闭时返回 None"""
+    return spec.get("preprocess") if UPLOAD_PREPROCESS else None
+
+
+def prepare_upload(blob, file_name, options, blobs=None):
+    """返回实际上传的 (BlobRef, 文件名)；无需处理、无法解码或处理后不更小时返回原图"""
+    if not options:
+        return blob, file_name
+
+    from PIL import Image, ImageOps
+
+    max_edge = options.get("max_edge")
+    try:
+        with blob.open() as f, Image.open(f) as original:
+            oversized = bool(max_edge) and max(original.size) > max_edge
+            rotated = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+            if not oversized and not rotated and blob.size < options.get("min_bytes", 0):
+                return blob, file_name
+
+            if oversized:
+                original.draft("RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(original)
+            if oversized:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            out = io.BytesIO()
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                img.save(out, format="PNG", optimize=True)
+                ext = ".png"
+            else:
+                img.convert("RGB").save(out, format="JPEG", quality=options.get("quality", 92), optimize=True)
+                ext = ".jpg"
+    except Exception:
+        # 无法解码的文件原样上传，由服务端判断
+        return blob, file_name
+
+    if out.tell() >= blob.size:
+        return blob, file_name
+    blobs = blobs or get_blob_store()
+    return blobs.put(out.getvalue()), os.path.splitext(file_name)[0] + ext
+
+
+class UploadStats:
+    """上传前后的字节数与耗时（线程池中记录，页面读取）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.preprocessed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.preprocess_seconds = 0.0
+        self.upload_seconds = 0.0
+        self.estimated_seconds_before = 0.0
+
+    def record(self, bytes_before, bytes_after, preprocess_seconds, upload_seconds):
+        with self._lock:
+            self.uploads += 1
+            self.preprocessed += bytes_after != bytes_before
+            self.bytes_before += bytes_before
+            self.bytes_after += bytes_after
+            self.preprocess_seconds += preprocess_seconds
+            self.upload_seconds += upload_seconds
+            # 按本次实测的上传速度估算原图上传所需时间
+            self.estimated_seconds_before += upload_seconds * bytes_before / max(bytes_after, 1)
+
+    def stats(self):
+        with self._lock:
+            count = max(self.uploads, 1)
+            return {
+                'uploads': self.uploads,
+                'preprocessed': self.preprocessed,
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after,
+                'avg_preprocess_seconds': self.preprocess_seconds / count,
+                'avg_upload_seconds': self.upload_seconds / count,
+                'avg_upload_seconds_before': self.estimated_seconds_before / count,
+            }
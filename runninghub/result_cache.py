@@ -0,0 +1,188 @@
+"""按内容寻址的结果缓存
+
+缓存键由输入图片内容的哈希、webappId 以及最终的 nodeInfoList（含图像优化版本、WAN 2.1 提示词）
+计算得到，同一张图片重复提交到同一工作流时直接返回已有结果。
+结果文件保存在 BlobStore 中，缓存条目只记录文件哈希；条目总大小超过上限时按最近使用时间淘汰，
+淘汰后不再被其他条目和任务引用的结果文件一并删除。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+from .blob_store import BlobRef, get_blob_store
+from .config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES
+from .workflows import build_node_info
+
+
+def result_cache_key(spec, input_digests):
+    """input_digests: {nodeId: 输入图片的sha256}，图片节点的值用内容哈希代替上传后的文件名"""
+    node_info_list = build_node_info(spec, {node_id: f"sha256:{digest}" for node_id, digest in input_digests.items()})
+    payload = json.dumps(
+        [spec["webapp_id"], spec["instance_type"],
+         [[node["nodeId"], node["fieldName"], node["fieldValue"]] for node in node_info_list]],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """磁盘结果缓存，每个键一个 JSON 文件，记录结果文件的哈希与大小"""
+
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, blobs=None, referenced=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blobs = blobs or get_blob_store()
+        self.referenced = referenced  # referenced(digests) -> 其中仍被任务引用的哈希集合，由引擎传入
+        self._lock = threading.Lock()
+        self._index = OrderedDict()   # key -> (字节数, 结果文件哈希)，按最近使用排序
+        self._refs = Counter()        # 结果文件哈希 -> 引用它的条目数
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and entry.name.endswith(".json") and not entry.name.startswith("."):
+                    try:
+                        with open(entry.path, encoding="utf-8") as f:
+                            items = json.load(f)['items']
+                        size = sum(item['size'] for item in items)
+                        digests = tuple(item['digest'] for item in items)
+                    except (OSError, ValueError, KeyError, TypeError):
+                        continue
+                    entries.append((entry.stat().st_mtime, entry.name[:-len(".json")], size, digests))
+        for _, key, size, digests in sorted(entries):
+            self._add(key, size, digests)
+
+    # 以下三个方法由调用方加锁
+    def _add(self, key, size, digests):
+        self._index[key] = (size, digests)
+        self._refs.update(digests)
+        self._total += size
+
+    def _remove(self, key):
+        """移除条目，返回不再被任何条目引用的结果文件哈希"""
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return []
+        size, digests = entry
+        self._total -= size
+        self._refs.subtract(digests)
+        orphans = [digest for digest in set(digests) if self._refs[digest] <= 0]
+        for digest in orphans:
+            del self._refs[digest]
+        return orphans
+
+    def _evict(self):
+        """超过上限时淘汰最久未使用的条目，返回 (被淘汰的键, 不再被引用的结果文件哈希)"""
+        evicted, orphans = [], []
+        while self._total > self.max_bytes and self._index:
+            old_key = next(iter(self._index))
+            orphans.extend(self._remove(old_key))
+            evicted.append(old_key)
+        return evicted, orphans
+
+    def get(self, key):
+        """命中时返回 {'result_data': BlobRef} 或 {'result_data_list': [{'blob', 'url'}, ...]}"""
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+
+        path = self._entry_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            meta = None
+        # 结果文件被清理时条目失效
+        if meta is None or not all(self.blobs.touch(item['digest']) for item in meta['items']):
+            with self._lock:
+                self._remove(key)
+            return None
+
+        items = [{'blob': BlobRef(item['digest'], item['size']), 'url': item.get('url')} for item in meta['items']]
+        if meta["multi"]:
+            return {'result_data_list': items}
+        return {'result_data': items[0]['blob']}
+
+    def put(self, key, results):
+        """results 与 get() 的返回格式相同"""
+        if 'result_data_list' in results:
+            items, multi = results['result_data_list'], True
+        else:
+            items, multi = [{'blob': results['result_data'], 'url': None}], False
+
+        size = sum(item['blob'].size for item in items)
+        if size > self.max_bytes:
+            return
+
+        meta = {
+            'multi': multi,
+            'items': [{'digest': item['blob'].digest, 'size': item['blob'].size, 'url': item.get('url')}
+                      for item in items],
+        }
+        shard = os.path.join(self.root, key[:2])
+        tmp_path = None
+        try:
+            os.makedirs(shard, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=shard, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError:
+            # 磁盘不可写；缓存失败不影响任务结果
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        digests = tuple(item['digest'] for item in meta['items'])
+        with self._lock:
+            orphans = self._remove(key)
+            self._add(key, size, digests)
+            evicted, evicted_orphans = self._evict()
+            orphans = [digest for digest in orphans + evicted_orphans if digest not in self._refs]
+        for old_key in evicted:
+            try:
+                os.remove(self._entry_path(old_key))
+            except OSError:
+                pass
+        self._discard(orphans)
+
+    def _discard(self, digests):
+        """删除不再被缓存引用的结果文件；仍被任务引用的保留，由 BlobStore 定期清理"""
+        if not digests:
+            return
+        kept = set()
+        if self.referenced:
+            try:
+                kept = self.referenced(digests)
+            except Exception:
+                return  # 无法确认时不删除
+        for digest in digests:
+            if digest not in kept:
+                self.blobs.discard(digest)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self._total,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
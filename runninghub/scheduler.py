@@ -0,0 +1,184 @@
+"""排队顺序：优先通道 + 加权公平 + 按历史耗时的短任务优先
+
+排队中的任务（共享队列、上传名额、API Key 并发名额三处）不再按先到先得取出。
+每个任务带一张调度票（Ticket）：
+
+- 通道：interactive（页面上单张、少量提交）或 bulk（批量上传、压缩包导入、命令行）
+- 流：通道 + 会话 + 工作流，同一个流内先到先得
+- 权重：通道权重 × 工作流权重（LANE_WEIGHTS、WORKFLOW_WEIGHTS）
+- 代价：默认为 1（按任务数公平）；开启 SCHEDULER_SJF 后为该工作流的历史远端耗时中位数
+
+按自计时公平排队（SCFQ）给每个任务打上虚拟完成时间，按完成时间从小到大取出：
+
+    开始 = max(当前虚拟时间, 该流上一个任务的完成时间)
+    完成 = 开始 + 代价 / 权重
+
+当前虚拟时间是最近取出的任务的完成时间。一个会话的 500 张批量任务排在同一个流里，
+完成时间一直排到很远；之后提交的单张任务从当前虚拟时间开始计算，下一个空出的名额就轮到它。
+代价按耗时计算时，耗时短的工作流在公平份额内排得更靠前。
+
+入队、出队都是 O(log n)（堆），撤销为惰性删除。
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from collections import deque, namedtuple
+
+from .config import LANE_WEIGHTS, WORKFLOW_WEIGHTS, LANE_WAIT_WINDOW
+from .workflows import workflow_key
+
+LANES = tuple(LANE_WEIGHTS)
+DEFAULT_LANE = "interactive"
+
+# flow: 流的名称（通道 + 会话ID + 工作流）；weight: 通道权重 × 工作流权重；cost: 估算代价
+Ticket = namedtuple("Ticket", "lane flow weight cost")
+
+
+def task_ticket(task, cost=1.0):
+    """任务的调度票"""
+    lane = getattr(task, "lane", DEFAULT_LANE)  # 旧版本写入队列的任务没有通道
+    lane = lane if lane in LANE_WEIGHTS else DEFAULT_LANE
+    weight = LANE_WEIGHTS[lane] * WORKFLOW_WEIGHTS.get(task.task_type, 1)
+    return Ticket(lane, f"{lane}\t{task.session_id}\t{workflow_key(task)}", weight, cost)
+
+
+class LaneWaits:
+    """各通道最近 LANE_WAIT_WINDOW 次从排队到取出的等待时间（可在任意线程记录、读取）"""
+
+    def __init__(self, window=LANE_WAIT_WINDOW):
+        self._lock = threading.Lock()
+        self._waits = {lane: deque(maxlen=window) for lane in LANES}
+        self._dispatched = dict.fromkeys(LANES, 0)
+
+    def record(self, lane, seconds):
+        with self._lock:
+            self._waits[lane].append(seconds)
+            self._dispatched[lane] += 1
+
+    def stats(self, waiting=None):
+        """{通道: {'waiting', 'dispatched', 'avg_wait', 'p95_wait', 'max_wait'}}，waiting 为各通道当前排队数"""
+        waiting = waiting or {}
+        result = {}
+        with self._lock:
+            for lane in LANES:
+                waits = sorted(self._waits[lane])
+                result[lane] = {
+                    'waiting': waiting.get(lane, 0),
+                    'dispatched': self._dispatched[lane],
+                    'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+                    'p95_wait': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    'max_wait': waits[-1] if waits else 0.0,
+                }
+        return result
+
+
+class FairScheduler:
+    """一组等待者的取出顺序，不加锁：由调用方加锁，或只在事件循环中使用"""
+
+    def __init__(self, waits=None):
+        self.waits = waits or LaneWaits()  # 可以由多个调度器共用
+        self._heap = []        # [(完成时间, 序号, 等待者)]
+        self._entries = {}     # 等待者 -> (完成时间, 序号, 通道, 流, 入队时间)
+        self._flows = {}       # 流 -> 最后一个任务的完成时间
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._vtime = 0.0
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def push(self, item, ticket, tag=None):
+        """加入等待；tag 为之前取出时返回的位置，交还的任务按原位置排回"""
+        if tag is None:
+            start = max(self._vtime, self._flows.get(ticket.flow, 0.0))
+            finish = start + ticket.cost / max(ticket.weight, 1e-9)
+            self._flows[ticket.flow] = finish
+        else:
+            finish = tag
+        seq = next(self._sequence)
+        self.remove(item)
+        self._entries[item] = (finish, seq, ticket.lane, ticket.flow, time.monotonic())
+        self._waiting[ticket.lane] += 1
+        heapq.heappush(self._heap, (finish, seq, item))
+
+    def pop(self):
+        """取出完成时间最小的等待者，返回 (等待者, 位置)，没有时返回 None"""
+        while self._heap:
+            finish, seq, item = heapq.heappop(self._heap)
+            entry = self._entries.get(item)
+            if entry is None or entry[1] != seq:
+                continue  # 已撤销或已重新加入
+            del self._entries[item]
+            _, _, lane, flow, enqueued_at = entry
+            self._waiting[lane] -= 1
+            self._vtime = max(self._vtime, finish)
+            if self._flows.get(flow, 0.0) <= self._vtime:
+                # 流已没有排在当前虚拟时间之后的任务，不再需要记录
+                self._flows.pop(flow, None)
+            self.waits.record(lane, time.monotonic() - enqueued_at)
+            return item, finish
+        return None
+
+    def remove(self, item):
+        """撤销等待，等待者不存在时返回 False"""
+        entry = self._entries.pop(item, None)
+        if entry is None:
+            return False
+        self._waiting[entry[2]] -= 1
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            # 撤销留下的过期堆元素过多时重建
+            self._heap = [(e[0], e[1], i) for i, e in self._entries.items()]
+            heapq.heapify(self._heap)
+        return True
+
+    def waiting(self):
+        """各通道当前的等待数"""
+        return dict(self._waiting)
+
+
+class FairSlots:
+    """按调度顺序分配的 asyncio 名额（代替 Semaphore），只在事件循环中使用"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._held = 0
+        self._waiters = FairScheduler()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, ticket):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.push(future, ticket)
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not self._waiters.remove(future) and future.done() and not future.cancelled():
+                # 刚分到名额就被取消
+                self._held -= 1
+                self._grant()
+            raise
+        try:
+            yield
+        finally:
+            self._held -= 1
+            self._grant()
+
+    def _grant(self):
+        while self._held < self.capacity:
+            popped = self._waiters.pop()
+            if popped is None:
+                return
+            future = popped[0]
+            if future.done():
+                continue
+            self._held += 1
+            future.set_result(True)
+
+    def stats(self):
+        return self._waiters.waits.stats(self._waiters.waiting())
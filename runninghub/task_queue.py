@@ -0,0 +1,427 @@
+"""共享任务队列
+
+队列中只保存任务的 uid，任务描述（TaskItem）单独按 uid 存放。就绪的任务按调度票
+（见 scheduler.py）的虚拟完成时间排序，取出任务（claim）时原子地
+把 uid 移入租约集合并记录投递次数；处理中的任务需要定期续租（extend），处理结束后确认（ack）。
+租约超时未续的任务会被重新投递，投递次数达到上限后转入死信队列（最多保留 DEAD_LETTER_MAX 个，
+Redis 中的任务描述移到死信键下、DEAD_LETTER_TTL 后过期，投递次数计数随之删除）；
+转入死信队列的任务与撤销的任务一样 is_cancelled() 为 True。
+失败待重试的任务由处理方交回（retry），在计时集合中等到退避时间结束后回到就绪队列原来的位置。
+
+- InMemoryTaskQueue：单进程默认实现
+- RedisTaskQueue：多个 Streamlit 副本 / worker 进程共享同一个积压队列；
+  client 可以是 redis.Redis，也可以是 fakeredis.FakeRedis 等兼容实现
+
+非本进程处理的任务，处理方通过 publish_state 回写状态快照，提交方用 fetch_states 读取。
+Redis 中的任务描述和状态快照使用与任务存储相同的 JSON 编码（见 task_store.py），不使用 pickle：
+能写入 Redis 的一方不能借此在 worker 进程中执行代码。
+"""
+import heapq
+import json
+import threading
+import time
+from collections import deque
+
+from .config import (
+    REDIS_URL, QUEUE_NAMESPACE, VISIBILITY_TIMEOUT, MAX_DELIVERIES, STATE_TTL, DEAD_LETTER_MAX, DEAD_LETTER_TTL,
+)
+from .scheduler import LANES, FairScheduler, LaneWaits, task_ticket
+from .task_store import decode_state, decode_task, encode_state, encode_task
+from .tasks import TaskState
+
+
+class InMemoryTaskQueue:
+    shared = False
+
+    def __init__(self, visibility_timeout=VISIBILITY_TIMEOUT, max_deliveries=MAX_DELIVERIES):
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self._lock = threading.Lock()
+        self._ready = FairScheduler()
+        self._payloads = {}     # uid -> TaskItem
+        self._tickets = {}      # uid -> (调度票, 取出时的位置)，交还时按原位置排回
+        self._leases = {}       # uid -> 租约到期时间
+        self._deliveries = {}   # uid -> 投递次数
+        self._delayed = []      # 计时堆 [(重新排队时间, uid)]
+        self._dead = deque(maxlen=DEAD_LETTER_MAX)
+        self._states = {}
+
+    def put(self, task, ticket=None):
+        """加入队列，ticket 为调度票（默认按任务数公平）"""
+        ticket = ticket or task_ticket(task)
+        with self._lock:
+            self._payloads[task.uid] = task
+            self._tickets[task.uid] = (ticket, None)
+            self._ready.push(task.uid, ticket)
+
+    def claim(self):
+        """取出排在最前的任务，返回 (uid, task, 投递次数)，队列为空时返回 None"""
+        with self._lock:
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._requeue(heapq.heappop(self._delayed)[1])
+            while True:
+                popped = self._ready.pop()
+                if popped is None:
+                    return None
+                uid, tag = popped
+                if uid not in self._payloads:
+                    continue
+                self._tickets[uid] = (self._tickets[uid][0], tag)
+                self._leases[uid] = time.time() + self.visibility_timeout
+                self._deliveries[uid] = self._deliveries.get(uid, 0) + 1
+                return uid, self._payloads[uid], self._deliveries[uid]
+
+    def _requeue(self, uid):
+        # 放回原来的位置，已撤销的任务不再放回（调用方已加锁）
+        if uid not in self._payloads:
+            self._tickets.pop(uid, None)
+            return
+        ticket, tag = self._tickets[uid]
+        self._ready.push(uid, ticket, tag)
+
+    def extend(self, uid):
+        """续租，租约已丢失（被重新投递）时返回 False"""
+        with self._lock:
+            if uid not in self._leases:
+                return False
+            self._leases[uid] = time.time() + self.visibility_timeout
+            return True
+
+    def release(self, uid):
+        """交还处理中的任务（进程正常退出时），放回队首且不计入投递次数"""
+        with self._lock:
+            if self._leases.pop(uid, None) is None:
+                return
+            self._deliveries[uid] = max(0, self._deliveries.get(uid, 1) - 1)
+            self._requeue(uid)
+
+    def retry(self, task, delay):
+        """交还失败待重试的任务（带着已累计的重试次数），delay 秒后回到就绪队列原来的位置，不计入投递次数"""
+        with self._lock:
+            if self._leases.pop(task.uid, None) is None:
+                return
+            if task.uid in self._payloads:
+                self._payloads[task.uid] = task
+            self._deliveries[task.uid] = max(0, self._deliveries.get(task.uid, 1) - 1)
+            heapq.heappush(self._delayed, (time.time() + delay, task.uid))
+
+    def ack(self, uid):
+        with self._lock:
+            self._leases.pop(uid, None)
+            self._deliveries.pop(uid, None)
+            self._payloads.pop(uid, None)
+            self._tickets.pop(uid, None)
+
+    def cancel(self, uid):
+        """撤销尚未取出的任务"""
+        with self._lock:
+            self._payloads.pop(uid, None)
+            self._deliveries.pop(uid, None)
+            if self._ready.remove(uid):
+                self._tickets.pop(uid, None)
+
+    def is_cancelled(self, uid):
+        with self._lock:
+            return uid not in self._payloads
+
+    def requeue_expired(self):
+        """重新投递租约超时的任务，返回转入死信队列的 uid 列表"""
+        now = time.time()
+        dead = []
+        with self._lock:
+            for uid, deadline in list(self._leases.items()):
+                if deadline > now:
+                    continue
+                del self._leases[uid]
+                if self._deliveries.get(uid, 0) >= self.max_deliveries:
+                    self._dead.append(uid)
+                    self._tickets.pop(uid, None)
+                    self._deliveries.pop(uid, None)
+                    self._payloads.pop(uid, None)
+                    dead.append(uid)
+                else:
+                    self._requeue(uid)
+        return dead
+
+    def publish_state(self, uid, state):
+        with self._lock:
+            self._states[uid] = state
+
+    def fetch_states(self, uids):
+        with self._lock:
+            return {uid: self._states[uid] for uid in uids if uid in self._states}
+
+    def stats(self):
+        with self._lock:
+            waiting = self._ready.waiting()
+            stats = {'ready': len(self._ready), 'leased': len(self._leases), 'delayed': sum(uid in self._payloads for _, uid in self._delayed),
+                     'dead': len(self._dead)}
+        stats['lanes'] = self._ready.waits.stats(waiting)
+        return stats
+
+
+# 就绪集合为有序集合，分数是调度票的虚拟完成时间（计算方法见 scheduler.py）；
+# meta 中记录每个任务的 "通道|完成时间|入队时间|流"，交还、重新投递时按原来的分数放回，
+# 入队时间改为放回的时间（排队等待时间不包含处理、退避的时间）
+
+# 放回就绪集合原来的位置（各脚本共用）
+_REQUEUE_FUNCTION = """
+local function requeue(ready, meta, lanes, uid, now)
+    local lane, finish, _, flow = string.match(redis.call('HGET', meta, uid) or '', '^([^|]*)|([^|]*)|([^|]*)|(.*)$')
+    redis.call('ZADD', ready, tonumber(finish) or 0, uid)
+    if lane then
+        redis.call('HINCRBY', lanes, lane, 1)
+        redis.call('HSET', meta, uid, lane .. '|' .. finish .. '|' .. now .. '|' .. flow)
+    end
+end
+"""
+
+# 加入就绪集合
+_PUT_SCRIPT = """
+local ready, meta, flows, vtime, lanes = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local uid, lane, flow, weight, cost = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4]), tonumber(ARGV[5])
+local start = math.max(tonumber(redis.call('GET', vtime) or '0'), tonumber(redis.call('HGET', flows, flow) or '0'))
+local finish = string.format('%.17g', start + cost / weight)
+redis.call('HSET', flows, flow, finish)
+if redis.call('ZADD', ready, finish, uid) == 1 then
+    redis.call('HINCRBY', lanes, lane, 1)
+end
+redis.call('HSET', meta, uid, lane .. '|' .. finish .. '|' .. ARGV[6] .. '|' .. flow)
+"""
+
+# 原子取出：先把退避时间已到的任务放回就绪集合原来的位置，
+# 再弹出分数最小的任务并推进虚拟时间，写入租约集合并累加投递次数
+_CLAIM_SCRIPT = _REQUEUE_FUNCTION + """
+local ready, leases, deliveries, meta, flows, vtime, lanes, delayed = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+for _, uid in ipairs(redis.call('ZRANGEBYSCORE', delayed, '-inf', ARGV[2], 'LIMIT', 0, 100)) do
+    redis.call('ZREM', delayed, uid)
+    requeue(ready, meta, lanes, uid, ARGV[2])
+end
+local popped = redis.call('ZPOPMIN', ready)
+if #popped == 0 then return nil end
+local uid, finish = popped[1], tonumber(popped[2])
+local lane, _, enqueued, flow = string.match(redis.call('HGET', meta, uid) or '', '^([^|]*)|([^|]*)|([^|]*)|(.*)$')
+local v = math.max(tonumber(redis.call('GET', vtime) or '0'), finish)
+redis.call('SET', vtime, string.format('%.17g', v))
+if flow and tonumber(redis.call('HGET', flows, flow) or '0') <= v then
+    redis.call('HDEL', flows, flow)
+end
+if lane then
+    redis.call('HINCRBY', lanes, lane, -1)
+end
+redis.call('ZADD', leases, ARGV[1], uid)
+local n = redis.call('HINCRBY', deliveries, uid, 1)
+return {uid, n, lane or '', enqueued or ''}
+"""
+
+# 交还处理中的任务：放回原来的位置，不计入投递次数
+_RELEASE_SCRIPT = _REQUEUE_FUNCTION + """
+local leases, ready, deliveries, meta, lanes = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+if redis.call('ZREM', leases, ARGV[1]) == 0 then return 0 end
+redis.call('HINCRBY', deliveries, ARGV[1], -1)
+requeue(ready, meta, lanes, ARGV[1], ARGV[2])
+return 1
+"""
+
+# 交还失败待重试的任务：从租约集合移入计时集合，不计入投递次数
+_RETRY_SCRIPT = """
+local leases, delayed, deliveries = KEYS[1], KEYS[2], KEYS[3]
+if redis.call('ZREM', leases, ARGV[1]) == 0 then return 0 end
+redis.call('HINCRBY', deliveries, ARGV[1], -1)
+redis.call('ZADD', delayed, ARGV[2], ARGV[1])
+return 1
+"""
+
+# 撤销尚未取出（含等待重试）的任务
+_CANCEL_SCRIPT = """
+local ready, meta, lanes, deliveries, payload, delayed = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+if redis.call('ZREM', ready, ARGV[1]) == 1 then
+    local lane = string.match(redis.call('HGET', meta, ARGV[1]) or '', '^([^|]*)|')
+    if lane then
+        redis.call('HINCRBY', lanes, lane, -1)
+    end
+    redis.call('HDEL', meta, ARGV[1])
+end
+if redis.call('ZREM', delayed, ARGV[1]) == 1 then
+    redis.call('HDEL', meta, ARGV[1])
+end
+redis.call('HDEL', deliveries, ARGV[1])
+redis.call('DEL', payload)
+"""
+
+# 租约超时：投递次数未达上限的放回原来的位置，否则转入死信队列（只保留最近 ARGV[3] 个），
+# 删除投递次数计数；任务描述由调用方移到死信键下并设置过期时间
+_REAP_SCRIPT = _REQUEUE_FUNCTION + """
+local leases, ready, deliveries, dead_list, meta, lanes = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+local expired = redis.call('ZRANGEBYSCORE', leases, '-inf', ARGV[1])
+local dead = {}
+for _, uid in ipairs(expired) do
+    redis.call('ZREM', leases, uid)
+    local n = tonumber(redis.call('HGET', deliveries, uid) or '0')
+    if n >= tonumber(ARGV[2]) then
+        redis.call('LPUSH', dead_list, uid)
+        redis.call('HDEL', meta, uid)
+        redis.call('HDEL', deliveries, uid)
+        table.insert(dead, uid)
+    else
+        requeue(ready, meta, lanes, uid, ARGV[1])
+    end
+end
+if #dead > 0 then
+    redis.call('LTRIM', dead_list, 0, tonumber(ARGV[3]) - 1)
+end
+return dead
+"""
+
+
+class RedisTaskQueue:
+    shared = True
+
+    def __init__(self, client, namespace=QUEUE_NAMESPACE,
+                 visibility_timeout=VISIBILITY_TIMEOUT, max_deliveries=MAX_DELIVERIES):
+        self.client = client
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self._ready = f"{namespace}:scheduled"
+        self._meta = f"{namespace}:meta"
+        self._flows = f"{namespace}:flows"
+        self._vtime = f"{namespace}:vtime"
+        self._lanes = f"{namespace}:lanes"
+        self._leases = f"{namespace}:leased"
+        self._delayed = f"{namespace}:delayed"
+        self._deliveries = f"{namespace}:deliveries"
+        self._dead = f"{namespace}:dead"
+        self._payload_prefix = f"{namespace}:payload:"
+        self._dead_payload_prefix = f"{namespace}:dead:payload:"
+        self._state_prefix = f"{namespace}:state:"
+        self._put = client.register_script(_PUT_SCRIPT)
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._release = client.register_script(_RELEASE_SCRIPT)
+        self._retry = client.register_script(_RETRY_SCRIPT)
+        self._cancel = client.register_script(_CANCEL_SCRIPT)
+        self._reap = client.register_script(_REAP_SCRIPT)
+        self.waits = LaneWaits()  # 本进程取出的任务的等待时间
+
+    def put(self, task, ticket=None):
+        """加入队列，ticket 为调度票（默认按任务数公平）"""
+        ticket = ticket or task_ticket(task)
+        self.client.set(self._payload_prefix + task.uid, _dump_task(task))
+        self._put(keys=[self._ready, self._meta, self._flows, self._vtime, self._lanes],
+                  args=[task.uid, ticket.lane, ticket.flow, ticket.weight, ticket.cost, time.time()])
+
+    def claim(self):
+        while True:
+            claimed = self._claim(
+                keys=[self._ready, self._leases, self._deliveries, self._meta, self._flows, self._vtime, self._lanes,
+                      self._delayed],
+                args=[time.time() + self.visibility_timeout, time.time()])
+            if not claimed:
+                return None
+            uid, deliveries = _text(claimed[0]), int(claimed[1])
+            payload = self.client.get(self._payload_prefix + uid)
+            if payload is None:
+                # 已被撤销
+                self.ack(uid)
+                continue
+            try:
+                task = _load_task(payload)
+            except (ValueError, TypeError, KeyError):
+                # 无法解析的任务描述（旧版本写入的 pickle 等），告知提交方后丢弃
+                self.publish_state(uid, TaskState(status="FAILED", error_message="任务描述无法解析，请重新提交"))
+                self.ack(uid)
+                continue
+            lane, enqueued = _text(claimed[2]), _text(claimed[3])
+            if lane in LANES and enqueued:
+                self.waits.record(lane, max(0.0, time.time() - float(enqueued)))
+            return uid, task, deliveries
+
+    def extend(self, uid):
+        return bool(self.client.zadd(self._leases, {uid: time.time() + self.visibility_timeout}, xx=True, ch=True))
+
+    def release(self, uid):
+        self._release(keys=[self._leases, self._ready, self._deliveries, self._meta, self._lanes], args=[uid, time.time()])
+
+    def retry(self, task, delay):
+        # 任务描述中带上已累计的重试次数，由哪个进程接手都不会重新计数
+        self.client.set(self._payload_prefix + task.uid, _dump_task(task), xx=True)
+        self._retry(keys=[self._leases, self._delayed, self._deliveries], args=[task.uid, time.time() + delay])
+
+    def ack(self, uid):
+        pipe = self.client.pipeline()
+        pipe.zrem(self._leases, uid)
+        pipe.hdel(self._deliveries, uid)
+        pipe.hdel(self._meta, uid)
+        pipe.delete(self._payload_prefix + uid)
+        pipe.execute()
+
+    def cancel(self, uid):
+        self._cancel(keys=[self._ready, self._meta, self._lanes, self._deliveries, self._payload_prefix + uid,
+                           self._delayed], args=[uid])
+
+    def is_cancelled(self, uid):
+        return not self.client.exists(self._payload_prefix + uid)
+
+    def requeue_expired(self):
+        dead = [_text(uid) for uid in self._reap(
+            keys=[self._leases, self._ready, self._deliveries, self._dead, self._meta, self._lanes],
+            args=[time.time(), self.max_deliveries, DEAD_LETTER_MAX])]
+        if dead:
+            # 死信任务的描述移出队列（is_cancelled 为 True），保留一段时间供排查，之后过期；
+            # 期间被撤销、已没有描述的任务 RENAME 失败，忽略
+            pipe = self.client.pipeline()
+            for uid in dead:
+                pipe.rename(self._payload_prefix + uid, self._dead_payload_prefix + uid)
+                pipe.expire(self._dead_payload_prefix + uid, DEAD_LETTER_TTL)
+            pipe.execute(raise_on_error=False)
+        return dead
+
+    def publish_state(self, uid, state):
+        self.client.set(self._state_prefix + uid, json.dumps(encode_state(state._asdict()), ensure_ascii=False,
+                                                             default=str), ex=STATE_TTL)
+
+    def fetch_states(self, uids):
+        uids = list(uids)
+        if not uids:
+            return {}
+        values = self.client.mget([self._state_prefix + uid for uid in uids])
+        states = {}
+        for uid, value in zip(uids, values):
+            if value is None:
+                continue
+            try:
+                states[uid] = decode_state(json.loads(value))
+            except (ValueError, TypeError, KeyError):
+                pass  # 旧版本写入的快照，等处理方下次回写
+        return states
+
+    def stats(self):
+        pipe = self.client.pipeline()
+        pipe.zcard(self._ready)
+        pipe.zcard(self._leases)
+        pipe.zcard(self._delayed)
+        pipe.llen(self._dead)
+        pipe.hgetall(self._lanes)
+        ready, leased, delayed, dead, lanes = pipe.execute()
+        waiting = {_text(lane): int(count) for lane, count in lanes.items()}
+        return {'ready': ready, 'leased': leased, 'delayed': delayed, 'dead': dead, 'lanes': self.waits.stats(waiting)}
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+def _dump_task(task):
+    return json.dumps(encode_task(task), ensure_ascii=False, default=str)
+
+def _load_task(payload):
+    """输入文件已不存在时对应属性为 None，由引擎标记为失败"""
+    data = json.loads(payload)
+    task, _ = decode_task(data['task_type'], data['record'], data['inputs'], data['state'])
+    return task
+
+def create_task_queue(redis_url=REDIS_URL):
+    """配置了 RH_REDIS_URL 时使用 Redis 队列，否则使用进程内队列"""
+    if redis_url:
+        import redis
+        return RedisTaskQueue(redis.Redis.from_url(redis_url))
+    return InMemoryTaskQueue()
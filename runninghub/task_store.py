@@ -0,0 +1,357 @@
+"""持久化任务存储
+
+任务描述、每次状态变更、远端任务ID都写入 SQLite（WAL 模式），输入/结果图片保存在 BlobStore 中，
+数据库只记录文件哈希；task_blobs 表按哈希索引任务引用的全部文件，清理图片文件时据此判断是否仍被使用。
+进程重启后可以恢复页面的任务列表，已在远端运行的任务继续等待结果，不再重新发起。
+
+写入由后台线程批量提交：变更先进入内存队列，每 TASK_STORE_FLUSH_INTERVAL 秒或攒够
+TASK_STORE_BATCH_SIZE 条时在一个事务中写入，同一任务的多次变更合并为一次更新。
+序列化也在写入线程中进行，不占用引擎事件循环。写入线程每 TASK_STORE_PRUNE_INTERVAL 秒
+清理过期的任务记录和状态变更记录。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from queue import Queue, Empty
+
+from .config import (
+    TASK_STORE_PATH, TASK_STORE_FLUSH_INTERVAL, TASK_STORE_BATCH_SIZE, TASK_STORE_RETENTION,
+    TASK_STORE_TRANSITIONS_RETENTION, TASK_STORE_PRUNE_INTERVAL,
+)
+from .blob_store import BlobRef, get_blob_store
+from .tasks import STATE_FIELDS, TASK_TYPES, TaskState
+from .workflows import get_workflow
+
+ACTIVE_STATUSES = ("QUEUED", "PROCESSING")
+INPUT_EXPIRED_ERROR = "输入图片已过期（文件已被清理），请重新上传"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    uid TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    task_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    api_task_id TEXT,
+    descriptor TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_session ON tasks (session_id);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL,
+    at REAL NOT NULL,
+    changes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_uid ON transitions (uid);
+CREATE INDEX IF NOT EXISTS transitions_at ON transitions (at);
+"""
+
+# 未取消任务引用的输入、结果文件；任务取消或清理时删除
+_BLOBS_SCHEMA = """
+CREATE TABLE task_blobs (
+    uid TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (uid, digest)
+) WITHOUT ROWID;
+CREATE INDEX task_blobs_digest ON task_blobs (digest);
+"""
+
+# 按任务记录中的输入哈希和结果哈希重建 task_blobs，{where} 为 tasks 表的筛选条件
+_INDEX_BLOBS = """
+INSERT OR IGNORE INTO task_blobs (uid, digest)
+SELECT uid, value FROM tasks, json_each(tasks.inputs) WHERE {where}
+UNION SELECT uid, json_extract(state, '$.result_data.blob') FROM tasks
+    WHERE {where} AND json_extract(state, '$.result_data.blob') IS NOT NULL
+UNION SELECT uid, json_extract(item.value, '$.blob') FROM tasks, json_each(tasks.state, '$.result_data_list') AS item
+    WHERE {where}
+"""
+
+
+class TaskStore:
+    def __init__(self, path=TASK_STORE_PATH, flush_interval=TASK_STORE_FLUSH_INTERVAL,
+                 batch_size=TASK_STORE_BATCH_SIZE, retention=TASK_STORE_RETENTION,
+                 transitions_retention=TASK_STORE_TRANSITIONS_RETENTION, prune_interval=TASK_STORE_PRUNE_INTERVAL,
+                 blobs=None):
+        self.flush_interval = flush_interval
+        self.blobs = blobs or get_blob_store()
+        self.batch_size = batch_size
+        self.retention = retention
+        self.transitions_retention = transitions_retention
+        self.prune_interval = prune_interval
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 写连接只在写入线程使用，读连接加锁后可在任意线程使用
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._create_blob_index()
+        self._prune()
+        self._pruned_at = time.monotonic()
+        self._reader = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._read_lock = threading.Lock()
+        self._pending = Queue()
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="rh-task-store", daemon=True)
+        self._thread.start()
+
+    def _create_blob_index(self):
+        """旧版本的数据库没有 task_blobs 表，创建后按已有任务记录填充"""
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_blobs'").fetchone():
+            return
+        with self._conn:
+            self._conn.executescript(_BLOBS_SCHEMA)
+            self._conn.execute(_INDEX_BLOBS.format(where="status != 'CANCELLED'"))
+
+    def _prune(self):
+        """删除超过保留时长未更新的任务，以及超过保留时长的状态变更记录（在写入线程或启动时调用）"""
+        now = time.time()
+        with self._conn:
+            expired = [(row[0],) for row in self._conn.execute(
+                "SELECT uid FROM tasks WHERE updated_at < ?", (now - self.retention,))]
+            self._conn.executemany("DELETE FROM tasks WHERE uid = ?", expired)
+            self._conn.executemany("DELETE FROM task_blobs WHERE uid = ?", expired)
+            self._conn.execute("DELETE FROM transitions WHERE at < ?", (now - self.transitions_retention,))
+
+    # --- 写入（可在任意线程调用，立即返回）---
+    def add(self, task):
+        """记录新任务；已存在的任务不覆盖"""
+        self._pending.put(('add', task, task.state, time.time()))
+
+    def on_update(self, task, changes):
+        """TaskItem.update() 的监听函数"""
+        changes = {name: value for name, value in changes.items() if name in STATE_FIELDS}
+        if changes:
+            self._pending.put(('update', task.uid, changes, time.time()))
+
+    def discard(self, uids):
+        """任务被用户清除，不再恢复"""
+        at = time.time()
+        for uid in uids:
+            self._pending.put(('discard', uid, at))
+
+    def flush(self, timeout=None):
+        """等待此前提交的变更全部写入"""
+        done = threading.Event()
+        self._pending.put(('flush', done))
+        return done.wait(timeout)
+
+    # --- 读取 ---
+    def load_session(self, session_id):
+        """会话的全部任务（按创建顺序），用于刷新页面或服务重启后恢复任务列表"""
+        self.flush()
+        rows = self._query(
+            "SELECT task_type, descriptor, inputs, state FROM tasks WHERE session_id = ? AND status != 'CANCELLED' "
+            "ORDER BY created_at", (session_id,))
+        return self._restore_rows(rows)
+
+    def load_unfinished(self):
+        """重启前尚未完成的任务"""
+        self.flush()
+        rows = self._query(
+            f"SELECT task_type, descriptor, inputs, state FROM tasks WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) "
+            "ORDER BY created_at", ACTIVE_STATUSES)
+        return self._restore_rows(rows)
+
+    def remote_task_id(self, uid):
+        """未完成任务已发起的远端任务ID"""
+        self.flush()
+        rows = self._query(
+            f"SELECT api_task_id FROM tasks WHERE uid = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+            (uid, *ACTIVE_STATUSES))
+        return rows[0][0] if rows else None
+
+    def referenced_blobs(self, digests=None):
+        """digests 中仍被未取消的任务（输入或结果）引用的文件哈希；digests 为 None 时返回全部，清理图片文件时保留"""
+        self.flush()
+        if digests is None:
+            return {row[0] for row in self._query("SELECT DISTINCT digest FROM task_blobs", ())}
+        digests = list(digests)
+        referenced = set()
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            referenced.update(row[0] for row in self._query(
+                f"SELECT DISTINCT digest FROM task_blobs WHERE digest IN ({','.join('?' * len(chunk))})", chunk))
+        return referenced
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _restore_rows(self, rows):
+        tasks = []
+        for row in rows:
+            try:
+                tasks.append(self._restore(*row))
+            except (ValueError, TypeError, KeyError):
+                pass  # 无法解析的旧记录
+        return tasks
+
+    def _restore(self, task_type, descriptor, inputs, state):
+        task, missing = decode_task(task_type, json.loads(descriptor), json.loads(inputs), json.loads(state), self.blobs)
+        if missing and task.status != "SUCCESS":
+            # 输入文件已被清理，无法再上传；已成功的任务只是不能重新提交，结果照常显示
+            failed = {'status': "FAILED", 'error_message': INPUT_EXPIRED_ERROR, 'retry_at': None}
+            task.state = task.state._replace(**failed)
+            self._pending.put(('update', task.uid, failed, time.time()))
+        return task
+
+    def stats(self):
+        return {
+            'pending': self._pending.qsize(),
+            'batches': self.batches,
+            'writes': self.writes,
+            'errors': self.errors,
+        }
+
+    # --- 写入线程 ---
+    def _run(self):
+        while True:
+            try:
+                batch = [self._pending.get(timeout=self.prune_interval)]
+            except Empty:
+                batch = []
+            deadline = time.time() + self.flush_interval
+            while batch and len(batch) < self.batch_size and batch[-1][0] != 'flush':
+                try:
+                    batch.append(self._pending.get(timeout=max(0, deadline - time.time())))
+                except Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if time.monotonic() - self._pruned_at >= self.prune_interval:
+                self._pruned_at = time.monotonic()
+                try:
+                    self._prune()
+                except sqlite3.Error:
+                    self.errors += 1
+
+    def _write(self, batch):
+        adds = []
+        transitions = []
+        updates = {}      # uid -> 合并后的变更
+        indexed = set()   # 新增任务或结果有变化、需要更新 task_blobs 的任务
+        discards = []
+        waiters = []
+        for op in batch:
+            kind = op[0]
+            if kind == 'flush':
+                waiters.append(op[1])
+            elif kind == 'add':
+                _, task, state, at = op
+                adds.append(self._encode_task(task, state, at))
+                indexed.add(task.uid)
+            elif kind == 'update':
+                _, uid, changes, at = op
+                state = encode_state(changes)
+                transitions.append((uid, at, json.dumps(state, ensure_ascii=False, default=str)))
+                merged = updates.setdefault(uid, {'state': {}})
+                merged['state'].update(state)
+                merged['at'] = at
+                if 'result_data' in state or 'result_data_list' in state:
+                    indexed.add(uid)
+            elif kind == 'discard':
+                _, uid, at = op
+                discards.append((at, uid))
+
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO tasks (uid, session_id, task_type, status, api_task_id, descriptor, "
+                    "inputs, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", adds)
+                self._conn.executemany(
+                    "INSERT INTO transitions (uid, at, changes) SELECT ?, ?, ? "
+                    "WHERE EXISTS (SELECT 1 FROM tasks WHERE uid = ?)",
+                    [(uid, at, changes, uid) for uid, at, changes in transitions])
+                self._conn.executemany(
+                    "UPDATE tasks SET status = COALESCE(?, status), "
+                    "api_task_id = CASE WHEN ? THEN ? ELSE api_task_id END, "
+                    "state = json_patch(state, ?), updated_at = ? WHERE uid = ?",
+                    [(merged['state'].get('status'), 'api_task_id' in merged['state'],
+                      merged['state'].get('api_task_id'),
+                      json.dumps(merged['state'], ensure_ascii=False, default=str), merged['at'], uid)
+                     for uid, merged in updates.items()])
+                self._conn.executemany(
+                    "UPDATE tasks SET status = 'CANCELLED', updated_at = ? WHERE uid = ?", discards)
+                # 结果被替换时旧结果不再算作引用，先删后按当前记录重建
+                indexed.difference_update(uid for _, uid in discards)
+                self._conn.executemany("DELETE FROM task_blobs WHERE uid = ?", [(uid,) for uid in indexed])
+                self._conn.executemany(_INDEX_BLOBS.format(where="tasks.uid = ? AND status != 'CANCELLED'"),
+                                       [(uid, uid, uid) for uid in indexed])
+                self._conn.executemany("DELETE FROM task_blobs WHERE uid = ?", [(uid,) for _, uid in discards])
+            self.batches += 1
+            self.writes += len(batch) - len(waiters)
+        except (sqlite3.Error, OSError):
+            # 存储失败不影响任务本身的处理
+            self.errors += 1
+        finally:
+            for done in waiters:
+                done.set()
+
+    @staticmethod
+    def _encode_task(task, state, at):
+        data = encode_task(task, state)
+        return (task.uid, task.session_id, task.task_type, state.status, state.api_task_id,
+                json.dumps(data['record'], ensure_ascii=False), json.dumps(data['inputs']),
+                json.dumps(data['state'], ensure_ascii=False, default=str),
+                data['record']['created_at'], at)
+
+
+# --- JSON 编码（任务存储和共享队列共用）---
+def encode_task(task, state=None):
+    """任务的 JSON 形式 {task_type, record, inputs, state}，输入图片只记录文件哈希"""
+    record = task.record()
+    inputs = {}
+    for _, data_attr, _ in get_workflow(task)["inputs"]:
+        blob = record.pop(data_attr)
+        if blob is not None:
+            inputs[data_attr] = blob.digest
+    record['created_at'] = record['created_at'].timestamp()
+    return {'task_type': task.task_type, 'record': record, 'inputs': inputs,
+            'state': encode_state((state or task.state)._asdict())}
+
+def decode_task(task_type, record, inputs, state, blobs=None):
+    """encode_task 的逆操作，返回 (任务, 是否有输入文件已不存在)；输入文件不存在时对应属性为 None"""
+    blobs = blobs or get_blob_store()
+    record = dict(record, created_at=datetime.fromtimestamp(record['created_at']))
+    missing = False
+    for attr, digest in inputs.items():
+        record[attr] = blobs.ref(digest)
+        missing = missing or record[attr] is None
+    return TASK_TYPES[task_type](**record, state=decode_state(state)), missing
+
+def encode_state(changes):
+    """状态字段（全部或部分）的 JSON 形式，结果图片只记录文件哈希和字节数"""
+    state = dict(changes)
+    if state.get('result_data') is not None:
+        blob = state['result_data']
+        state['result_data'] = {'blob': blob.digest, 'size': blob.size}
+    if state.get('result_data_list'):
+        state['result_data_list'] = [
+            {'blob': item['blob'].digest, 'size': item['blob'].size,
+             'filename': item.get('filename'), 'url': item.get('url')}
+            for item in state['result_data_list']
+        ]
+    return state
+
+def decode_state(state):
+    """encode_state 的逆操作，返回 TaskState，忽略未知字段"""
+    values = {}
+    for name, value in state.items():
+        if name not in STATE_FIELDS:
+            continue
+        if name == 'result_data' and value:
+            value = BlobRef(value['blob'], value['size'])
+        elif name == 'result_data_list':
+            value = tuple({'blob': BlobRef(item['blob'], item['size']), 'filename': item['filename'],
+                           'url': item['url']} for item in value or ())
+        values[name] = value
+    return TaskState(**values)
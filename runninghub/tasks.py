@@ -0,0 +1,137 @@
+"""任务数据结构
+
+每个工作流一个任务类，只保存该工作流用到的字段（__slots__，没有实例 __dict__），
+输入图片只保存 BlobRef。处理状态集中在不可变的 TaskState 中：update() 生成新的 TaskState
+整体替换，task.state 本身就是一致的快照，可以直接交给其他线程、队列或任务存储。
+"""
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+# 需要在进程间同步的任务状态字段
+STATE_FIELDS = (
+    'status', 'progress', 'error_message', 'api_task_id', 'remote_status', 'cache_hit',
+    'start_time', 'elapsed_time', 'retry_count', 'timeout_count', 'result_data', 'result_data_list', 'retry_at',
+)
+
+TaskState = namedtuple("TaskState", STATE_FIELDS, defaults=(
+    "QUEUED",  # status
+    0,         # progress
+    None,      # error_message
+    None,      # api_task_id
+    None,      # remote_status: 最近一次查询到的远端状态
+    False,     # cache_hit: 结果来自缓存或同时提交的相同任务
+    None,      # start_time
+    None,      # elapsed_time
+    0,         # retry_count
+    0,         # timeout_count
+    None,      # result_data: 单结果工作流的 BlobRef
+    (),        # result_data_list: 多结果工作流的 ({'blob', 'filename', 'url'}, ...)
+    None,      # retry_at: 等待重试时重新排队的时间
+))
+
+# 状态变更监听（任务存储等），listener(task, changes) 在 update() 后调用
+_listeners = []
+
+def add_listener(listener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+class TaskItem:
+    """各工作流任务的公共部分"""
+    __slots__ = ('uid', 'task_id', 'session_id', 'created_at', 'lane', 'state', '__weakref__')
+    task_type = None
+    record_fields = ('uid', 'task_id', 'session_id', 'created_at', 'lane')  # 创建后不再变化的字段
+
+    def __init__(self, task_id, session_id, uid=None, created_at=None, lane="interactive", state=None):
+        self.uid = uid or uuid.uuid4().hex  # 全局唯一，task_id 只在会话内唯一
+        self.task_id = task_id
+        self.session_id = session_id
+        self.created_at = created_at or datetime.now()
+        self.lane = lane  # 排队通道：interactive / bulk（见 scheduler.py）
+        self.state = state or TaskState()
+
+    def update(self, **changes):
+        """更新任务状态，所有状态变更都经过这里"""
+        if 'result_data_list' in changes:
+            # 状态中保存为元组，先转换再比较，否则传入相同内容的列表也会被当作变更
+            changes['result_data_list'] = tuple(changes['result_data_list'])
+        changed = {name: value for name, value in changes.items() if getattr(self.state, name) != value}
+        if changed:
+            self.state = self.state._replace(**changed)
+            for listener in _listeners:
+                listener(self, changed)
+
+    def snapshot(self):
+        """当前状态快照"""
+        return self.state
+
+    def record(self):
+        """创建任务时确定的字段，用于持久化"""
+        return {name: getattr(self, name) for name in self.record_fields}
+
+    def reset_for_retry(self):
+        """重置为排队状态（用于重启失败任务）"""
+        self.update(status="QUEUED", retry_count=0, timeout_count=0, error_message=None, progress=0,
+                    api_task_id=None, remote_status=None, cache_hit=False, retry_at=None)
+
+
+# 状态字段只读，变更统一通过 update()
+for _name in STATE_FIELDS:
+    setattr(TaskItem, _name, property(lambda self, _name=_name: getattr(self.state, _name)))
+
+
+class _SingleImageTask(TaskItem):
+    __slots__ = ('file_data', 'file_name')
+    record_fields = TaskItem.record_fields + ('file_data', 'file_name')
+
+    def __init__(self, task_id, session_id, file_data, file_name, **kwargs):
+        super().__init__(task_id, session_id, **kwargs)
+        self.file_data = file_data
+        self.file_name = file_name
+
+
+class WatermarkTask(_SingleImageTask):
+    """去水印"""
+    __slots__ = ()
+    task_type = "watermark"
+
+
+class LightingTask(_SingleImageTask):
+    """溶图打光"""
+    __slots__ = ()
+    task_type = "lighting"
+
+
+class EnhanceTask(_SingleImageTask):
+    """图像优化"""
+    __slots__ = ('enhance_version',)
+    task_type = "enhance"
+    record_fields = _SingleImageTask.record_fields + ('enhance_version',)
+
+    def __init__(self, task_id, session_id, file_data, file_name, enhance_version='WAN 2.2', **kwargs):
+        super().__init__(task_id, session_id, file_data, file_name, **kwargs)
+        self.enhance_version = enhance_version  # 默认 WAN 2.2
+
+
+class PoseTask(TaskItem):
+    """姿态迁移"""
+    __slots__ = ('character_image_data', 'character_image_name', 'reference_image_data', 'reference_image_name')
+    task_type = "pose"
+    record_fields = TaskItem.record_fields + __slots__
+
+    def __init__(self, task_id, session_id, character_image_data, character_image_name,
+                 reference_image_data, reference_image_name, **kwargs):
+        super().__init__(task_id, session_id, **kwargs)
+        self.character_image_data = character_image_data
+        self.character_image_name = character_image_name
+        self.reference_image_data = reference_image_data
+        self.reference_image_name = reference_image_name
+
+
+TASK_TYPES = {cls.task_type: cls for cls in (WatermarkTask, LightingTask, PoseTask, EnhanceTask)}
@@ -0,0 +1,72 @@
+"""上传文件名缓存
+
+同一个 API Key 上传过的相同图片内容，在 UPLOAD_CACHE_TTL 内直接复用 /task/openapi/upload
+返回的 fileName，不再重复上传。实际上传的文件随工作流的预处理参数而不同（见 preprocess.py），
+因此键同时包含原图哈希和预处理参数。缓存保存在 SQLite 中，跨会话、跨重启共享；
+服务端拒绝已缓存的文件名时由调用方使其失效。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .config import UPLOAD_CACHE_PATH, UPLOAD_CACHE_TTL
+
+
+class UploadCache:
+    def __init__(self, path=UPLOAD_CACHE_PATH, ttl=UPLOAD_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads (key TEXT PRIMARY KEY, file_name TEXT NOT NULL, uploaded_at REAL NOT NULL)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(api_key, digest, options=None):
+        # 不直接保存 API Key；不预处理时键与原来相同
+        key = f"{api_key}:{digest}"
+        if options:
+            key += ":" + json.dumps(options, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, api_key, digest, options=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, uploaded_at FROM uploads WHERE key = ?",
+                (self._key(api_key, digest, options),)).fetchone()
+            if row and time.time() - row[1] < self.ttl:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, api_key, digest, file_name, options=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads (key, file_name, uploaded_at) VALUES (?, ?, ?)",
+                (self._key(api_key, digest, options), file_name, time.time()))
+            # 顺带清理过期记录
+            self._conn.execute("DELETE FROM uploads WHERE uploaded_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+    def invalidate(self, api_key, digest, options=None):
+        with self._lock:
+            self._conn.execute("DELETE FROM uploads WHERE key = ?", (self._key(api_key, digest, options),))
+            self._conn.commit()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,95 @@
+"""独立的任务 worker 进程
+
+    RH_REDIS_URL=redis://localhost:6379/0 python -m runninghub.worker --processes 4
+
+每个子进程运行一个 TaskEngine，从共享的 Redis 队列取任务执行，并通过状态快照把进度回写给页面。
+页面端配置 RH_EXTERNAL_WORKERS=1 后只负责提交任务和读取状态，Streamlit 重启、会话被回收都不会
+中断处理中的任务；worker 数量也可以独立于页面副本扩缩。
+
+子进程异常退出时由主进程重新拉起；收到 SIGTERM / Ctrl+C 时停止取新任务，处理中的任务交还队列。
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from .config import REDIS_URL, WORKER_PROCESSES, WORKER_SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger("runninghub.worker")
+
+STATS_INTERVAL = 60     # 子进程输出运行状态的间隔（秒）
+RESTART_DELAY = 5       # 子进程退出后重新拉起前的等待秒数
+
+
+def run_worker(index):
+    """子进程入口：运行任务引擎直到收到退出信号"""
+    from .engine import TaskEngine
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    engine = TaskEngine()
+    logger.info("worker-%s (pid %s) 已启动", index, os.getpid())
+    while not stop.wait(STATS_INTERVAL):
+        stats = engine.stats()
+        logger.info("worker-%s 处理中 %s，队列 %s", index, stats['in_flight'], stats['queue'])
+
+    logger.info("worker-%s 正在退出，交还处理中的任务", index)
+    try:
+        engine.shutdown()
+    except Exception as e:
+        logger.warning("worker-%s 退出时交还任务失败，等待租约超时后重新投递: %s", index, e)
+
+
+def _start(index):
+    process = multiprocessing.Process(target=run_worker, args=(index,), name=f"rh-worker-{index}")
+    process.start()
+    return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m runninghub.worker", description="RunningHub 任务 worker")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES, help="worker 进程数")
+    args = parser.parse_args(argv)
+
+    if not REDIS_URL:
+        parser.error("未配置 RH_REDIS_URL，worker 需要通过 Redis 队列与页面共享任务")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+    stopping = threading.Event()
+
+    def handle_stop(*_):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    processes = {i: _start(i) for i in range(args.processes)}
+    restart_at = {}
+    while not stopping.wait(1):
+        for i, process in processes.items():
+            if process.is_alive() or i in restart_at:
+                continue
+            logger.warning("worker-%s 已退出（exitcode=%s），%s 秒后重启", i, process.exitcode, RESTART_DELAY)
+            restart_at[i] = time.time() + RESTART_DELAY
+        for i, at in list(restart_at.items()):
+            if time.time() >= at:
+                del restart_at[i]
+                processes[i] = _start(i)
+
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()   # 子进程收到 SIGTERM 后交还任务再退出
+    for process in processes.values():
+        process.join(WORKER_SHUTDOWN_TIMEOUT + 30)
+        if process.is_alive():
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""各工作流的接口参数
+
+每个工作流描述：使用的 API Key / WebApp ID、节点模板、需要上传的图片
+（节点ID、任务上的数据属性、文件名属性）、上传前的预处理参数以及是否返回多个结果。
+"""
+import copy
+
+from .config import (
+    WATERMARK_API_KEY, WATERMARK_WEBAPP_ID, WATERMARK_NODE_INFO, WATERMARK_PREPROCESS,
+    LIGHTING_API_KEY, LIGHTING_WEBAPP_ID, LIGHTING_NODE_INFO, LIGHTING_PREPROCESS,
+    POSE_API_KEY, POSE_WEBAPP_ID, POSE_NODE_INFO, POSE_PREPROCESS,
+    ENHANCE_API_KEY, ENHANCE_WEBAPP_ID_V2_2, ENHANCE_NODE_INFO_V2_2,
+    ENHANCE_WEBAPP_ID_V2_1, ENHANCE_NODE_INFO_V2_1, ENHANCE_PREPROCESS,
+)
+
+WORKFLOWS = {
+    "watermark": {
+        "name": "去水印",
+        "api_key": WATERMARK_API_KEY,
+        "webapp_id": WATERMARK_WEBAPP_ID,
+        "node_info": WATERMARK_NODE_INFO,
+        "inputs": [("191", "file_data", "file_name")],
+        "preprocess": WATERMARK_PREPROCESS,
+        "instance_type": None,
+        "multi_output": False,
+    },
+    "lighting": {
+        "name": "溶图打光",
+        "api_key": LIGHTING_API_KEY,
+        "webapp_id": LIGHTING_WEBAPP_ID,
+        "node_info": LIGHTING_NODE_INFO,
+        "inputs": [("437", "file_data", "file_name")],
+        "preprocess": LIGHTING_PREPROCESS,
+        "instance_type": "plus",
+        "multi_output": False,
+    },
+    "pose": {
+        "name": "姿态迁移",
+        "api_key": POSE_API_KEY,
+        "webapp_id": POSE_WEBAPP_ID,
+        "node_info": POSE_NODE_INFO,
+        "inputs": [
+            ("245", "character_image_data", "character_image_name"),  # 角色图片
+            ("244", "reference_image_data", "reference_image_name"),  # 姿势参考图
+        ],
+        "preprocess": POSE_PREPROCESS,
+        "instance_type": None,
+        "multi_output": True,
+    },
+    "enhance:WAN 2.2": {
+        "name": "图像优化 WAN 2.2",
+        "api_key": ENHANCE_API_KEY,
+        "webapp_id": ENHANCE_WEBAPP_ID_V2_2,
+        "node_info": ENHANCE_NODE_INFO_V2_2,
+        "inputs": [("14", "file_data", "file_name")],
+        "preprocess": ENHANCE_PREPROCESS,
+        "instance_type": None,
+        "multi_output": False,
+    },
+    "enhance:WAN 2.1": {
+        "name": "图像优化 WAN 2.1",
+        "api_key": ENHANCE_API_KEY,
+        "webapp_id": ENHANCE_WEBAPP_ID_V2_1,
+        "node_info": ENHANCE_NODE_INFO_V2_1,
+        "inputs": [("38", "file_data", "file_name")],
+        "preprocess": ENHANCE_PREPROCESS,
+        "instance_type": None,
+        "multi_output": False,
+    },
+}
+
+def workflow_key(task):
+    """任务对应的工作流名称，图像优化按模型版本区分"""
+    if task.task_type == "enhance":
+        return "enhance:WAN 2.1" if task.enhance_version == "WAN 2.1" else "enhance:WAN 2.2"
+    return task.task_type
+
+def get_workflow(task):
+    return WORKFLOWS[workflow_key(task)]
+
+def missing_inputs(task):
+    """输入图片文件已不存在（任务从存储恢复时已被清理）的节点ID"""
+    return [node_id for node_id, data_attr, _ in get_workflow(task)["inputs"] if getattr(task, data_attr) is None]
+
+def build_node_info(spec, uploaded_files):
+    """用上传后的文件名填充节点模板，uploaded_files: {nodeId: fileName}"""
+    node_info_list = copy.deepcopy(spec["node_info"])
+    for node in node_info_list:
+        if node["nodeId"] in uploaded_files:
+            node["fieldValue"] = uploaded_files[node["nodeId"]]
+    return node_info_list
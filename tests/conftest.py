@@ -0,0 +1,83 @@
+"""测试公共设置：缓存目录放在临时目录，RunningHub 接口替换为进程内的假实现"""
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["RH_CACHE_DIR"] = tempfile.mkdtemp(prefix="rh-test-")
+os.environ.pop("RH_REDIS_URL", None)
+os.environ.pop("RH_EXTERNAL_WORKERS", None)
+
+import pytest  # noqa: E402
+
+
+class FakeRunningHub:
+    """记录上传内容；发起的远端任务第一次查询即成功，结果为固定字节"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.uploads = []   # (上传文件名, 文件内容)
+        self.runs = []      # (webappId, nodeInfoList)
+
+    def upload_file_with_retry(self, blob, file_name, api_key, max_retries=3):
+        with self._lock:
+            self.uploads.append((file_name, blob.read()))
+            return f"api/{len(self.uploads)}_{file_name}"
+
+    def run_task_with_retry(self, api_key, webapp_id, node_info_list, max_retries=3, instance_type=None):
+        with self._lock:
+            self.runs.append((webapp_id, node_info_list))
+            return f"remote-{next(self._ids)}"
+
+    def get_task_status(self, api_key, api_task_id):
+        return "SUCCESS"
+
+    def fetch_task_outputs(self, api_key, api_task_id, task_type="watermark"):
+        url = f"https://example.invalid/{api_task_id}.png"
+        return [url, url] if task_type == "pose" else url
+
+    def iter_result_image(self, url, chunk_size=0):
+        return iter([b"result:", url.encode("utf-8")])
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    from runninghub import engine, poller
+    fake = FakeRunningHub()
+    for module in (engine, poller):
+        for name in ("upload_file_with_retry", "run_task_with_retry", "get_task_status",
+                     "fetch_task_outputs", "iter_result_image"):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, getattr(fake, name))
+    return fake
+
+
+@pytest.fixture
+def engine(fake_api, tmp_path):
+    """使用进程内队列和独立数据库文件的引擎"""
+    from runninghub.engine import TaskEngine
+    from runninghub.result_cache import ResultCache
+    from runninghub.task_store import TaskStore
+    from runninghub.upload_cache import UploadCache
+    from runninghub.task_queue import InMemoryTaskQueue
+    store = TaskStore(path=str(tmp_path / "tasks.sqlite3"))
+    e = TaskEngine(queue=InMemoryTaskQueue(), store=store)
+    e.poller.interval = 0.05
+    e.result_cache = ResultCache(root=str(tmp_path / "results"), referenced=store.referenced_blobs)
+    e.upload_cache = UploadCache(path=str(tmp_path / "uploads.sqlite3"))
+    return e
+
+
+@pytest.fixture
+def wait_finished():
+    """wait_finished(tasks) 等待任务全部结束（成功或失败）"""
+    def wait(tasks, timeout=10):
+        deadline = time.monotonic() + timeout
+        while any(task.status not in ("SUCCESS", "FAILED") for task in tasks):
+            assert time.monotonic() < deadline, [task.status for task in tasks]
+            time.sleep(0.02)
+    return wait
@@ -0,0 +1,59 @@
+from runninghub.adaptive import CLOSED, HALF_OPEN, OPEN, AdaptiveWindow
+from runninghub.config import BREAKER_COOLDOWN, BREAKER_MIN_CALLS
+
+
+def _tripped_window():
+    window = AdaptiveWindow(5, 1, 20)
+    for i in range(BREAKER_MIN_CALLS):
+        window.record("error", float(i), holder=f"before-{i}")
+    assert window.breaker == OPEN
+    return window
+
+
+def test_success_grows_and_congestion_shrinks_window():
+    window = AdaptiveWindow(4, 1, 20)
+    for i in range(5):
+        window.record("success", float(i))
+    assert window.capacity(5.0) == 5
+    window.record("congestion", 100.0)
+    assert window.capacity(100.0) == 2
+
+
+def test_breaker_is_closed_only_by_the_probe():
+    window = _tripped_window()
+    now = BREAKER_MIN_CALLS + BREAKER_COOLDOWN
+    assert window.capacity(now) == 0 and window.breaker == HALF_OPEN
+
+    assert window.reserve_probe(now)
+    assert not window.reserve_probe(now)
+    window.assign_probe("probe")
+    # 熔断前放行、半开期间才返回的结果不影响熔断器
+    window.record("success", now + 1, holder="before-0")
+    window.record("error", now + 1, holder="before-1")
+    assert window.breaker == HALF_OPEN
+
+    window.record("success", now + 2, holder="probe")
+    assert window.breaker == CLOSED and window.capacity(now + 2) > 0
+
+
+def test_failed_probe_trips_again():
+    window = _tripped_window()
+    now = BREAKER_MIN_CALLS + BREAKER_COOLDOWN
+    assert window.reserve_probe(now)
+    window.assign_probe("probe")
+    window.record("congestion", now + 1, holder="probe")
+    assert window.breaker == OPEN and window.trips == 2
+
+
+def test_unused_probe_can_be_reserved_again():
+    window = _tripped_window()
+    now = BREAKER_MIN_CALLS + BREAKER_COOLDOWN
+    assert window.reserve_probe(now)
+    window.cancel_probe()
+    assert window.reserve_probe(now)
+    window.assign_probe("first")
+    # 试探任务一直没有结果时，冷却时间后可以再放行一个，之前的试探任务不再算数
+    assert window.reserve_probe(now + BREAKER_COOLDOWN)
+    window.assign_probe("second")
+    window.record("success", now + BREAKER_COOLDOWN + 1, holder="first")
+    assert window.breaker == HALF_OPEN
@@ -0,0 +1,18 @@
+from runninghub.blob_store import get_blob_store
+from runninghub.tasks import WatermarkTask
+
+
+def test_result_cache_write_error_does_not_fail_task(engine, fake_api, wait_finished, monkeypatch):
+    def disk_full(key, results):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(engine.result_cache, "put", disk_full)
+    blob = get_blob_store().put(b"same input")
+    # 第二个任务输入相同，等待第一个任务的远端结果
+    tasks = [WatermarkTask(1, "s", blob, "a.png"), WatermarkTask(2, "s", blob, "a.png")]
+    for task in tasks:
+        engine.submit(task)
+    wait_finished(tasks)
+
+    assert [task.status for task in tasks] == ["SUCCESS", "SUCCESS"]
+    assert all(task.result_data is not None for task in tasks)
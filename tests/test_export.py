@@ -0,0 +1,35 @@
+import io
+import os
+import zipfile
+
+from runninghub.blob_store import get_blob_store
+from runninghub.export import MISSING_MANIFEST, export_zip
+from runninghub.tasks import PoseTask, WatermarkTask
+
+
+def test_missing_results_are_skipped_and_listed():
+    blobs = get_blob_store()
+    kept = WatermarkTask(1, "s", blobs.put(b"input 1"), "a.png")
+    kept.update(status="SUCCESS", result_data=blobs.put(b"kept result"))
+    pruned = PoseTask(2, "s", blobs.put(b"character"), "c.png", blobs.put(b"reference"), "r.png")
+    gone = blobs.put(b"pruned pose result")
+    present = blobs.put(b"remaining pose result")
+    pruned.update(status="SUCCESS", result_data_list=[
+        {'blob': gone, 'filename': "p1.png", 'url': "u1"},
+        {'blob': present, 'filename': "p2.png", 'url': "u2"},
+    ])
+    os.remove(blobs.path(gone.digest))
+
+    with export_zip([kept, pruned]) as archive, zipfile.ZipFile(io.BytesIO(archive.read())) as zf:
+        assert sorted(zf.namelist()) == sorted(["001_watermark_removed_a.png", "002_p2.png", MISSING_MANIFEST])
+        assert zf.read("001_watermark_removed_a.png") == b"kept result"
+        assert zf.read("002_p2.png") == b"remaining pose result"
+        assert "002_p1.png" in zf.read(MISSING_MANIFEST).decode()
+
+
+def test_no_manifest_when_nothing_is_missing():
+    task = WatermarkTask(1, "s", get_blob_store().put(b"input 2"), "b.png")
+    task.update(status="SUCCESS", result_data=get_blob_store().put(b"result 2"))
+
+    with export_zip([task]) as archive, zipfile.ZipFile(io.BytesIO(archive.read())) as zf:
+        assert zf.namelist() == ["001_watermark_removed_b.png"]
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from runninghub.limiter import LocalLimiter, RedisLimiter
+from runninghub.scheduler import Ticket
+
+
+def _limiter(kind, capacity):
+    if kind == "local":
+        limiter = LocalLimiter(capacity=capacity, max_capacity=capacity)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        limiter = RedisLimiter(fakeredis.FakeRedis(), capacity=capacity, max_capacity=capacity,
+                               namespace="test", poll_interval=0.01)
+    limiter.controller.enabled = False  # 名额固定为 capacity，不受自适应窗口影响
+    return limiter
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_permits_are_limited_per_api_key(kind):
+    limiter = _limiter(kind, 2)
+    running = []
+    peak = []
+
+    async def job(api_key, n):
+        async with limiter.permit(api_key, "s", f"{api_key}-{n}"):
+            running.append(api_key)
+            peak.append(running.count("k1"))
+            await asyncio.sleep(0.02)
+            running.remove(api_key)
+
+    async def main():
+        await asyncio.gather(*(job("k1", n) for n in range(6)), job("k2", 0), job("k2", 1))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+
+
+@pytest.mark.parametrize("kind", ["local", "redis"])
+def test_waiters_are_granted_in_ticket_order(kind):
+    limiter = _limiter(kind, 1)
+    order = []
+
+    async def job(holder, ticket, hold=0.0):
+        async with limiter.permit("k", ticket.flow, holder, ticket):
+            order.append(holder)
+            await asyncio.sleep(hold)
+
+    async def main():
+        first = asyncio.create_task(job("first", Ticket("bulk", "batch", 1, 1.0), hold=0.05))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(job(f"bulk{i}", Ticket("bulk", "batch", 1, 1.0))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        waiters.append(asyncio.create_task(job("page", Ticket("interactive", "page", 8, 1.0))))
+        await asyncio.gather(first, *waiters)
+
+    asyncio.run(main())
+    assert order[:2] == ["first", "page"]
+
+
+def test_cancelled_waiter_does_not_leak_a_permit():
+    limiter = _limiter("local", 1)
+
+    async def main():
+        async with limiter.permit("k", "s", "holder"):
+            waiter = asyncio.create_task(limiter.acquire("k", "s", "waiter", Ticket("bulk", "s", 1, 1.0)))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        async with limiter.permit("k", "s", "next"):
+            return [h['holder'] for usage in limiter.snapshot().values() for h in usage['holders']]
+
+    assert asyncio.run(main()) == ["next"]
+
+
+def test_only_the_probe_closes_the_breaker(monkeypatch):
+    from runninghub import adaptive
+    monkeypatch.setattr(adaptive, "BREAKER_COOLDOWN", 0.1)
+    limiter = LocalLimiter(capacity=2, max_capacity=2)
+    ticket = Ticket("bulk", "s", 1, 1.0)
+
+    async def main():
+        await limiter.acquire("k", "s", "before", ticket)
+        for _ in range(adaptive.BREAKER_MIN_CALLS):
+            limiter.record("k", "error", "before")
+        assert limiter.controller.breaker("k") == adaptive.OPEN
+
+        waiters = [asyncio.create_task(limiter.acquire("k", "s", f"w{i}", ticket)) for i in range(3)]
+        await asyncio.sleep(0.2)
+        # 半开：只放行一个试探任务
+        assert [w.done() for w in waiters] == [True, False, False]
+
+        limiter.record("k", "success", "before")
+        await asyncio.sleep(0)
+        assert limiter.controller.breaker("k") == adaptive.HALF_OPEN
+        assert [w.done() for w in waiters] == [True, False, False]
+
+        limiter.record("k", "success", "w0")
+        await asyncio.sleep(0)
+        assert limiter.controller.breaker("k") == adaptive.CLOSED
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+from runninghub import poller as poller_module
+from runninghub.poller import StatusPoller
+
+
+async def _io(func, *args):
+    return func(*args)
+
+
+def test_latency_recorded_from_remote_submit_time(monkeypatch):
+    monkeypatch.setattr(poller_module, "get_task_status", lambda api_key, api_task_id: "SUCCESS")
+
+    async def main():
+        poller = StatusPoller(_io, interval=0.01)
+        submitted_at = time.time() - 30
+        await poller.watch("k", "fresh", workflow="watermark", submitted_at=submitted_at)
+        # 重启后恢复等待：不知道发起时间，刚登记就完成的耗时不能计入历史
+        await poller.watch("k", "resumed", workflow="watermark")
+        return poller.history
+
+    history = asyncio.run(main())
+    samples = list(history._samples["watermark"])
+    assert len(samples) == 1 and samples[0] >= 30
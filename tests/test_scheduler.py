@@ -0,0 +1,51 @@
+from runninghub.scheduler import FairScheduler, Ticket
+
+
+def _ticket(lane, flow, weight=1, cost=1.0):
+    return Ticket(lane, flow, weight, cost)
+
+
+def test_same_flow_is_first_come_first_served():
+    scheduler = FairScheduler()
+    for i in range(5):
+        scheduler.push(i, _ticket("bulk", "a"))
+    assert [scheduler.pop()[0] for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert scheduler.pop() is None
+
+
+def test_flows_share_by_weight():
+    scheduler = FairScheduler()
+    for i in range(40):
+        scheduler.push(("bulk", i), _ticket("bulk", "batch", weight=1))
+        scheduler.push(("interactive", i), _ticket("interactive", "page", weight=8))
+    lanes = [scheduler.pop()[0][0] for _ in range(18)]
+    assert lanes.count("interactive") == 16 and lanes.count("bulk") == 2
+
+
+def test_late_flow_starts_at_current_virtual_time():
+    scheduler = FairScheduler()
+    for i in range(100):
+        scheduler.push(("batch", i), _ticket("bulk", "batch"))
+    scheduler.pop()
+    scheduler.push("single", _ticket("bulk", "other"))
+    # 新的流不排在整批任务之后
+    assert "single" in [scheduler.pop()[0] for _ in range(2)]
+
+
+def test_requeue_with_tag_keeps_position():
+    scheduler = FairScheduler()
+    for i in range(3):
+        scheduler.push(i, _ticket("bulk", "a"))
+    item, tag = scheduler.pop()
+    scheduler.push(item, _ticket("bulk", "a"), tag)
+    assert scheduler.pop()[0] == item
+
+
+def test_remove_and_waiting_counts():
+    scheduler = FairScheduler()
+    scheduler.push("a", _ticket("bulk", "x"))
+    scheduler.push("b", _ticket("interactive", "y"))
+    assert scheduler.waiting() == {"interactive": 1, "bulk": 1}
+    assert scheduler.remove("a") and not scheduler.remove("a")
+    assert scheduler.waiting() == {"interactive": 1, "bulk": 0}
+    assert scheduler.pop()[0] == "b" and scheduler.pop() is None
@@ -0,0 +1,205 @@
+import json
+import pickle
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis 执行 Lua 脚本需要
+
+from runninghub.blob_store import get_blob_store  # noqa: E402
+from runninghub.task_queue import InMemoryTaskQueue, RedisTaskQueue  # noqa: E402
+from runninghub.tasks import EnhanceTask, PoseTask, TaskState, WatermarkTask  # noqa: E402
+
+LEASE = 0.1
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def redis_queue(client):
+    return RedisTaskQueue(client, namespace="test", visibility_timeout=LEASE, max_deliveries=2)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def queue(request, client):
+    """两种实现的行为应一致"""
+    if request.param == "memory":
+        return InMemoryTaskQueue(visibility_timeout=LEASE, max_deliveries=2)
+    return RedisTaskQueue(client, namespace="test", visibility_timeout=LEASE, max_deliveries=2)
+
+
+def _task(task_id=1, session_id="s", **kwargs):
+    return WatermarkTask(task_id, session_id, get_blob_store().put(b"input %d" % task_id), "a.png", **kwargs)
+
+
+def test_claim_returns_tasks_in_submission_order_within_a_flow(queue):
+    tasks = [_task(i) for i in range(3)]
+    for task in tasks:
+        queue.put(task)
+    claimed = [queue.claim() for _ in range(3)]
+    assert [uid for uid, _, _ in claimed] == [task.uid for task in tasks]
+    assert [deliveries for _, _, deliveries in claimed] == [1, 1, 1]
+    assert queue.claim() is None
+
+
+def test_interactive_task_overtakes_bulk_backlog(queue):
+    bulk = [_task(i, session_id="batch", lane="bulk") for i in range(20)]
+    for task in bulk:
+        queue.put(task)
+    assert queue.claim()[0] == bulk[0].uid
+    single = _task(100, session_id="page")
+    queue.put(single)
+    assert queue.claim()[0] == single.uid
+
+
+def test_expired_lease_is_redelivered(queue):
+    task = _task()
+    queue.put(task)
+    queue.claim()
+    assert queue.claim() is None
+    assert queue.extend(task.uid)
+
+    time.sleep(LEASE * 1.5)
+    assert queue.requeue_expired() == []
+    assert not queue.extend(task.uid)
+    uid, _, deliveries = queue.claim()
+    assert (uid, deliveries) == (task.uid, 2)
+
+
+def test_release_requeues_without_counting_a_delivery(queue):
+    task = _task()
+    queue.put(task)
+    queue.claim()
+    queue.release(task.uid)
+    assert queue.claim()[2] == 1
+
+
+def test_retry_waits_for_delay_and_keeps_retry_count(queue):
+    task = _task()
+    queue.put(task)
+    _, claimed, _ = queue.claim()
+    claimed.update(retry_count=1, retry_at=time.time() + 0.2)
+    queue.retry(claimed, 0.2)
+
+    assert queue.claim() is None
+    assert queue.stats()['delayed'] == 1
+    assert not queue.is_cancelled(task.uid)
+    time.sleep(0.25)
+    uid, retried, deliveries = queue.claim()
+    assert uid == task.uid and retried.retry_count == 1
+    assert deliveries == 1
+
+
+def test_cancel_of_claimed_task(queue):
+    task = _task()
+    queue.put(task)
+    queue.claim()
+    queue.cancel(task.uid)
+    # 处理方通过心跳发现任务已撤销，停止处理并确认
+    assert queue.is_cancelled(task.uid)
+
+    # 处理方没有确认就中断：租约到期后重新投递时不再交给任何人，也不进入死信队列
+    time.sleep(LEASE * 1.5)
+    assert queue.requeue_expired() == []
+    assert queue.claim() is None
+    assert queue.stats()['dead'] == 0
+
+
+def test_cancel_of_task_waiting_to_retry(queue):
+    task = _task()
+    queue.put(task)
+    _, claimed, _ = queue.claim()
+    queue.retry(claimed, 0.05)
+    queue.cancel(task.uid)
+    time.sleep(0.1)
+    assert queue.claim() is None
+    assert queue.stats()['delayed'] == 0
+
+
+def test_dead_letter_after_max_deliveries(queue):
+    task = _task()
+    queue.put(task)
+    for _ in range(2):
+        queue.claim()
+        time.sleep(LEASE * 1.5)
+        dead = queue.requeue_expired()
+    assert dead == [task.uid]
+    assert queue.claim() is None
+    assert queue.is_cancelled(task.uid)
+    stats = queue.stats()
+    assert (stats['ready'], stats['leased'], stats['dead']) == (0, 0, 1)
+
+
+def test_dead_letter_cleans_redis_bookkeeping(redis_queue, client):
+    task = _task()
+    redis_queue.put(task)
+    for _ in range(2):
+        redis_queue.claim()
+        time.sleep(LEASE * 1.5)
+        redis_queue.requeue_expired()
+    assert client.lrange("test:dead", 0, -1) == [task.uid.encode()]
+    assert not client.hexists("test:deliveries", task.uid)
+    assert not client.hexists("test:meta", task.uid)
+    assert not client.exists("test:payload:" + task.uid)
+    assert 0 < client.ttl("test:dead:payload:" + task.uid)
+
+
+def test_ack_removes_everything(redis_queue, client):
+    task = _task()
+    redis_queue.put(task)
+    redis_queue.claim()
+    redis_queue.ack(task.uid)
+    assert redis_queue.is_cancelled(task.uid)
+    assert not client.hexists("test:deliveries", task.uid)
+    assert not client.hexists("test:meta", task.uid)
+    assert client.zcard("test:leased") == 0
+
+
+def test_payloads_and_states_are_json(redis_queue, client):
+    blobs = get_blob_store()
+    task = PoseTask(1, "s", blobs.put(b"character"), "c.png", blobs.put(b"reference"), "r.png", lane="bulk")
+    redis_queue.put(task)
+    payload = json.loads(client.get("test:payload:" + task.uid))
+    assert payload['task_type'] == "pose"
+
+    uid, claimed, deliveries = redis_queue.claim()
+    assert (uid, deliveries) == (task.uid, 1)
+    assert type(claimed) is PoseTask and claimed.record() == task.record()
+
+    result = blobs.put(b"result")
+    state = claimed.state._replace(status="SUCCESS", result_data_list=({'blob': result, 'filename': "p.png",
+                                                                        'url': "u"},))
+    redis_queue.publish_state(uid, state)
+    json.loads(client.get("test:state:" + uid))
+    assert redis_queue.fetch_states([uid]) == {uid: state}
+
+
+def test_enhance_version_survives_round_trip(redis_queue):
+    task = EnhanceTask(1, "s", get_blob_store().put(b"photo"), "p.png", enhance_version="WAN 2.1")
+    redis_queue.put(task)
+    assert redis_queue.claim()[1].enhance_version == "WAN 2.1"
+
+
+def _executed():
+    raise AssertionError("pickle payload was unpickled")
+
+
+class _Exploit:
+    def __reduce__(self):
+        return _executed, ()
+
+
+def test_pickled_payload_is_never_unpickled(redis_queue, client):
+    task = _task()
+    redis_queue.put(task)
+    client.set("test:payload:" + task.uid, pickle.dumps(_Exploit()))
+    client.set("test:state:other", pickle.dumps(_Exploit()))
+
+    assert redis_queue.claim() is None
+    assert redis_queue.fetch_states([task.uid])[task.uid] == TaskState(
+        status="FAILED", error_message="任务描述无法解析，请重新提交")
+    assert redis_queue.fetch_states(["other"]) == {}
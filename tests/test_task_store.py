@@ -0,0 +1,129 @@
+import sqlite3
+import time
+
+import pytest
+
+from runninghub.blob_store import get_blob_store
+from runninghub.task_store import TaskStore
+from runninghub.tasks import PoseTask, WatermarkTask, add_listener, remove_listener
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(path=str(tmp_path / "tasks.sqlite3"))
+    add_listener(store.on_update)
+    yield store
+    remove_listener(store.on_update)
+
+
+def test_referenced_blobs_tracks_inputs_and_current_results(store):
+    blobs = get_blob_store()
+    task = WatermarkTask(1, "s", blobs.put(b"input"), "a.png")
+    store.add(task)
+    first = blobs.put(b"first result")
+    task.update(status="SUCCESS", result_data=first)
+    store.flush()
+    assert store.referenced_blobs([task.file_data.digest, first.digest]) == {task.file_data.digest, first.digest}
+
+    second = blobs.put(b"second result")
+    task.update(result_data=second)
+    store.flush()
+    assert store.referenced_blobs([first.digest, second.digest]) == {second.digest}
+
+
+def test_cancelled_tasks_release_their_blobs(store):
+    blobs = get_blob_store()
+    task = PoseTask(1, "s", blobs.put(b"character"), "c.png", blobs.put(b"reference"), "r.png")
+    store.add(task)
+    output = blobs.put(b"pose result")
+    task.update(result_data_list=[{'blob': output, 'filename': "p.png", 'url': "u"}])
+    store.flush()
+    digests = [task.character_image_data.digest, task.reference_image_data.digest, output.digest]
+    assert store.referenced_blobs(digests) == set(digests)
+
+    store.discard([task.uid])
+    store.flush()
+    assert store.referenced_blobs(digests) == set()
+
+
+def test_blob_index_is_built_for_existing_databases(tmp_path):
+    path = str(tmp_path / "tasks.sqlite3")
+    store = TaskStore(path=path)
+    task = WatermarkTask(1, "s", get_blob_store().put(b"old input"), "a.png")
+    store.add(task)
+    store.flush()
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE task_blobs")
+    conn.commit()
+    conn.close()
+
+    assert TaskStore(path=path).referenced_blobs([task.file_data.digest]) == {task.file_data.digest}
+
+
+def test_transitions_are_pruned_periodically(tmp_path):
+    store = TaskStore(path=str(tmp_path / "tasks.sqlite3"), transitions_retention=0.2, prune_interval=0.2)
+    add_listener(store.on_update)
+    try:
+        task = WatermarkTask(1, "s", get_blob_store().put(b"input"), "a.png")
+        store.add(task)
+        for progress in range(1, 6):
+            task.update(progress=progress)
+        store.flush()
+        assert store._query("SELECT COUNT(*) FROM transitions", ())[0][0] == 5
+
+        time.sleep(1)
+        store.flush()
+        assert store._query("SELECT COUNT(*) FROM transitions", ())[0][0] == 0
+    finally:
+        remove_listener(store.on_update)
+
+
+def test_prune_keeps_results_of_finished_tasks(tmp_path):
+    from runninghub.blob_store import BlobStore
+    blobs = BlobStore(root=str(tmp_path / "blobs"))
+    store = TaskStore(path=str(tmp_path / "tasks.sqlite3"), blobs=blobs)
+    add_listener(store.on_update)
+    try:
+        task = WatermarkTask(1, "s", blobs.put(b"input"), "a.png")
+        store.add(task)
+        result = blobs.put(b"result")
+        task.update(status="SUCCESS", result_data=result)
+        orphan = blobs.put(b"orphan")
+
+        blobs.prune(retention=0, max_bytes=0, keep=store.referenced_blobs(), min_age=0)
+        assert blobs.exists(task.file_data.digest) and blobs.exists(result.digest)
+        assert not blobs.exists(orphan.digest)
+    finally:
+        remove_listener(store.on_update)
+
+
+def test_restore_fails_unfinished_task_whose_input_was_pruned(tmp_path):
+    from runninghub.blob_store import BlobStore
+    from runninghub.task_store import INPUT_EXPIRED_ERROR
+    blobs = BlobStore(root=str(tmp_path / "blobs"))
+    path = str(tmp_path / "tasks.sqlite3")
+    store = TaskStore(path=path, blobs=blobs)
+    queued = WatermarkTask(1, "s", blobs.put(b"queued input"), "a.png")
+    done = WatermarkTask(2, "s", blobs.put(b"done input"), "b.png", state=queued.state._replace(
+        status="SUCCESS", result_data=blobs.put(b"done result")))
+    store.add(queued)
+    store.add(done)
+    store.flush()
+    blobs.discard(queued.file_data.digest)
+    blobs.discard(done.file_data.digest)
+
+    restored = {task.task_id: task for task in store.load_session("s")}
+    assert restored[1].status == "FAILED" and restored[1].error_message == INPUT_EXPIRED_ERROR
+    assert restored[1].file_data is None
+    assert restored[2].status == "SUCCESS"
+    # 失败状态已写回存储，重启后不再当作未完成任务恢复
+    store.flush()
+    assert TaskStore(path=path, blobs=blobs).load_unfinished() == []
+
+
+def test_resubmitting_task_without_input_fails_it(engine):
+    from runninghub.task_store import INPUT_EXPIRED_ERROR
+    task = WatermarkTask(1, "s", None, "a.png")
+    engine.submit(task)
+    assert task.status == "FAILED" and task.error_message == INPUT_EXPIRED_ERROR
+    assert engine.queue.stats()['ready'] == 0
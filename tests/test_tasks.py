@@ -0,0 +1,18 @@
+from runninghub.blob_store import get_blob_store
+from runninghub.tasks import PoseTask, add_listener, remove_listener
+
+
+def test_unchanged_result_list_is_not_an_update():
+    blobs = get_blob_store()
+    task = PoseTask(1, "s", blobs.put(b"character 2"), "c.png", blobs.put(b"reference 2"), "r.png")
+    results = [{'blob': blobs.put(b"pose output"), 'filename': "p.png", 'url': "u"}]
+    task.update(result_data_list=results)
+    seen = []
+    listener = lambda task, changed: seen.append(changed)
+    add_listener(listener)
+    try:
+        task.update(result_data_list=list(results))
+    finally:
+        remove_listener(listener)
+    assert seen == []
+    assert task.result_data_list == tuple(results)
@@ -0,0 +1,44 @@
+import io
+
+from PIL import Image
+
+from runninghub.blob_store import get_blob_store
+from runninghub.tasks import EnhanceTask, LightingTask, WatermarkTask
+
+
+def _wide_image():
+    """最长边 5000：超过去水印的 max_edge（4096），不超过图像优化的 max_edge（6144）"""
+    out = io.BytesIO()
+    Image.new("RGB", (5000, 64), (200, 120, 40)).save(out, format="JPEG")
+    return get_blob_store().put(out.getvalue())
+
+
+def test_same_image_uploaded_once_per_preprocess_options(engine, fake_api, wait_finished):
+    blob = _wide_image()
+    watermark = WatermarkTask(1, "s", blob, "wide.jpg")
+    engine.submit(watermark)
+    wait_finished([watermark])
+
+    enhance = EnhanceTask(2, "s", blob, "wide.jpg")
+    engine.submit(enhance)
+    wait_finished([enhance])
+
+    assert watermark.status == enhance.status == "SUCCESS"
+    assert len(fake_api.uploads) == 2
+    (_, downscaled), (_, original) = fake_api.uploads
+    with Image.open(io.BytesIO(downscaled)) as img:
+        assert max(img.size) == 4096
+    assert original == blob.read()
+
+
+def test_same_preprocess_options_reuse_upload(engine, fake_api, wait_finished):
+    blob = _wide_image()
+    # 溶图打光与去水印的预处理参数相同
+    tasks = [WatermarkTask(1, "s", blob, "wide.jpg"), LightingTask(2, "s", blob, "wide.jpg")]
+    for task in tasks:
+        engine.submit(task)
+        wait_finished([task])
+
+    assert [task.status for task in tasks] == ["SUCCESS", "SUCCESS"]
+    assert len(fake_api.uploads) == 1
+    assert engine.upload_cache.stats()['hits'] == 1